@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# Project:      CAM Analyzer
+# File:         analysis_worker.py
+# Author:       TFC-CRM
+# Created:      2025-12-12
+# Copyright:    (c) 2025 TFC-CRM. All rights reserved.
+# License:      Proprietary / Confidential
+# Description:  Runs an analysis in a child process.
+#               Progress streams back over a pipe; result arrays are handed
+#               over through one shared memory block and mapped zero-copy
+#               (cached results: through their memory-mapped cache entry).
+# ------------------------------------------------------------------------------
+
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+from backend import GCodeAnalyzer, SegmentStats, FeedDensity, DistanceIndex, ProgressReporter, StageProfile
+from result_cache import ResultCache
+
+SHM_ALIGN = 64
+JOIN_TIMEOUT = 2.0
+
+# Group names inside the shared block
+GROUP_DATA = "data"
+GROUP_INDEX = "index"
+
+
+# ------------------------------------------------------------------------------
+# Shared memory layout
+# ------------------------------------------------------------------------------
+def publish_arrays(groups: dict):
+    """
+    Copies {group: {name: ndarray}} into one new SharedMemory block.
+    Returns (shm, layout); layout is [(group, name, dtype str, shape, offset)].
+    """
+    layout, offset = [], 0
+    for group, arrays in groups.items():
+        for name, arr in arrays.items():
+            offset = -(-offset // SHM_ALIGN) * SHM_ALIGN
+            layout.append((group, name, arr.dtype.str, arr.shape, offset))
+            offset += arr.nbytes
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for group, name, dtype, shape, off in layout:
+        dst = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=off)
+        np.copyto(dst, groups[group][name], casting='no')
+        del dst
+    return shm, layout
+
+
+class SharedResult:
+    """
+    Read-only views of a published block, owned by the receiving process.
+    release() unmaps and removes the block once the views are no longer used.
+    """
+
+    def __init__(self, shm_name: str, layout):
+        self.shm = shared_memory.SharedMemory(name=shm_name)
+        self.groups = {}
+        for group, name, dtype, shape, off in layout:
+            arr = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=off)
+            arr.flags.writeable = False
+            self.groups.setdefault(group, {})[name] = arr
+
+    def release(self):
+        if self.shm is None: return
+        self.groups = {}
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # a view is still referenced; the mapping goes with it
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = None
+
+
+# ------------------------------------------------------------------------------
+# Child process
+# ------------------------------------------------------------------------------
+class _Control:
+    """
+    progress_callback for the engine inside the child, called at most once
+    per PROGRESS_INTERVAL by the ProgressReporter that also watches stop.
+    resume is set while running; pausing blocks on it instead of polling.
+    stop also sets resume so a paused worker wakes up and cancels.
+    """
+
+    def __init__(self, conn, resume, stop):
+        self.conn = conn
+        self.resume = resume
+        self.stop = stop
+
+    def __call__(self, pct, msg):
+        self.conn.send(("PROGRESS", (pct, msg)))
+        if not self.resume.is_set():
+            self.conn.send(("STATUS", "Paused..."))
+            self.resume.wait()
+        return self.stop.is_set()
+
+    def status(self, text):
+        self.conn.send(("STATUS", text))
+
+
+def _run(conn, file_path, intervals, compact, workers, cache_dir, cache_max_bytes, resume, stop):
+    control = _Control(conn, resume, stop)
+    progress = ProgressReporter(control, token=stop)
+    engine = GCodeAnalyzer()
+    engine.compact_results = compact
+    settings = engine.settings_key()
+    cache = ResultCache(cache_dir, cache_max_bytes)
+    bins = [s for s, _ in intervals] + [intervals[-1][1]]
+
+    profile = StageProfile()
+    cache_key = digest = None
+    try:
+        with profile.stage('cache_load'):
+            digest = cache.file_digest(file_path)
+            data_dict = cache.load(file_path, settings, digest)
+        if data_dict is not None:
+            cache_key = cache.entry_key(digest, settings)
+            # The stored profile is the one of the original parse
+            data_dict['profile'] = profile.to_dict()
+            control.status("Loaded from cache")
+    except OSError:
+        data_dict = None
+
+    if data_dict is None:
+        data_dict = engine.parse_file(file_path, progress, workers=workers)
+        if data_dict is None or stop.is_set():
+            conn.send(("CANCELLED", None))
+            return
+        try:
+            control.status("Saving to cache...")
+            # Stored arrays reach the parent through the entry, like a cache hit
+            digest = digest or cache.file_digest(file_path)
+            if cache.store(file_path, data_dict, settings, digest):
+                cache_key = cache.entry_key(digest, settings)
+        except OSError:
+            pass  # caching is best effort
+
+    # One sort here makes every later re-binning a searchsorted
+    dist_index = engine.build_distance_index(data_dict, progress)
+    if dist_index is None:
+        conn.send(("CANCELLED", None))
+        return
+    try:
+        cached = cache.load_stats(file_path, bins, settings)
+        stats = SegmentStats.from_dict(cached) if cached else None
+    except (OSError, KeyError, TypeError, ValueError):
+        stats = None
+    if stats is None:
+        stats = engine.compute_stats(data_dict, intervals, index=dist_index)
+        try:
+            cache.store_stats(file_path, bins, stats.to_dict(), settings)
+        except OSError:
+            pass
+
+    try:
+        cached = cache.load_density(file_path, settings)
+        density = FeedDensity.from_dict(cached) if cached else None
+    except (OSError, KeyError, TypeError, ValueError):
+        density = None
+    if density is None:
+        density = engine.compute_density(data_dict)
+        try:
+            cache.store_density(file_path, density.to_dict(), settings)
+        except OSError:
+            pass
+
+    if stop.is_set():
+        conn.send(("CANCELLED", None))
+        return
+
+    arrays = {k: v for k, v in data_dict.items() if isinstance(v, np.ndarray)}
+    values = {k: v for k, v in data_dict.items() if not isinstance(v, np.ndarray)}
+    # Cached (or just stored) arrays are already files: the parent maps the
+    # same entry instead of receiving a full-size copy
+    cached = {'key': cache_key, 'arrays': list(arrays)} if cache_key else None
+    if cached:
+        arrays = {}
+    index_arrays = {'sorted_dists': dist_index.sorted_dists, 'feed_prefix': dist_index.feed_prefix}
+    shm, layout = publish_arrays({GROUP_DATA: arrays, GROUP_INDEX: index_arrays})
+    del arrays, data_dict, dist_index
+
+    # The receiver registers the block when it attaches and unlinks it on release
+    resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        conn.send(("DONE", {'shm': shm.name, 'layout': layout, 'cached': cached, 'values': values,
+                            'stats': stats.to_dict(), 'density': density.to_dict()}))
+        # Keep the block alive until the receiver has mapped it (Windows frees
+        # named mappings with the last open handle)
+        conn.recv()
+    except (EOFError, OSError):
+        shm.unlink()
+    finally:
+        shm.close()
+
+
+def _worker_main(conn, *args):
+    try:
+        _run(conn, *args)
+    except Exception as e:
+        try:
+            conn.send(("ERROR", str(e)))
+        except OSError:
+            pass
+    finally:
+        conn.close()
+
+
+# ------------------------------------------------------------------------------
+# Parent side
+# ------------------------------------------------------------------------------
+class AnalysisProcess:
+    """
+    One analysis run in a child process.
+
+    poll() returns the messages the UI queue already understands:
+    ("PROGRESS", (pct, msg)), ("STATUS", text), ("DONE", payload),
+    ("ERROR", text) and a final ("FINISH", None).
+    The DONE payload holds raw_data, stats, density, dist_index and the SharedResult
+    that owns the memory of the freshly computed arrays. Arrays of a cached
+    result are memory-mapped from the cache entry instead.
+    """
+
+    def __init__(self, file_path, intervals, compact=False, workers=1, cache: ResultCache = None):
+        cache = cache or ResultCache()
+        self.cache = cache
+        # Spawned, not forked: the parent is the Tk process, whose X connection,
+        # shared memory mappings and locks held by its threads must not be copied
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child_conn = ctx.Pipe(duplex=True)
+        self.resume = ctx.Event()
+        self.resume.set()
+        self.stop_event = ctx.Event()
+        intervals = [(float(s), float(e)) for s, e in intervals]
+        # Not a daemon: the parser starts its own process pool
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, file_path, intervals, compact, workers,
+                  cache.cache_dir, cache.max_bytes, self.resume, self.stop_event),
+            name="CAM-Analysis")
+        self._child_conn = child_conn
+        self.finished = False
+
+    def start(self):
+        self.process.start()
+        # The child holds its own copy; closing ours lets recv() see EOF if it dies
+        self._child_conn.close()
+
+    def pause(self):
+        self.resume.clear()
+
+    def resume_run(self):
+        self.resume.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self.resume.set()
+
+    def poll(self):
+        messages = []
+        if self.finished:
+            return messages
+        try:
+            while self.conn.poll():
+                kind, data = self.conn.recv()
+                if kind == "DONE":
+                    try:
+                        messages.append(("DONE", self._attach(data)))
+                    except OSError as e:
+                        messages.append(("ERROR", f"Cached result could not be opened ({e})"))
+                elif kind == "CANCELLED":
+                    messages.append(("STATUS", "Cancelled"))
+                else:
+                    messages.append((kind, data))
+                if kind in ("DONE", "CANCELLED", "ERROR"):
+                    self._finish()
+                    break
+        except (EOFError, OSError):
+            self.process.join(JOIN_TIMEOUT)
+            messages.append(("ERROR", f"Analysis process exited unexpectedly (exit code {self.process.exitcode})"))
+            self._finish()
+        if self.finished:
+            messages.append(("FINISH", None))
+        return messages
+
+    def _attach(self, done):
+        shared = SharedResult(done['shm'], done['layout'])
+        self.conn.send(("ATTACHED", None))
+        raw_data = dict(done['values'])
+        if done['cached']:
+            try:
+                raw_data.update(self.cache.load_arrays(done['cached']['key'], done['cached']['arrays']))
+            except OSError:
+                shared.release()
+                raise
+        raw_data.update(shared.groups.get(GROUP_DATA, {}))
+        index = shared.groups[GROUP_INDEX]
+        return {
+            "raw_data": raw_data,
+            "stats": SegmentStats.from_dict(done['stats']),
+            "density": FeedDensity.from_dict(done['density']),
+            "dist_index": DistanceIndex.from_sorted(index['sorted_dists'], index['feed_prefix']),
+            "shared": shared,
+        }
+
+    def _finish(self):
+        self.finished = True
+        self.conn.close()
+        self.process.join(JOIN_TIMEOUT)
+
+    def shutdown(self):
+        """Stops the run and makes sure the child is gone (window closing)."""
+        self.stop()
+        if not self.finished:
+            # A result published before the stop arrived is mapped and dropped
+            # here, so its block does not outlive both processes
+            try:
+                if self.conn.poll(JOIN_TIMEOUT):
+                    for kind, data in iter(self.conn.recv, None):
+                        if kind == "DONE":
+                            SharedResult(data['shm'], data['layout']).release()
+                            self.conn.send(("ATTACHED", None))
+                        if kind in ("DONE", "CANCELLED", "ERROR"):
+                            break
+            except (EOFError, OSError):
+                pass
+            self.finished = True
+            self.conn.close()
+        self.process.join(JOIN_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(JOIN_TIMEOUT)
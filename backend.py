@@ -12,9 +12,438 @@
 
 import re
 import os
+import io
+import mmap
+import gzip
+import codecs
 import numpy as np
 import chardet
+import sys
 import math
+import bisect
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+AXIS_MAP = {
+    'X':0, 'Y':1, 'Z':2,
+    'A':3, 'B':4, 'C':5,
+    'I':6, 'J':7, 'K':8
+}
+
+# Axes (XYZABCIJK), radius (R) and feed (F) followed by a number
+TOKEN_PATTERN = r'([XYZABCIJKFR])([-+]?(?:\d+\.?\d*|\.\d+))'
+
+# Comments never span lines: '(' closes at the first ')' on the same line
+COMMENT_PATTERN = r'\([^)]*\)'
+COMMENT_RE = re.compile(COMMENT_PATTERN)
+
+UTF8_BOM = b'\xef\xbb\xbf'
+
+# Skipped (non-motion) line categories
+LOG_M_CODE, LOG_TOOL, LOG_G_SETUP, LOG_HEADER = 1, 2, 3, 4
+LOG_SUFFIXES = ("", "[M Code]", "[Tool/Speed]", "[G Code Setup]", "[Header]")
+
+
+class _DecodeRequired(Exception):
+    """Raised by the byte-level path when a line needs real text decoding."""
+
+
+class _Syntax:
+    """
+    Literals and compiled patterns for one line type (str or ASCII bytes),
+    so the same parsing loop serves the decoded and the memory-mapped path.
+    """
+
+    def __init__(self, kind):
+        lit = (lambda t: t) if kind is str else (lambda t: t.encode('ascii'))
+        self.empty = lit('')
+        self.open_paren = lit('(')
+        self.comment_sub = re.compile(lit(COMMENT_PATTERN)).sub
+        self.token_findall = re.compile(lit(TOKEN_PATTERN), re.IGNORECASE).findall
+        self.mode_findall = re.compile(lit(r'G0([0-3])'), re.IGNORECASE).findall
+        self.rapid = lit('0')
+        # Both cases, so the loop never has to upper() a token
+        self.axis_cols = {}
+        for char, idx in AXIS_MAP.items():
+            self.axis_cols[lit(char)] = idx
+            self.axis_cols[lit(char.lower())] = idx
+        self.feed_chars = (lit('F'), lit('f'))
+        self.check_ascii = kind is bytes
+        self._m, self._s, self._t = lit('M'), lit('S'), lit('T')
+        self._g, self._headers = lit('G'), (lit('%'), lit('O'))
+
+    def log_category(self, line_upper):
+        if self._m in line_upper: return LOG_M_CODE
+        if self._s in line_upper or self._t in line_upper: return LOG_TOOL
+        if line_upper.startswith(self._g): return LOG_G_SETUP
+        if line_upper.startswith(self._headers): return LOG_HEADER
+        return 0
+
+
+_STR_SYNTAX = _Syntax(str)
+_BYTES_SYNTAX = _Syntax(bytes)
+
+# Byte values for the vectorized tokenizer (letters compared after `| 0x20`)
+(ORD_NL, ORD_CR, ORD_LPAREN, ORD_RPAREN, ORD_DOT, ORD_MINUS, ORD_PERCENT,
+ ORD_UPPER_A, ORD_LOWER_G, ORD_LOWER_M, ORD_LOWER_S, ORD_LOWER_T, ORD_LOWER_O) = b'\n\r().-%Agmsto'
+ORD_ZERO = np.uint8(ord('0'))
+
+SIGN_LUT = np.zeros(256, dtype=np.int64)
+SIGN_LUT[[ord('+'), ord('-')]] = 1
+
+# Token letter -> matrix column (0-8), feed, radius; everything else is NONE
+TOKEN_FEED, TOKEN_RADIUS, TOKEN_NONE = 9, 10, 255
+TOKEN_CLASS_LUT = np.full(256, TOKEN_NONE, dtype=np.uint8)
+for _char, _idx in list(AXIS_MAP.items()) + [('F', TOKEN_FEED), ('R', TOKEN_RADIUS)]:
+    TOKEN_CLASS_LUT[ord(_char)] = _idx
+    TOKEN_CLASS_LUT[ord(_char.lower())] = _idx
+
+# Numbers with more digits than this are converted with float() instead
+EXACT_DIGITS = 15
+POW10_FLOAT = 10.0 ** np.arange(EXACT_DIGITS + 1)
+
+
+class _ParseState:
+    """
+    Modal state and growable buffers of an incremental parse.
+    Carries mode, TCP flag and the unfinished line across chunk boundaries;
+    axis values and feeds are carried by the final forward fill.
+    """
+
+    def __init__(self, line_capacity=1 << 16):
+        self.buf_rows = np.zeros(line_capacity * 3, dtype=np.int32)
+        self.buf_cols = np.zeros(line_capacity * 3, dtype=np.int8)
+        self.buf_vals = np.zeros(line_capacity * 3, dtype=np.float64)
+        self.ptr = 0
+
+        self.line_modes = np.full(line_capacity, np.nan, dtype=np.float64)
+        self.line_feeds = np.full(line_capacity, np.nan, dtype=np.float64)
+        # Initial State
+        self.line_modes[0] = 0.0
+        self.line_feeds[0] = 0.0
+        self.line_count = 0
+
+        # NaN = mode unknown (a slice parsed without its preceding lines)
+        self.current_mode_val = 0.0
+        self.is_tcp_mode = False
+        self.ijk_before_mode = False
+        # Non-motion log entries: line index + LOG_* category (text is read back lazily)
+        self.skip_lines = np.zeros(1024, dtype=np.int32)
+        self.skip_cats = np.zeros(1024, dtype=np.int8)
+        self.skip_count = 0
+        # (line number, byte offset) of every LINE_INDEX_STRIDE-th line, recorded
+        # by the byte-level paths only (decoded text has no byte offsets)
+        self.line_marks = []
+        # Encoding the parse decoded with ('ascii': bytes only, none needed)
+        self.encoding = None
+        self.carry = ''
+
+    def grow_tokens(self):
+        new_size = len(self.buf_rows) * 2
+        self.buf_rows.resize(new_size, refcheck=False)
+        self.buf_cols.resize(new_size, refcheck=False)
+        self.buf_vals.resize(new_size, refcheck=False)
+
+    def ensure_lines(self, size):
+        old_size = len(self.line_modes)
+        if size <= old_size: return
+        new_size = max(size, old_size * 2)
+        self.line_modes.resize(new_size, refcheck=False)
+        self.line_feeds.resize(new_size, refcheck=False)
+        self.line_modes[old_size:] = np.nan
+        self.line_feeds[old_size:] = np.nan
+
+    def add_skipped(self, lines, categories):
+        n = len(lines)
+        end = self.skip_count + n
+        if end > len(self.skip_lines):
+            new_size = max(end, len(self.skip_lines) * 2)
+            self.skip_lines.resize(new_size, refcheck=False)
+            self.skip_cats.resize(new_size, refcheck=False)
+        self.skip_lines[self.skip_count:end] = lines
+        self.skip_cats[self.skip_count:end] = categories
+        self.skip_count = end
+
+    def line_offsets(self) -> np.ndarray:
+        """Recorded marks as an (n, 2) int64 array (empty when not recorded)."""
+        if not self.line_marks:
+            return np.empty((0, 2), dtype=np.int64)
+        return np.concatenate(self.line_marks).astype(np.int64, copy=False)
+
+    def release_tokens(self):
+        self.buf_rows = self.buf_cols = self.buf_vals = None
+
+
+# Files below this size are always parsed serially
+PARALLEL_MIN_BYTES = 16 * 1024 * 1024
+PARALLEL_MIN_SLICE = 4 * 1024 * 1024
+# Bytes handed to the parsing loop per step of the memory-mapped path
+# (~50 ms of work: stays cache friendly and bounds the cancel latency)
+MMAP_BLOCK = 512 * 1024
+# Raw bytes decoded and parsed per step of the streaming path
+READ_CHUNK = 256 * 1024
+# Rows forward-filled per step (bounds the index scratch buffers)
+FFILL_BLOCK = 64 * 1024
+# Segments per step of the vector math and of the distance sort
+CALC_BLOCK = 256 * 1024
+SORT_BLOCK = 512 * 1024
+# Shorter segments are treated as zero-length moves in statistics
+MIN_SEGMENT_LENGTH = 0.000001
+# Log-spaced bins per decade of the feed / segment length density map
+DENSITY_BINS_PER_DECADE = 8
+# Spatial index grid: average segments per cell, and segments whose bounding
+# box covers more cells than this are kept in a separate list instead
+GRID_SEGMENTS_PER_CELL = 4
+GRID_MAX_CELLS_PER_SEGMENT = 64
+# Axes spanning less than this fraction of the largest extent count as flat
+GRID_FLAT_RATIO = 1e-3
+# Lines between remembered byte offsets of SourceLines
+LINE_INDEX_STRIDE = 4096
+SOURCE_SCAN_BLOCK = 8 * 1024 * 1024
+# Segments formatted per CSV write (one % operation and one write each)
+CSV_BLOCK_ROWS = 16 * 1024
+# Shortest printf precision that reads back to the same float64 / float32
+CSV_FLOAT_FMT = {np.dtype(np.float64): '%.17g', np.dtype(np.float32): '%.9g'}
+# Minimum seconds between two progress callbacks
+PROGRESS_INTERVAL = 0.1
+
+# Segment length intervals (mm) of the statistics, shared by the UI and batch mode
+DEFAULT_INTERVALS = (
+    (0.000, 0.001), (0.001, 0.01), (0.01, 0.02), (0.02, 0.03),
+    (0.03, 0.04), (0.04, 0.05), (0.05, 0.06), (0.06, 0.07),
+    (0.07, 0.08), (0.08, 0.09), (0.09, 0.10), (0.10, 0.20),
+    (0.20, 0.30), (0.30, 0.40), (0.40, 0.50), (0.50, 0.60),
+    (0.60, 0.70), (0.70, 0.80), (0.80, 0.90), (0.90, 1.00),
+    (1.00, float('inf'))
+)
+
+
+class AnalysisCancelled(Exception):
+    """
+    Raised by ProgressReporter inside the engine. Public entry points catch
+    it and return None, as they did for a callback returning True.
+    """
+
+
+class CancelToken:
+    """
+    Stop request shared with a running analysis. Any object with is_set()
+    (threading.Event, multiprocessing.Event) can be passed in its place.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+
+class ProgressReporter:
+    """
+    Time-based progress shared by every engine stage.
+
+    update(pct, msg) records the position; check() only polls for a stop.
+    Both are cheap enough to call per block: the token is tested every
+    time, the callback runs at most once per interval (and at once when
+    the stage message changes). A stop from the token, or a callback
+    returning True, raises AnalysisCancelled at the next call.
+    """
+
+    def __init__(self, callback=None, token=None, interval=PROGRESS_INTERVAL):
+        self.callback = callback
+        self.token = token
+        self.interval = interval
+        self.pct = 0.0
+        self.msg = ""
+        self._shown = None
+        self._next = 0.0
+
+    @classmethod
+    def wrap(cls, progress) -> "ProgressReporter":
+        """Accepts a reporter, a plain progress_callback(pct, msg) or None."""
+        return progress if isinstance(progress, cls) else cls(progress)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.token is not None and self.token.is_set()
+
+    def update(self, pct, msg):
+        self.pct = pct
+        self.msg = msg
+        if msg != self._shown:
+            self._next = 0.0
+        self.check()
+
+    def check(self):
+        if self.token is not None and self.token.is_set():
+            raise AnalysisCancelled()
+        if self.callback is not None and time.monotonic() >= self._next:
+            self._shown = self.msg
+            stop = self.callback(self.pct, self.msg)
+            self._next = time.monotonic() + self.interval
+            if stop:
+                if isinstance(self.token, CancelToken): self.token.cancel()
+                raise AnalysisCancelled()
+
+
+def reset_peak_rss():
+    """Restarts the peak RSS count (Linux; elsewhere the peak is per process)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def memory_usage():
+    """(current RSS, peak RSS) in bytes; None where the platform cannot tell."""
+    if sys.platform.startswith('linux'):
+        values = {}
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith(('VmRSS:', 'VmHWM:')):
+                        name, kb = line.split()[:2]
+                        values[name] = int(kb) * 1024
+        except OSError:
+            pass
+        return values.get('VmRSS:'), values.get('VmHWM:')
+    if os.name == 'nt':
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize, counters.PeakWorkingSetSize
+        return None, None
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return None, peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return None, None
+
+
+class StageProfile:
+    """
+    Wall time, CPU time, bytes, lines and peak RSS per engine stage.
+
+    stage() brackets a whole stage (two clock reads and one RSS read, so it
+    stays on in production); add() accumulates time measured inside another
+    stage, which is then reported without it. Stages of the same name add up.
+    to_dict() is plain JSON and travels with the result as 'profile'.
+    """
+
+    FIELDS = ('wall_s', 'cpu_s', 'bytes', 'lines')
+
+    def __init__(self, stages=None):
+        self.stages = {}
+        self._nested = None
+        for entry in stages or ():
+            self.stages[entry['name']] = dict(entry)
+
+    @classmethod
+    def of(cls, data_dict) -> "StageProfile":
+        """Continues the profile stored in a result dict."""
+        profile = data_dict.get('profile') if data_dict is not None else None
+        return cls(profile['stages'] if isinstance(profile, dict) else None)
+
+    def _entry(self, name):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = {'name': name, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                         'bytes': 0, 'lines': 0, 'peak_rss_mb': None}
+        return entry
+
+    @contextmanager
+    def stage(self, name, nbytes=0, lines=0):
+        """Times the block; the yielded entry takes counts known only at the end."""
+        entry = self._entry(name)
+        outer = self._nested
+        # [wall, cpu, peak] of inner stages: their time is reported there, not here
+        self._nested = [0.0, 0.0, 0]
+        if outer is not None:
+            # The reset below would lose the enclosing stage's peak so far
+            outer[2] = max(outer[2], memory_usage()[1] or 0)
+        reset_peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield entry
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            nested, self._nested = self._nested, outer
+            entry['wall_s'] += wall - nested[0]
+            entry['cpu_s'] += cpu - nested[1]
+            entry['bytes'] += nbytes
+            entry['lines'] += lines
+            peak = memory_usage()[1]
+            if peak is not None:
+                peak = max(peak, nested[2])
+                entry['peak_rss_mb'] = max(entry['peak_rss_mb'] or 0.0, round(peak / 1024 ** 2, 1))
+            if outer is not None:
+                outer[0] += wall
+                outer[1] += cpu
+                outer[2] = max(outer[2], peak or 0)
+
+    def discard(self, name):
+        """Drops a stage that is about to be measured again (e.g. stats after re-binning)."""
+        self.stages.pop(name, None)
+
+    def add(self, name, wall, cpu, nbytes=0, lines=0):
+        entry = self._entry(name)
+        entry['wall_s'] += wall
+        entry['cpu_s'] += cpu
+        entry['bytes'] += nbytes
+        entry['lines'] += lines
+        if self._nested is not None:
+            self._nested[0] += wall
+            self._nested[1] += cpu
+
+    def to_dict(self) -> dict:
+        stages = []
+        for entry in self.stages.values():
+            stages.append(dict(entry, wall_s=round(entry['wall_s'], 4), cpu_s=round(entry['cpu_s'], 4)))
+        peaks = [e['peak_rss_mb'] for e in stages if e['peak_rss_mb'] is not None]
+        return {
+            'stages': stages,
+            'wall_s': round(sum(e['wall_s'] for e in stages), 4),
+            'cpu_s': round(sum(e['cpu_s'] for e in stages), 4),
+            'peak_rss_mb': max(peaks) if peaks else None,
+        }
+
+
+def format_profile(profile) -> list:
+    """Text table of a result's 'profile' (Log tab and CLI)."""
+    if not isinstance(profile, dict) or not profile.get('stages'):
+        return []
+    lines = [f"{'Stage':<16}{'Wall s':>9}{'CPU s':>9}{'MB':>10}{'Lines':>14}{'Lines/s':>15}{'Peak RSS MB':>13}"]
+    for e in profile['stages']:
+        # Sub-millisecond stages have no meaningful rate
+        rate = f"{e['lines'] / e['wall_s']:,.0f}" if e['lines'] and e['wall_s'] >= 0.001 else ""
+        peak = f"{e['peak_rss_mb']:,.1f}" if e['peak_rss_mb'] is not None else ""
+        mb = f"{e['bytes'] / 1024 ** 2:,.1f}" if e['bytes'] else ""
+        count = f"{e['lines']:,}" if e['lines'] else ""
+        lines.append(f"{e['name']:<16}{e['wall_s']:>9.3f}{e['cpu_s']:>9.3f}{mb:>10}{count:>14}{rate:>15}{peak:>13}")
+    peak = f"{profile['peak_rss_mb']:,.1f}" if profile.get('peak_rss_mb') is not None else ""
+    lines.append(f"{'Total':<16}{profile['wall_s']:>9.3f}{profile['cpu_s']:>9.3f}{'':>10}{'':>14}{'':>15}{peak:>13}")
+    return lines
+
 
 class GCodeAnalyzer:
     """
@@ -22,324 +451,1752 @@ class GCodeAnalyzer:
     
     Version: 10.6 (Flagship / Numpy Float64 / English Messages)
     """
+
+    # Bump whenever parse semantics or the result layout change (keys the result cache)
+    ENGINE_VERSION = "10.9"
     
     def __init__(self):
         # Regex: Capture axes (XYZABCIJK), radius (R), and feed (F)
-        self.pattern = re.compile(r'([XYZABCIJKFR])([-+]?(?:\d+\.?\d*|\.\d+))', re.IGNORECASE)
+        self.pattern = re.compile(TOKEN_PATTERN, re.IGNORECASE)
+        self._stream = None
+        # Memory-mapped ASCII fast path (falls back to decoding when needed)
+        self.use_mmap = True
+        # Byte tokenizer of the fast path: 'numpy' (vectorized) or 'regex' (per line)
+        self.tokenizer = 'numpy'
+        # Keep only motion lines (rows mapped back through 'lines', float32 where
+        # precision allows, unused matrix columns dropped)
+        self.compact_results = False
+        # Per-stage timings of the last analysis (result['profile'])
+        self._profile = StageProfile()
+        # When set, the parse loop runs under cProfile and its stats are dumped here
+        self.cprofile_path = None
 
     def detect_encoding(self, file_path: str) -> str:
         """
         Detects the file encoding by reading the first 64KB.
         """
         try:
-            with open(file_path, 'rb') as f:
-                result = chardet.detect(f.read(65536))
+            with self._profile.stage('detect_encoding') as entry:
+                with open(file_path, 'rb') as f:
+                    head = f.read(65536)
+                result = chardet.detect(head)
+                entry['bytes'] += len(head)
             return result['encoding'] or 'utf-8'
         except Exception as e:
             raise RuntimeError(f"Failed to detect file encoding: {str(e)}")
 
-    def read_file_generator(self, file_path: str, chunk_size=1024*1024, progress_callback=None):
+    def read_file_generator(self, file_path: str, chunk_size=READ_CHUNK, progress_callback=None, encoding=None):
         """
         Generator that reads the file in chunks to manage memory usage.
+        Stops early when progress_callback cancels. encoding: detected when None.
         """
-        file_size = os.path.getsize(file_path)
-        encoding = self.detect_encoding(file_path)
+        file_size = max(os.path.getsize(file_path), 1)
+        encoding = encoding or self.detect_encoding(file_path)
         processed_bytes = 0
+        progress = ProgressReporter.wrap(progress_callback) if progress_callback else None
         
         try:
-            with open(file_path, 'r', encoding=encoding, errors='replace') as f:
+            # Decode raw chunks ourselves so byte progress needs no re-encoding
+            decoder = io.IncrementalNewlineDecoder(
+                codecs.getincrementaldecoder(encoding)(errors='replace'), translate=True)
+            with open(file_path, 'rb') as f:
                 while True:
-                    chunk = f.read(chunk_size)
-                    if not chunk:
+                    wall, cpu = time.perf_counter(), time.process_time()
+                    raw = f.read(chunk_size)
+                    chunk = decoder.decode(raw, final=not raw)
+                    self._profile.add('read', time.perf_counter() - wall, time.process_time() - cpu, len(raw))
+                    if not raw and not chunk:
                         break
-                    processed_bytes += len(chunk.encode(encoding))
+                    processed_bytes += len(raw)
                     
-                    if progress_callback:
+                    if progress:
                         # [Modified] English Message
-                        if processed_bytes % (5 * 1024 * 1024) == 0: 
-                            if progress_callback((processed_bytes / file_size) * 100, "Reading File"):
-                                return None
-                    yield chunk
+                        progress.update((processed_bytes / file_size) * 100, "Reading File")
+                    if chunk:
+                        yield chunk
+        except AnalysisCancelled:
+            return
         except Exception as e:
             raise RuntimeError(f"Failed to read file: {str(e)}")
 
-    def _numpy_ffill(self, arr: np.ndarray) -> np.ndarray:
+    def _numpy_ffill(self, arr: np.ndarray, block_rows=FFILL_BLOCK, progress=None) -> np.ndarray:
         """
-        Vectorized Forward Fill using Numpy.
+        Vectorized Forward Fill using Numpy, in place and block by block.
+        Scratch memory is a few block-sized buffers instead of an index
+        array and a copy of the whole matrix. Returns arr.
         """
-        mask = np.isnan(arr)
-        # Use [:, None] to broadcast index array (N, 1) against mask (N, Cols)
-        idx = np.where(~mask, np.arange(mask.shape[0])[:, None], 0)
-        
-        # Propagate the last valid index down
-        np.maximum.accumulate(idx, axis=0, out=idx)
-        
-        # Use advanced indexing to construct the filled array
-        return arr[idx, np.arange(arr.shape[1])]
+        n_rows, n_cols = arr.shape
+        if n_rows == 0: return arr
+
+        rows = min(block_rows, n_rows)
+        idx = np.empty((rows, n_cols), dtype=np.intp)
+        valid = np.empty((rows, n_cols), dtype=bool)
+        ramp = np.arange(rows, dtype=np.intp)[:, None]
+        col_ids = np.arange(n_cols)
+
+        carry = None
+        for start in range(0, n_rows, rows):
+            block = arr[start:start + rows]
+            n = len(block)
+            # Seed the block with the last filled row of the previous one
+            if carry is not None:
+                np.copyto(block[0], carry, where=np.isnan(block[0]))
 
-    def _numpy_ffill_1d(self, arr: np.ndarray) -> np.ndarray:
-        """1D array Forward Fill."""
-        mask = np.isnan(arr)
-        idx = np.where(~mask, np.arange(mask.shape[0]), 0)
-        np.maximum.accumulate(idx, out=idx)
-        return arr[idx]
+            v = valid[:n]
+            np.isnan(block, out=v)
+            if v.any():
+                np.logical_not(v, out=v)
+                ix = idx[:n]
+                # Propagate the last valid index down
+                np.multiply(ramp[:n], v, out=ix)
+                np.maximum.accumulate(ix, axis=0, out=ix)
+                block[...] = block[ix, col_ids]
+            carry = block[-1]
+            if progress: progress.check()
+        return arr
+
+    def _numpy_ffill_1d(self, arr: np.ndarray, progress=None) -> np.ndarray:
+        """1D array Forward Fill (in place)."""
+        self._numpy_ffill(arr[:, None], progress=progress)
+        return arr
+
+    # ------------------------------------------------------------------
+    # Incremental (streaming) parsing API
+    # ------------------------------------------------------------------
+    def begin_parse(self):
+        """
+        Starts a new incremental parse. Feed text with feed(), then call finalize().
+        """
+        self._stream = _ParseState()
+        self._profile = StageProfile()
+
+    def feed(self, chunk: str):
+        """
+        Parses one chunk of G-code text. Lines may be split across chunks;
+        the unfinished tail is carried over to the next call.
+        """
+        st = self._stream
+        if st is None:
+            raise RuntimeError("Incremental parse not started (call begin_parse first)")
+
+        text = st.carry + chunk if st.carry else chunk
+        if not text: return
+
+        # A trailing CR may be the first half of a CRLF split across chunks
+        held_cr = ''
+        if text[-1] == '\r':
+            text, held_cr = text[:-1], '\r'
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+        cut = text.rfind('\n')
+        if cut < 0:
+            st.carry = text + held_cr
+            return
+        st.carry = text[cut + 1:] + held_cr
+        wall, cpu, first = time.perf_counter(), time.process_time(), st.line_count
+        self._parse_lines(st, text[:cut].split('\n'))
+        self._profile.add('parse', time.perf_counter() - wall, time.process_time() - cpu,
+                          len(chunk), st.line_count - first)
+
+    def finalize(self, progress_callback=None) -> dict:
+        """
+        Flushes the carried line and runs matrix reconstruction and vector math.
+        """
+        st = self._stream
+        if st is None:
+            raise RuntimeError("Incremental parse not started (call begin_parse first)")
+        self._stream = None
+
+        if st.carry:
+            self._parse_lines(st, [st.carry.rstrip('\r')])
+            st.carry = ''
+        try:
+            return self._build_result(st, ProgressReporter.wrap(progress_callback))
+        except AnalysisCancelled:
+            return None
+
+    def parse_file(self, file_path: str, progress_callback=None, workers=1) -> dict:
+        """
+        Streams the file through the incremental parser.
+        Peak memory is one chunk plus the output arrays.
+        workers > 1 (or None = all cores) parses slices in a process pool.
+        progress_callback is a callable(pct, msg) -> stop or a ProgressReporter
+        (which may carry a CancelToken). Returns None when cancelled.
+        """
+        progress = ProgressReporter.wrap(progress_callback)
+        self._profile = StageProfile()
+        try:
+            return self._parse_file(file_path, progress, workers)
+        except AnalysisCancelled:
+            self._stream = None
+            return None
+
+    def _parse_file(self, file_path: str, progress: "ProgressReporter", workers) -> dict:
+        if workers is None: workers = os.cpu_count() or 1
+        if workers > 1 and os.path.getsize(file_path) >= PARALLEL_MIN_BYTES:
+            encoding = self.detect_encoding(file_path)
+            # UTF-16/32 newlines are not single bytes: slicing needs the serial path
+            if not codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32')):
+                return self._parse_file_parallel(file_path, encoding, workers, progress)
+
+        if self.use_mmap:
+            try:
+                return self._parse_mmap(file_path, progress)
+            except _DecodeRequired:
+                pass
+
+        file_size = max(os.path.getsize(file_path), 1)
+        consumed = 0
+        # Not begin_parse(): the profile keeps the time of a failed mapped attempt
+        self._stream = _ParseState()
+        self._stream.encoding = self.detect_encoding(file_path)
+        with self._capture(), self._profile.stage('parse'):
+            for chunk in self.read_file_generator(file_path, encoding=self._stream.encoding):
+                self.feed(chunk)
+                consumed += len(chunk)
+                progress.update(min(consumed / file_size, 1.0) * 50, "Parsing G-code (Streaming)")
+        return self.finalize(progress)
 
     def parse_and_calculate(self, gcode_content: str, progress_callback=None) -> dict:
         """
         Executes sparse parsing and vectorized geometric calculations.
         """
-        # Remove comments
-        gcode_content = re.sub(r'\([^)]*\)', '', gcode_content)
-        lines = gcode_content.splitlines() 
-        total_lines = len(lines)
-        
-        estimated_tokens = total_lines * 3
-        
-        # Pre-allocation (Float64)
-        buf_rows = np.zeros(estimated_tokens, dtype=np.int32)
-        buf_cols = np.zeros(estimated_tokens, dtype=np.int8)
-        buf_vals = np.zeros(estimated_tokens, dtype=np.float64) 
-        
-        # Line Properties
-        line_modes = np.full(total_lines + 1, np.nan, dtype=np.float64) 
-        line_feeds = np.full(total_lines + 1, np.nan, dtype=np.float64)
-        
-        # Initial State
-        line_modes[0] = 0.0 
-        line_feeds[0] = 0.0
-        
-        axis_map = {
-            'X':0, 'Y':1, 'Z':2, 
-            'A':3, 'B':4, 'C':5, 
-            'I':6, 'J':7, 'K':8
-        }
-        
+        total_chars = max(len(gcode_content), 1)
+        step = READ_CHUNK
+        progress = ProgressReporter.wrap(progress_callback)
+        self.begin_parse()
+        try:
+            with self._capture(), self._profile.stage('parse'):
+                for pos in range(0, len(gcode_content), step):
+                    self.feed(gcode_content[pos:pos + step])
+                    progress.update((pos / total_chars) * 50, "Parsing G-code (Sparse)")
+        except AnalysisCancelled:
+            self._stream = None
+            return None
+        return self.finalize(progress)
+
+    # ------------------------------------------------------------------
+    # Memory-mapped byte-level parsing
+    # ------------------------------------------------------------------
+    def _parse_mmap(self, file_path: str, progress: "ProgressReporter") -> dict:
+        """
+        Parses the file straight from a read-only memory map as ASCII bytes:
+        no decode and no whole-text comment pass. The encoding is detected
+        only when comments hold non-ASCII text (for showing the source).
+        Raises _DecodeRequired on non-ASCII text outside comments or bare CRs.
+        """
+        st = _ParseState()
+        st.encoding = 'ascii'
+        non_ascii = False
+        with open(file_path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size == 0:
+                return self._build_result(st, progress)
+
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                with self._capture(), self._profile.stage('parse', nbytes=file_size) as entry:
+                    pos = len(UTF8_BOM) if mm[:len(UTF8_BOM)] == UTF8_BOM else 0
+                    while pos < file_size:
+                        end = pos + MMAP_BLOCK
+                        if end >= file_size:
+                            end = file_size
+                        else:
+                            nl = mm.rfind(b'\n', pos, end)
+                            end = nl + 1 if nl >= 0 else (mm.find(b'\n', end) + 1 or file_size)
+
+                        self._mark_lines(st, mm, pos, end)
+                        self._parse_byte_block(st, mm, pos, end)
+                        # Non-ASCII bytes can only be comment text here
+                        non_ascii = non_ascii or np.frombuffer(mm, dtype=np.uint8, count=end - pos,
+                                                               offset=pos).max() >= 0x80
+                        pos = end
+                        progress.update((pos / file_size) * 50, "Parsing G-code (Mapped)")
+                    entry['lines'] += st.line_count
+            finally:
+                try:
+                    mm.close()
+                except BufferError:
+                    pass  # an in-flight traceback still holds a view; GC unmaps it
+
+        # The code itself is ASCII; only comment text needs an encoding to be shown
+        if non_ascii:
+            st.encoding = self.detect_encoding(file_path)
+        return self._build_result(st, progress)
+
+    def _split_byte_lines(self, block: bytes) -> list:
+        """
+        Splits a newline-aligned byte block into lines (CRLF aware).
+        """
+        if b'\r' in block:
+            block = block.replace(b'\r\n', b'\n')
+            # Old-Mac CR line ends: let the decode path translate them
+            if b'\r' in block: raise _DecodeRequired(0)
+        lines = block.split(b'\n')
+        if lines and not lines[-1]:
+            lines.pop()
+        return lines
+
+    def _mark_lines(self, st, buf, start: int, end: int, origin: int = 0):
+        """
+        Records the byte offset of every LINE_INDEX_STRIDE-th line (1, 4097, ...)
+        beginning in buf[start:end] (newline-aligned, lines numbered on from
+        st.line_count). origin is the file offset of buf[0]. Parallel slices
+        count from their own first line, so after stitching the marks are at
+        most (not exactly) LINE_INDEX_STRIDE lines apart.
+        """
+        nl = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8, count=end - start, offset=start) == ORD_NL)
+        starts = np.concatenate(([0], nl + 1))
+        if starts[-1] >= end - start:
+            starts = starts[:-1]
+        k = np.arange(-st.line_count % LINE_INDEX_STRIDE, len(starts), LINE_INDEX_STRIDE)
+        if len(k):
+            st.line_marks.append(np.column_stack((st.line_count + k + 1, origin + start + starts[k])))
+
+    # ------------------------------------------------------------------
+    # Vectorized byte tokenizer
+    # ------------------------------------------------------------------
+    def _parse_byte_block(self, st, buf, start: int, end: int):
+        """
+        Parses buf[start:end] (bytes or mmap, newline-aligned) with the configured tokenizer.
+        """
+        if self.tokenizer == 'numpy':
+            self._tokenize_block(st, np.frombuffer(buf, dtype=np.uint8, count=end - start, offset=start))
+        else:
+            self._parse_lines(st, self._split_byte_lines(buf[start:end]), _BYTES_SYNTAX)
+
+    def _tokenize_block(self, st, b: np.ndarray):
+        """
+        Array-level equivalent of _parse_lines for an ASCII byte block.
+        Comments, tokens, numbers, modes and log categories are all found with
+        whole-block numpy operations; there is no per-token Python work.
+        """
+        n_bytes = len(b)
+        if n_bytes == 0: return
+        base = st.line_count
+        n_lines = int(np.count_nonzero(b == ORD_NL)) + (1 if b[-1] != ORD_NL else 0)
+        st.ensure_lines(base + n_lines + 1)
+
+        # --- 1. Drop CR of CRLF and (...) comments -> compacted stream `s` ---
+        keep = None
+        cr = np.flatnonzero(b == ORD_CR)
+        if len(cr):
+            if cr[-1] + 1 >= n_bytes or not np.all(b[cr + 1] == ORD_NL):
+                raise _DecodeRequired(base)
+            keep = np.ones(n_bytes, dtype=bool)
+            keep[cr] = False
+
+        opens = np.flatnonzero(b == ORD_LPAREN)
+        if len(opens):
+            # A '(' closes at the next ')' unless a newline comes first; every
+            # '(' sharing that closer is inside the same comment.
+            closers = np.flatnonzero((b == ORD_RPAREN) | (b == ORD_NL))
+            k = np.searchsorted(closers, opens)
+            first = np.ones(len(k), dtype=bool)
+            first[1:] = k[1:] != k[:-1]
+            opens, k = opens[first], k[first]
+            opens, k = opens[k < len(closers)], k[k < len(closers)]
+            ends = closers[k]
+            closed = b[ends] == ORD_RPAREN
+            opens, ends = opens[closed], ends[closed]
+            if len(opens):
+                span = np.zeros(n_bytes + 1, dtype=np.int8)
+                span[opens] = 1
+                span[ends + 1] -= 1
+                in_comment = np.cumsum(span[:-1], dtype=np.int8).view(bool)
+                keep = ~in_comment if keep is None else keep & ~in_comment
+                del span, in_comment
+
+        s = b[keep] if keep is not None else b
+        del keep
+        n = len(s)
+        if n and s.max() >= 0x80:
+            raise _DecodeRequired(base)
+
+        # Copy padded with NULs so lookahead never runs off the end
+        sp = np.zeros(n + 3, dtype=np.uint8)
+        sp[:n] = s
+        del s
+        nl = np.flatnonzero(sp == ORD_NL)
+        line_starts = np.empty(n_lines, dtype=np.int64)
+        line_starts[0] = 0
+        line_starts[1:] = nl[:n_lines - 1] + 1
+        line_ends = np.empty(n_lines, dtype=np.int64)
+        line_ends[:len(nl)] = nl[:n_lines]
+        if len(nl) < n_lines: line_ends[-1] = n
+
+        # --- 2. Tokens: letter, optional sign, \d+\.?\d* | \.\d+ ---
+        p = np.flatnonzero(sp >= ORD_UPPER_A)
+        tok_class = TOKEN_CLASS_LUT[sp[p]]
+        p, tok_class = p[tok_class != TOKEN_NONE], tok_class[tok_class != TOKEN_NONE]
+        q = p + 1 + SIGN_LUT[sp[p + 1]]
+        c0 = sp[q]
+        valid = ((c0 - ORD_ZERO) < 10) | ((c0 == ORD_DOT) & ((sp[q + 1] - ORD_ZERO) < 10))
+        p, q, tok_class = p[valid], q[valid], tok_class[valid]
+        del c0, valid
+
+        # Horner scan, one character column at a time over all tokens.
+        # Accumulating in float64 is exact while the mantissa has <= 15 digits,
+        # and M / 10**frac is then correctly rounded, i.e. equal to float().
+        m = len(q)
+        mantissa = np.zeros(m, dtype=np.float64)
+        n_frac = np.zeros(m, dtype=np.int64)
+        n_dig = np.zeros(m, dtype=np.int64)
+        seen_dot = np.zeros(m, dtype=bool)
+        alive = np.ones(m, dtype=bool)
+        pos = q.copy()
+        while m:
+            c = sp[pos]
+            d = c - ORD_ZERO
+            take_digit = alive & (d < 10)
+            take_dot = alive & (c == ORD_DOT) & ~seen_dot
+            alive = take_digit | take_dot
+            if not alive.any(): break
+            mantissa = np.where(take_digit, mantissa * 10 + d, mantissa)
+            n_dig += take_digit
+            n_frac += take_digit & seen_dot
+            seen_dot |= take_dot
+            pos += alive
+        del alive, seen_dot
+
+        long_tok = n_dig > EXACT_DIGITS
+        vals = mantissa / POW10_FLOAT[np.where(long_tok, 0, n_frac)]
+        np.negative(vals, out=vals, where=sp[p + 1] == ORD_MINUS)
+        for t in np.flatnonzero(long_tok):
+            vals[t] = float(sp[p[t] + 1:pos[t]].tobytes())
+        del mantissa, n_frac, n_dig, long_tok, pos, q
+
+        tok_line = np.searchsorted(nl, p)
+        del p
+
+        is_axis = tok_class < 9
+        axis_line = tok_line[is_axis]
+        axis_cols = tok_class[is_axis]
+        k = len(axis_line)
+        while st.ptr + k > len(st.buf_rows):
+            st.grow_tokens()
+        np.add(axis_line, base + 1, out=st.buf_rows[st.ptr:st.ptr + k], casting='unsafe')
+        st.buf_cols[st.ptr:st.ptr + k] = axis_cols
+        st.buf_vals[st.ptr:st.ptr + k] = vals[is_axis]
+        st.ptr += k
+
+        is_feed = tok_class == TOKEN_FEED
+        feed_line = tok_line[is_feed]
+        if len(feed_line):
+            # Last F word on a line wins
+            last = np.ones(len(feed_line), dtype=bool)
+            last[:-1] = feed_line[1:] != feed_line[:-1]
+            st.line_feeds[feed_line[last] + base + 1] = vals[is_feed][last]
+        del tok_line, tok_class, vals
+
+        # --- 3. Modal G-code: G00 wins over G01/G02/G03 on the same line ---
+        incoming = st.current_mode_val
+        g = np.flatnonzero((sp | 0x20) == ORD_LOWER_G)
+        g = g[(sp[g + 1] == ORD_ZERO) & (sp[g + 2] >= ORD_ZERO) & (sp[g + 2] <= ORD_ZERO + 3)]
+        mode_lines, first = np.unique(np.searchsorted(nl, g), return_index=True)
+        if len(mode_lines):
+            is_rapid = (sp[g + 2] == ORD_ZERO).view(np.int8)
+            mode_vals = np.where(np.maximum.reduceat(is_rapid, first), 0.0, 1.0)
+            st.line_modes[mode_lines + base + 1] = mode_vals
+            st.current_mode_val = mode_vals[-1]
+        else:
+            mode_vals = np.empty(0, dtype=np.float64)
+
+        # --- 4. TCP detection: IJK on a line whose mode is G01 ---
+        ijk_lines = axis_line[axis_cols >= 6]
+        if len(ijk_lines) and not st.is_tcp_mode:
+            idx = np.searchsorted(mode_lines, ijk_lines, side='right') - 1
+            mode_at = np.full(len(idx), incoming)
+            mode_at[idx >= 0] = mode_vals[idx[idx >= 0]]
+            if np.any(mode_at == 1.0):
+                st.is_tcp_mode = True
+            elif incoming != incoming and np.any(idx < 0):
+                st.ijk_before_mode = True
+
+        # --- 5. Non-motion log lines ---
+        lower = sp[:n] | 0x20
+        category = np.zeros(n_lines, dtype=np.int8)
+        first_char = sp[line_starts] | 0x20
+        category[(first_char == ORD_PERCENT) | (first_char == ORD_LOWER_O)] = LOG_HEADER
+        category[first_char == ORD_LOWER_G] = LOG_G_SETUP
+        category[np.searchsorted(nl, np.flatnonzero((lower == ORD_LOWER_S) | (lower == ORD_LOWER_T)))] = LOG_TOOL
+        category[np.searchsorted(nl, np.flatnonzero(lower == ORD_LOWER_M))] = LOG_M_CODE
+        del lower
+        category[line_ends == line_starts] = 0
+        category[axis_line] = 0
+        logged = np.flatnonzero(category)
+        st.add_skipped(logged + (base + 1), category[logged])
+
+        st.line_count = base + n_lines
+
+    # ------------------------------------------------------------------
+    # Multi-process parsing
+    # ------------------------------------------------------------------
+    def _split_file(self, file_path: str, parts: int) -> list:
+        """
+        Splits the file into byte ranges that each end right after a newline.
+        """
+        file_size = os.path.getsize(file_path)
+        slice_size = max(file_size // max(parts, 1), PARALLEL_MIN_SLICE)
+        ranges = []
+        start = 0
+        with open(file_path, 'rb') as f:
+            while start < file_size:
+                end = start + slice_size
+                if end >= file_size:
+                    end = file_size
+                else:
+                    f.seek(end)
+                    while True:
+                        block = f.read(65536)
+                        if not block:
+                            end = file_size
+                            break
+                        nl = block.find(b'\n')
+                        if nl >= 0:
+                            end += nl + 1
+                            break
+                        end += len(block)
+                ranges.append((start, end))
+                start = end
+        return ranges
+
+    def _parse_file_parallel(self, file_path, encoding, workers, progress: "ProgressReporter"):
+        """
+        Parses newline-aligned slices in worker processes, then stitches them.
+        Each worker starts with an unknown mode (NaN); the forward fill and
+        the stitching below carry modal state across slice boundaries.
+        """
+        ranges = self._split_file(file_path, workers * 4)
+        results = [None] * len(ranges)
+
+        processes = min(workers, len(ranges))
+        executor = ProcessPoolExecutor(max_workers=processes)
+        completed = False
+        # cProfile sees only this process (waiting); worker CPU is added to the stage
+        with self._capture(), self._profile.stage('parse', nbytes=os.path.getsize(file_path)) as entry:
+            try:
+                futures = {executor.submit(_parse_slice_job, file_path, start, end, encoding): i
+                           for i, (start, end) in enumerate(ranges)}
+                pending = set(futures)
+                done = 0
+                while pending:
+                    # Wake up at the progress interval so a stop is seen while slices run
+                    finished, pending = wait(pending, timeout=progress.interval, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        results[futures[fut]] = fut.result()
+                        done += 1
+                    progress.update((done / len(ranges)) * 50, "Parsing G-code (Parallel)")
+                completed = True
+            finally:
+                # On cancel or error, queued slices are dropped and running ones abandoned
+                executor.shutdown(wait=completed, cancel_futures=True)
+            entry['lines'] += sum(r['line_count'] for r in results)
+            entry['cpu_s'] += sum(r['cpu_s'] for r in results)
+            entry['processes'] = processes
+            peaks = [r['peak_rss'] for r in results if r['peak_rss'] is not None]
+            entry['worker_peak_rss_mb'] = round(max(peaks) / 1024 ** 2, 1) if peaks else None
+
+        with self._profile.stage('stitch'):
+            st = self._stitch_slices(results)
+        st.encoding = encoding
+        return self._build_result(st, progress)
+
+    def _stitch_slices(self, results) -> "_ParseState":
+        """
+        Concatenates per-slice buffers into one parse state with global line indices.
+        """
+        total_lines = sum(r['line_count'] for r in results)
+        total_tokens = sum(len(r['rows']) for r in results)
+
+        st = _ParseState(line_capacity=1)
+        st.buf_rows = np.empty(total_tokens, dtype=np.int32)
+        st.buf_cols = np.empty(total_tokens, dtype=np.int8)
+        st.buf_vals = np.empty(total_tokens, dtype=np.float64)
+        st.line_modes = np.empty(total_lines + 1, dtype=np.float64)
+        st.line_feeds = np.empty(total_lines + 1, dtype=np.float64)
+        st.line_modes[0] = 0.0
+        st.line_feeds[0] = 0.0
+
+        line_base = 0
         ptr = 0
-        skipped_logs = []
-        is_tcp_mode = False
-        calc_mode_name = "歐幾里得距離計算法"
-        
-        pattern_findall = self.pattern.findall
-        current_mode_val = 0.0 
-        
-        # === 1. Sparse Parsing Loop ===
+        mode = 0.0
+        for r in results:
+            n = r['line_count']
+            k = len(r['rows'])
+            np.add(r['rows'], line_base, out=st.buf_rows[ptr:ptr + k])
+            st.buf_cols[ptr:ptr + k] = r['cols']
+            st.buf_vals[ptr:ptr + k] = r['vals']
+            st.line_modes[line_base + 1:line_base + n + 1] = r['modes']
+            st.line_feeds[line_base + 1:line_base + n + 1] = r['feeds']
+            st.add_skipped(r['skip_lines'] + line_base, r['skip_cats'])
+
+            if not st.is_tcp_mode:
+                if r['is_tcp'] or (r['ijk_before_mode'] and mode == 1.0):
+                    st.is_tcp_mode = True
+            if r['last_mode'] == r['last_mode']:
+                mode = r['last_mode']
+
+            if r['line_marks'] is not None and len(r['line_marks']):
+                st.line_marks.append(r['line_marks'] + [line_base, 0])
+            line_base += n
+            ptr += k
+
+        if any(r['line_marks'] is None for r in results):
+            st.line_marks = []
+        st.line_count = total_lines
+        st.ptr = total_tokens
+        st.current_mode_val = mode
+        return st
+
+    def _parse_lines(self, st, lines, syntax=None):
+        """
+        Sparse parsing loop over complete lines. Modal state lives in `st`.
+        Lines are str, or ASCII bytes when `syntax` is _BYTES_SYNTAX.
+        """
+        sx = syntax or _STR_SYNTAX
+        base = st.line_count
+        n = len(lines)
+        st.ensure_lines(base + n + 1)
+        st.line_count = base + n
+
+        buf_rows, buf_cols, buf_vals = st.buf_rows, st.buf_cols, st.buf_vals
+        line_modes, line_feeds = st.line_modes, st.line_feeds
+        ptr = st.ptr
+        skip_lines, skip_cats = [], []
+        current_mode_val = st.current_mode_val
+
+        axis_cols = sx.axis_cols
+        feed_chars = sx.feed_chars
+        open_paren, empty = sx.open_paren, sx.empty
+        sub_comment = sx.comment_sub
+        pattern_findall = sx.token_findall
+        mode_findall = sx.mode_findall
+        rapid = sx.rapid
+        check_ascii = sx.check_ascii
+
         for i, line in enumerate(lines):
-            line_idx = i + 1
+            line_idx = base + i + 1
             if not line: continue
-            
-            if i % 20000 == 0 and progress_callback:
-                # [Modified] English Message
-                if progress_callback((i / total_lines) * 50, "Parsing G-code (Sparse)"):
-                    return None
-
-            line_upper = line.upper()
-            
-            # Modal G-code
-            if 'G0' in line_upper: 
-                if 'G00' in line_upper: current_mode_val = 0.0
-                elif 'G01' in line_upper: current_mode_val = 1.0
-                elif 'G02' in line_upper or 'G03' in line_upper: current_mode_val = 1.0 
+            if open_paren in line:
+                line = sub_comment(empty, line)
+                if not line: continue
+            if check_ascii and not line.isascii():
+                raise _DecodeRequired(line_idx)
+
+            # Modal G-code (G00 wins over G01/G02/G03 on the same line)
+            codes = mode_findall(line)
+            if codes:
+                current_mode_val = 0.0 if rapid in codes else 1.0
                 line_modes[line_idx] = current_mode_val
-            
+
             coords = pattern_findall(line)
-            
+
             has_move = False
             has_ijk = False
-            
+
             for axis_char, val_str in coords:
-                axis = axis_char.upper()
-                if axis in axis_map:
-                    if ptr >= len(buf_rows): 
-                        new_size = len(buf_rows) * 2
-                        buf_rows.resize(new_size, refcheck=False)
-                        buf_cols.resize(new_size, refcheck=False)
-                        buf_vals.resize(new_size, refcheck=False)
-                    
-                    val = float(val_str)
+                col = axis_cols.get(axis_char)
+                if col is not None:
+                    if ptr >= len(buf_rows):
+                        st.ptr = ptr
+                        st.grow_tokens()
+                        buf_rows, buf_cols, buf_vals = st.buf_rows, st.buf_cols, st.buf_vals
+
                     buf_rows[ptr] = line_idx
-                    buf_cols[ptr] = axis_map[axis]
-                    buf_vals[ptr] = val
+                    buf_cols[ptr] = col
+                    buf_vals[ptr] = float(val_str)
                     ptr += 1
-                    
+
                     has_move = True
-                    if axis in ['I', 'J', 'K']: has_ijk = True
-                    
-                elif axis == 'F':
+                    if col >= 6: has_ijk = True
+
+                elif axis_char in feed_chars:
                     line_feeds[line_idx] = float(val_str)
 
             # Auto-detect TCP
-            if current_mode_val == 1.0 and has_ijk and not is_tcp_mode:
-                is_tcp_mode = True
-                calc_mode_name = "TCP 向量複合距離法(IJK)"
-            
+            if has_ijk and not st.is_tcp_mode:
+                if current_mode_val == 1.0:
+                    st.is_tcp_mode = True
+                elif current_mode_val != current_mode_val:
+                    st.ijk_before_mode = True
+
             # Log non-movement lines
-            if not has_move and not has_ijk:
-                log_suffix = ""
-                should_log = False
-                
-                if 'M' in line_upper:
-                    log_suffix = "[M Code]"
-                    should_log = True
-                elif any(x in line_upper for x in ['S', 'T']):
-                    log_suffix = "[Tool/Speed]"
-                    should_log = True
-                elif line_upper.startswith('G'):
-                    log_suffix = "[G Code Setup]"
-                    should_log = True
-                elif line_upper.startswith(('%', 'O')):
-                    log_suffix = "[Header]"
-                    should_log = True
-                
-                if should_log:
-                    skipped_logs.append(f"Line {line_idx}: {line} {log_suffix}")
+            if not has_move:
+                log_cat = sx.log_category(line.upper())
+                if log_cat:
+                    skip_lines.append(line_idx)
+                    skip_cats.append(log_cat)
+
+        if skip_lines:
+            st.add_skipped(skip_lines, skip_cats)
+        st.ptr = ptr
+        st.current_mode_val = current_mode_val
+
+    def _parse_slice(self, file_path: str, start: int, end: int, encoding: str) -> dict:
+        """
+        Parses one newline-aligned byte range with an unknown incoming mode.
+        """
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        origin = start
+        if start == 0 and data.startswith(UTF8_BOM):
+            data = data[len(UTF8_BOM):]
+            origin = len(UTF8_BOM)
+
+        st = None
+        if self.use_mmap:
+            try:
+                st = _ParseState(line_capacity=data.count(b'\n') + 2)
+                st.current_mode_val = np.nan
+                # Marks count from the slice's first line; stitching shifts them
+                self._mark_lines(st, data, 0, len(data), origin)
+                self._parse_byte_block(st, data, 0, len(data))
+            except _DecodeRequired:
+                st = None
+        byte_level = st is not None
+
+        if st is None:
+            text = data.decode(encoding, errors='replace')
+            if '\r' in text:
+                text = text.replace('\r\n', '\n').replace('\r', '\n')
+            lines = text.split('\n')
+            del text
+            if lines and not lines[-1]:
+                lines.pop()
+
+            st = _ParseState(line_capacity=len(lines) + 1)
+            st.current_mode_val = np.nan
+            self._parse_lines(st, lines)
+            del lines
+        del data
+        n = st.line_count
+        return {
+            "line_count": n,
+            "rows": st.buf_rows[:st.ptr].copy(),
+            "cols": st.buf_cols[:st.ptr].copy(),
+            "vals": st.buf_vals[:st.ptr].copy(),
+            "modes": st.line_modes[1:n + 1].copy(),
+            "feeds": st.line_feeds[1:n + 1].copy(),
+            "skip_lines": st.skip_lines[:st.skip_count].copy(),
+            "skip_cats": st.skip_cats[:st.skip_count].copy(),
+            "is_tcp": st.is_tcp_mode,
+            "ijk_before_mode": st.ijk_before_mode,
+            "last_mode": float(st.current_mode_val),
+            # None: decoded slice, so the whole file gets no offsets
+            "line_marks": st.line_offsets() if byte_level else None,
+        }
+
+    def _build_result(self, st, progress: "ProgressReporter") -> dict:
+        """
+        Matrix reconstruction, forward fill and vector math on the parsed buffers.
+        Every step runs in blocks with a progress check in between.
+        """
+        total_lines = st.line_count
+        ptr = st.ptr
+        axis_map = AXIS_MAP
 
         # === 2. Matrix Reconstruction ===
         # [Modified] English Message
-        if progress_callback: progress_callback(60, "Building Matrix")
-        
-        buf_rows = buf_rows[:ptr]
-        buf_cols = buf_cols[:ptr]
-        buf_vals = buf_vals[:ptr]
-        
-        matrix = np.full((total_lines + 1, 9), np.nan, dtype=np.float64)
-        matrix[0] = [0, 0, 0, 0, 0, 0, 0, 0, 1] 
-        
-        matrix[buf_rows, buf_cols] = buf_vals
-        
+        progress.update(60, "Building Matrix")
+        profile = self._profile
+
+        # Bytes: the token buffers (int32 row, int8 column, float64 value)
+        with profile.stage('matrix', nbytes=ptr * 13, lines=total_lines):
+            buf_rows = st.buf_rows[:ptr]
+            buf_cols = st.buf_cols[:ptr]
+            buf_vals = st.buf_vals[:ptr]
+
+            line_modes = st.line_modes[:total_lines + 1]
+            line_feeds = st.line_feeds[:total_lines + 1]
+
+            if self.compact_results:
+                # One row per motion line. Tokens are appended in line order, so
+                # buf_rows is sorted and a running count of new lines is the row index.
+                new_line = np.ones(ptr, dtype=bool)
+                new_line[1:] = buf_rows[1:] != buf_rows[:-1]
+                line_numbers = np.concatenate(([0], buf_rows[new_line])).astype(np.int32)
+                rows = np.cumsum(new_line, dtype=np.int64)
+            else:
+                line_numbers = np.arange(total_lines + 1, dtype=np.int32)
+                rows = buf_rows
+
+            matrix = np.full((len(line_numbers), 9), np.nan, dtype=np.float64)
+            matrix[0] = [0, 0, 0, 0, 0, 0, 0, 0, 1]
+
+            for lo in range(0, ptr, CALC_BLOCK):
+                hi = lo + CALC_BLOCK
+                matrix[rows[lo:hi], buf_cols[lo:hi]] = buf_vals[lo:hi]
+                progress.check()
+            del buf_rows, buf_cols, buf_vals, rows
+            st.release_tokens()
+
         # === 3. Vectorized Fill ===
-        matrix_filled = self._numpy_ffill(matrix)
-        modes_filled = self._numpy_ffill_1d(line_modes)
-        feeds_filled = self._numpy_ffill_1d(line_feeds)
-        
+        with profile.stage('ffill', nbytes=matrix.nbytes, lines=len(matrix)):
+            matrix_filled = self._numpy_ffill(matrix, progress=progress)
+            # Modal G/F words may sit on lines without motion: fill per line, then pick rows
+            modes_filled = self._numpy_ffill_1d(line_modes, progress=progress)
+            feeds_filled = self._numpy_ffill_1d(line_feeds, progress=progress)
+            if self.compact_results:
+                modes_filled = modes_filled[line_numbers]
+                feeds_filled = feeds_filled[line_numbers]
+
         # === 4. Vectorized Calculation ===
         # [Modified] English Message
-        if progress_callback: progress_callback(80, "Calculating Vectors")
-        
-        delta = matrix_filled[1:] - matrix_filled[:-1]
-        dist_xyz = np.linalg.norm(delta[:, 0:3], axis=1)
-        
-        # TCP Angle Calculation
-        vec_prev = matrix_filled[:-1, 6:9]
-        vec_curr = matrix_filled[1:, 6:9]
-        
-        norm_prev = np.linalg.norm(vec_prev, axis=1, keepdims=True)
-        norm_curr = np.linalg.norm(vec_curr, axis=1, keepdims=True)
-        norm_prev[norm_prev == 0] = 1.0
-        norm_curr[norm_curr == 0] = 1.0
-        
-        vec_prev_n = vec_prev / norm_prev
-        vec_curr_n = vec_curr / norm_curr
-        
-        dot = np.einsum('ij,ij->i', vec_prev_n, vec_curr_n)
-        dot = np.clip(dot, -1.0, 1.0)
-        angles = np.degrees(np.arccos(dot))
-        
-        final_dists = np.zeros_like(dist_xyz)
-        is_g00 = (modes_filled[1:] == 0.0)
-        is_g01 = ~is_g00
-        
-        if is_tcp_mode:
-            final_dists[is_g01] = np.sqrt(dist_xyz[is_g01]**2 + angles[is_g01]**2)
-            final_dists[is_g00] = dist_xyz[is_g00]
-        else:
-            dist_abc = np.linalg.norm(delta[:, 3:6], axis=1)
-            final_dists = np.sqrt(dist_xyz**2 + dist_abc**2)
-            
-        # === 5. Statistics ===
-        total_g00 = np.sum(final_dists[is_g00])
-        total_g01 = np.sum(final_dists[is_g01])
-        
-        safe_feeds = feeds_filled[1:].copy()
-        safe_feeds[safe_feeds <= 0] = 1000.0
-        time_m = np.sum(final_dists[is_g01] / safe_feeds[is_g01])
-        
-        used_cols = np.any(matrix_filled != 0, axis=0)
-        final_axes = []
-        for char, idx in axis_map.items():
-            if used_cols[idx]: final_axes.append(char)
-        
-        line_numbers = np.arange(total_lines + 1, dtype=np.int32)
-        
+        progress.update(80, "Calculating Vectors")
+
+        is_tcp_mode = st.is_tcp_mode
+        calc_mode_name = "TCP 向量複合距離法(IJK)" if is_tcp_mode else "歐幾里得距離計算法"
+
+        with profile.stage('vectors', nbytes=matrix_filled.nbytes, lines=len(matrix_filled) - 1):
+            final_dists, dist_xyz, angles = self._segment_lengths(matrix_filled, modes_filled, is_tcp_mode, progress)
+            is_g00 = (modes_filled[1:] == 0.0)
+            is_g01 = ~is_g00
+
+            # === 5. Statistics ===
+            total_g00 = np.sum(final_dists[is_g00])
+            total_g01 = np.sum(final_dists[is_g01])
+
+            safe_feeds = feeds_filled[1:].copy()
+            safe_feeds[safe_feeds <= 0] = 1000.0
+            time_m = np.sum(final_dists[is_g01] / safe_feeds[is_g01])
+
+            used_cols = np.any(matrix_filled != 0, axis=0)
+            final_axes = []
+            for char, idx in axis_map.items():
+                if used_cols[idx]: final_axes.append(char)
+
+            matrix_axes = list(axis_map)
+            if self.compact_results:
+                # Keep only the columns in use; dists stays float64 for exact binning
+                matrix_axes = [char for char in matrix_axes if used_cols[axis_map[char]]]
+                matrix_filled = np.ascontiguousarray(matrix_filled[:, used_cols])
+                dist_xyz = dist_xyz.astype(np.float32)
+                angles = angles.astype(np.float32)
+                feeds_filled = feeds_filled.astype(np.float32)
+                modes_filled = modes_filled.astype(np.int8)
+
         return {
             "matrix": matrix_filled,
+            "matrix_axes": matrix_axes,
             "dists": final_dists,
             "dists_xyz": dist_xyz,
             "rots_deg": angles,
             "feeds": feeds_filled,
             "modes": modes_filled,
             "lines": line_numbers,
-            "skipped": skipped_logs,
+            "total_lines": total_lines,
+            "line_offsets": st.line_offsets(),
+            "encoding": st.encoding,
+            "compact": self.compact_results,
+            "skipped_lines": st.skip_lines[:st.skip_count].copy(),
+            "skipped_cats": st.skip_cats[:st.skip_count].copy(),
             "axes": sorted(final_axes),
             "g00_dist": total_g00,
             "g01_dist": total_g01,
             "time": time_m,
             "calc_mode": calc_mode_name,
-            "is_tcp": is_tcp_mode
+            "is_tcp": is_tcp_mode,
+            "profile": profile.to_dict(),
         }
 
-    def calculate_metrics_and_stats(self, data_dict, bins, fixed_intervals, progress_callback=None):
-        """Calculates histograms, Top N stats, and BPT."""
+    def _segment_lengths(self, matrix, modes, is_tcp_mode, progress):
+        """
+        (final_dists, dist_xyz, angles) of consecutive rows, CALC_BLOCK
+        segments at a time. Row-wise math, so blocking changes no value.
+        """
+        n = len(matrix) - 1
+        dist_xyz = np.empty(n, dtype=np.float64)
+        angles = np.empty(n, dtype=np.float64)
+        final_dists = np.empty(n, dtype=np.float64)
+
+        for lo in range(0, n, CALC_BLOCK):
+            hi = min(lo + CALC_BLOCK, n)
+            prev = matrix[lo:hi]
+            curr = matrix[lo + 1:hi + 1]
+
+            # Differences per column group: no block x 9 temporary
+            xyz = np.linalg.norm(curr[:, 0:3] - prev[:, 0:3], axis=1)
+            dist_xyz[lo:hi] = xyz
+
+            # TCP Angle Calculation
+            vec_prev = prev[:, 6:9]
+            vec_curr = curr[:, 6:9]
+
+            norm_prev = np.linalg.norm(vec_prev, axis=1, keepdims=True)
+            norm_curr = np.linalg.norm(vec_curr, axis=1, keepdims=True)
+            norm_prev[norm_prev == 0] = 1.0
+            norm_curr[norm_curr == 0] = 1.0
+
+            dot = np.einsum('ij,ij->i', vec_prev / norm_prev, vec_curr / norm_curr)
+            dot = np.clip(dot, -1.0, 1.0)
+            ang = np.degrees(np.arccos(dot))
+            # arccos(1 - eps) is ~1e-6 deg: unchanged tool vectors must give exactly 0
+            ang[np.all(vec_prev == vec_curr, axis=1)] = 0.0
+            angles[lo:hi] = ang
+
+            if is_tcp_mode:
+                is_g00 = modes[lo + 1:hi + 1] == 0.0
+                final = np.sqrt(xyz**2 + ang**2)
+                final[is_g00] = xyz[is_g00]
+            else:
+                abc = np.linalg.norm(curr[:, 3:6] - prev[:, 3:6], axis=1)
+                final = np.sqrt(xyz**2 + abc**2)
+            final_dists[lo:hi] = final
+            progress.check()
+
+        return final_dists, dist_xyz, angles
+
+    @contextmanager
+    def _capture(self):
+        """cProfile of the enclosed parse loop when cprofile_path is set."""
+        if not self.cprofile_path:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(self.cprofile_path)
+
+    def settings_key(self) -> str:
+        """Analyzer options that change the result layout (part of the cache key)."""
+        return "compact" if self.compact_results else "full"
+
+    def matrix_columns(self, data_dict, axes) -> list:
+        """Matrix column index of each axis letter (compact results drop unused columns)."""
+        matrix_axes = data_dict.get('matrix_axes', list(AXIS_MAP))
+        return [matrix_axes.index(ax) for ax in axes]
+
+    def format_skipped(self, data_dict, indices, source=None) -> list:
+        """
+        "Line N: text [Category]" for the given entries of skipped_lines.
+        Text comes from source (a SourceLines); without one it is left empty.
+        """
+        lines = np.asarray(data_dict['skipped_lines'])[indices]
+        cats = np.asarray(data_dict['skipped_cats'])[indices]
+        texts = source.get(lines) if source is not None else [''] * len(lines)
+        return [f"Line {n}: {text} {LOG_SUFFIXES[c]}" for n, text, c in zip(lines.tolist(), texts, cats.tolist())]
+
+    def valid_segment_mask(self, dists: np.ndarray) -> np.ndarray:
+        """Segments counted in statistics (zero-length moves are ignored)."""
+        return dists > MIN_SEGMENT_LENGTH
+
+    def build_distance_index(self, data_dict, progress_callback=None) -> "DistanceIndex":
+        """
+        Sorted valid segment lengths for instant re-binning (one sort per result).
+        Returns None when cancelled.
+        """
+        progress = ProgressReporter.wrap(progress_callback)
+        profile = StageProfile.of(data_dict)
+        profile.discard('sort')
+        try:
+            with profile.stage('sort') as entry:
+                dists = data_dict['dists']
+                valid_mask = self.valid_segment_mask(dists)
+                progress.update(progress.pct, "Sorting Segments")
+                index = DistanceIndex(dists[valid_mask], data_dict['feeds'][1:][valid_mask], progress)
+                entry['lines'] = len(index)
+        except AnalysisCancelled:
+            return None
+        data_dict['profile'] = profile.to_dict()
+        return index
+
+    def compute_stats(self, data_dict, fixed_intervals, index=None, progress_callback=None) -> "SegmentStats":
+        """
+        Interval statistics of one result, computed once and shared by the
+        KPI cards, the histogram and the exports. Returns None when cancelled.
+        """
+        if index is None:
+            index = self.build_distance_index(data_dict, progress_callback)
+            if index is None: return None
+        intervals = tuple((float(s), float(e)) for s, e in fixed_intervals)
+        bins = [s for s, _ in intervals] + [intervals[-1][1]]
+        profile = StageProfile.of(data_dict)
+        profile.discard('stats')
+        with profile.stage('stats', lines=len(index)):
+            counts, feed_sums = index.bin_stats(bins)
+            stats = SegmentStats(intervals, counts, feed_sums, len(index),
+                                 float(data_dict['g01_dist']), float(data_dict['time']))
+        data_dict['profile'] = profile.to_dict()
+        return stats
+
+    def compute_density(self, data_dict, bins_per_decade=DENSITY_BINS_PER_DECADE) -> "FeedDensity":
+        """
+        Segment count per (feed, length) cell on log-spaced bins that cover
+        whole decades, over the same segments as the statistics. Segments
+        without a positive feed are only counted in no_feed.
+        """
         dists = data_dict['dists']
-        feeds = data_dict['feeds'] 
-        
-        valid_mask = dists > 0.000001
-        valid_dists = dists[valid_mask]
-        valid_feeds = feeds[1:][valid_mask]
-        
-        if len(valid_dists) == 0:
+        feeds = data_dict['feeds'][1:]
+        profile = StageProfile.of(data_dict)
+        profile.discard('density')
+        with profile.stage('density', lines=len(dists)):
+            # Pass 1: value range, pass 2: cell counts (bounded scratch per block)
+            d_min = f_min = np.inf
+            d_max = f_max = -np.inf
+            no_feed = 0
+            for lo in range(0, len(dists), CALC_BLOCK):
+                d, f = self._density_block(dists, feeds, lo)
+                no_feed += int(np.count_nonzero(~(f > 0)))
+                keep = f > 0
+                if keep.any():
+                    d, f = d[keep], f[keep]
+                    d_min, d_max = min(d_min, float(d.min())), max(d_max, float(d.max()))
+                    f_min, f_max = min(f_min, float(f.min())), max(f_max, float(f.max()))
+            if d_min > d_max:
+                return FeedDensity(np.empty(0), np.empty(0), np.zeros((0, 0), dtype=np.int64), no_feed)
+
+            d_lo, d_hi = self._decades(d_min, d_max)
+            f_lo, f_hi = self._decades(f_min, f_max)
+            nd, nf = (d_hi - d_lo) * bins_per_decade, (f_hi - f_lo) * bins_per_decade
+            counts = np.zeros(nf * nd, dtype=np.int64)
+            for lo in range(0, len(dists), CALC_BLOCK):
+                d, f = self._density_block(dists, feeds, lo)
+                keep = f > 0
+                di = ((np.log10(d[keep]) - d_lo) * bins_per_decade).astype(np.int64)
+                fi = ((np.log10(f[keep]) - f_lo) * bins_per_decade).astype(np.int64)
+                np.clip(di, 0, nd - 1, out=di)
+                np.clip(fi, 0, nf - 1, out=fi)
+                counts += np.bincount(fi * nd + di, minlength=nf * nd)
+
+        data_dict['profile'] = profile.to_dict()
+        steps = np.arange(max(nd, nf) + 1) / bins_per_decade
+        return FeedDensity(10.0 ** (d_lo + steps[:nd + 1]), 10.0 ** (f_lo + steps[:nf + 1]),
+                           counts.reshape(nf, nd), no_feed)
+
+    def _density_block(self, dists, feeds, lo):
+        """Valid segment lengths and their feeds in dists[lo:lo + CALC_BLOCK]."""
+        d = dists[lo:lo + CALC_BLOCK]
+        valid = self.valid_segment_mask(d)
+        return d[valid], np.asarray(feeds[lo:lo + CALC_BLOCK][valid], dtype=np.float64)
+
+    @staticmethod
+    def _decades(v_min, v_max):
+        lo = math.floor(math.log10(v_min))
+        return lo, max(math.ceil(math.log10(v_max)), lo + 1)
+
+    def build_segment_index(self, data_dict, progress_callback=None) -> "SegmentIndex":
+        """
+        Uniform grid over the segment bounding boxes (X, Y, Z), for picking
+        segments by position. Returns None when cancelled.
+        """
+        progress = ProgressReporter.wrap(progress_callback)
+        profile = StageProfile.of(data_dict)
+        profile.discard('spatial')
+        try:
+            with profile.stage('spatial', lines=len(data_dict['matrix'])):
+                index = SegmentIndex(*self.segment_coordinates(data_dict), progress=progress)
+        except AnalysisCancelled:
+            return None
+        data_dict['profile'] = profile.to_dict()
+        return index
+
+    def segment_coordinates(self, data_dict) -> tuple:
+        """X, Y, Z columns of the matrix (zeros for an axis a compact result dropped)."""
+        matrix = data_dict['matrix']
+        matrix_axes = data_dict.get('matrix_axes', list(AXIS_MAP))
+        return tuple(matrix[:, matrix_axes.index(ax)] if ax in matrix_axes
+                     else np.broadcast_to(np.float64(0.0), len(matrix)) for ax in 'XYZ')
+
+    def segment_lines(self, data_dict, segments) -> np.ndarray:
+        """Source line numbers of segment indices (segment i ends on row i + 1)."""
+        return data_dict['lines'][np.asarray(segments, dtype=np.int64) + 1]
+
+    def calculate_metrics_and_stats(self, data_dict, bins, fixed_intervals, progress_callback=None, index=None):
+        """
+        Calculates histograms, Top N stats, and BPT.
+        Kept for callers of the tuple API; new code uses compute_stats().
+        """
+        if index is None:
+            index = self.build_distance_index(data_dict, progress_callback)
+            if index is None: return None
+        if len(index) == 0:
             return [], 0, 0, [], [], None
+        stats = self.compute_stats(data_dict, fixed_intervals, index)
+        return index.sorted_dists, stats.g01_dist, stats.time, stats.top(10), stats.top(3), stats.bpt
 
-        bin_indices = np.digitize(valid_dists, bins)
-        bin_counts = np.bincount(bin_indices, minlength=len(bins)+2)
-        bin_feed_sums = np.bincount(bin_indices, weights=valid_feeds, minlength=len(bins)+2)
-        
-        stats_list = []
-        total_count = len(valid_dists)
-        
-        for i, (s, e) in enumerate(fixed_intervals):
-            bin_idx = i + 1
-            if bin_idx >= len(bin_counts): break
-            count = bin_counts[bin_idx]
-            if count == 0: continue
-            
-            total_f = bin_feed_sums[bin_idx]
-            avg_f = total_f / count if count > 0 else 1000.0
-            
-            pct = (count / total_count) * 100
-            
-            def fmt_val(v):
-                if v == float('inf'): return "inf"
-                if v < 1.0: return f"{v*1000:.0f}um"
-                return f"{v:.3f}mm"
-            
-            label = f"{fmt_val(s)} ~ {fmt_val(e)}" if e != float('inf') else f"> {fmt_val(s)}"
-            
-            stats_list.append({
-                'label': label,
-                'count': count,
-                'pct': pct,
-                'avg_feed': avg_f,
-                'min_len': s,
-                'max_len': e
-            })
-            
-        stats_list.sort(key=lambda x: x['count'], reverse=True)
-        top_10 = stats_list[:10]
-        top_3 = stats_list[:3]
-        
-        bpt_info = None
-        if top_10:
-            top1 = top_10[0]
-            f_avg = top1['avg_feed']
-            if f_avg > 0:
-                min_bpt = (top1['min_len'] / f_avg) * 60000
-                m_len = top1['max_len']
-                if m_len == float('inf'): m_len = top1['min_len'] * 1.5
-                max_bpt = (m_len / f_avg) * 60000
-                bpt_info = {'range_str': f"{min_bpt:.2f}ms ~ {max_bpt:.2f}ms", 'f_avg': f_avg}
-
-        return valid_dists, data_dict['g01_dist'], data_dict['time'], top_10, top_3, bpt_info
-
-    def calculate_histogram_data(self, distances, bins):
-        hist, bin_edges = np.histogram(distances, bins=bins)
-        return hist, bin_edges
\ No newline at end of file
+    def export_stats_csv(self, stats: "SegmentStats", file_path: str):
+        """Interval table (count, share, average feed, Top-N rank) as CSV."""
+        labels, ranks = stats.labels, stats.ranks
+        with open(file_path, 'w', encoding='utf-8-sig', newline='') as f:
+            f.write("Interval,Min_mm,Max_mm,Count,Pct,Avg_Feed,Rank\n")
+            for i, (s, e) in enumerate(stats.intervals):
+                count = int(stats.counts[i])
+                avg_feed = f"{stats.avg_feeds[i]:.3f}" if count else ""
+                f.write(f"{_csv_quote(labels[i])},{s:g},{e:g},{count},"
+                        f"{stats.percentages[i]:.4f},{avg_feed},{int(ranks[i]) or ''}\n")
+
+    # ------------------------------------------------------------------
+    # CSV export
+    # ------------------------------------------------------------------
+    def csv_columns(self, data_dict) -> list:
+        """All exportable column names of a result, in export order."""
+        axes = [ax for ax in AXIS_MAP if ax in data_dict['axes']]
+        dist_cols = ["XYZ_Dist", "Rot_Deg", "Total_Dist"] if data_dict['is_tcp'] else ["Dist"]
+        return (["Line", "Mode"] + [f"Start_{ax}" for ax in axes] + [f"End_{ax}" for ax in axes]
+                + dist_cols + ["Feed", "Info"])
+
+    def _csv_column_source(self, data_dict, name):
+        """
+        (printf format, getter(start, end) -> values of segments start..end-1)
+        for one column. Text constant across the file is baked into the format.
+        """
+        if name == "Line":
+            return '%d', lambda s, e: data_dict['lines'][s + 1:e + 1]
+        if name == "Mode":
+            return _csv_quote(data_dict['calc_mode']).replace('%', '%%'), None
+        if name == "Feed":
+            return _csv_float_fmt(data_dict['feeds']), lambda s, e: data_dict['feeds'][s + 1:e + 1]
+        if name == "Info":
+            # G00 / G01 from the mode code
+            return 'G0%d', lambda s, e: data_dict['modes'][s + 1:e + 1] != 0
+        if name in ("Dist", "Total_Dist"):
+            return _csv_float_fmt(data_dict['dists']), lambda s, e: data_dict['dists'][s:e]
+        if name == "XYZ_Dist":
+            return _csv_float_fmt(data_dict['dists_xyz']), lambda s, e: data_dict['dists_xyz'][s:e]
+        if name == "Rot_Deg":
+            return _csv_float_fmt(data_dict['rots_deg']), lambda s, e: data_dict['rots_deg'][s:e]
+        if name.startswith(("Start_", "End_")):
+            which, ax = name.split('_', 1)
+            if ax in AXIS_MAP and ax in data_dict['axes']:
+                col = self.matrix_columns(data_dict, [ax])[0]
+                shift = 1 if which == "End" else 0
+                return (_csv_float_fmt(data_dict['matrix']),
+                        lambda s, e: data_dict['matrix'][s + shift:e + shift, col])
+        raise ValueError(f"Unknown CSV column: {name}")
+
+    def export_csv(self, data_dict, file_path, columns=None, compress=None, progress_callback=None):
+        """
+        Writes one row per segment. Each block of CSV_BLOCK_ROWS rows is
+        formatted with a single printf over the stacked columns and written
+        with one call. columns selects a subset (default: csv_columns()),
+        compress='gzip' writes a gzip stream. Returns the number of rows,
+        or None when cancelled (the partial file is removed).
+        """
+        if columns is None: columns = self.csv_columns(data_dict)
+        if compress not in (None, 'gzip'):
+            raise ValueError(f"Unsupported compression: {compress}")
+
+        sources = [self._csv_column_source(data_dict, name) for name in columns]
+        row_fmt = ','.join(fmt for fmt, _ in sources) + '\n'
+        getters = [get for _, get in sources if get is not None]
+        total = len(data_dict['dists'])
+        progress = ProgressReporter.wrap(progress_callback)
+
+        if compress == 'gzip':
+            # Level 6: near level 9 ratio on CSV text at a fraction of the time
+            stream = gzip.open(file_path, 'wb', compresslevel=6)
+        else:
+            stream = open(file_path, 'wb')
+        try:
+            with stream as f:
+                # BOM so Excel opens the UTF-8 (Chinese) text correctly
+                f.write(UTF8_BOM + (','.join(_csv_quote(c) for c in columns) + '\n').encode('utf-8'))
+                block = np.empty((min(CSV_BLOCK_ROWS, total), len(getters)), dtype=np.float64)
+                for start in range(0, total, CSV_BLOCK_ROWS):
+                    end = min(start + CSV_BLOCK_ROWS, total)
+                    n = end - start
+                    for j, get in enumerate(getters):
+                        block[:n, j] = get(start, end)
+                    if getters:
+                        text = (row_fmt * n) % tuple(block[:n].ravel().tolist())
+                    else:
+                        text = row_fmt * n
+                    f.write(text.encode('utf-8'))
+                    progress.update((end / total) * 100, "Exporting CSV")
+        except AnalysisCancelled:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            return None
+        return total
+
+
+class DistanceIndex:
+    """
+    Valid segment lengths sorted once, with the running sum of their feeds.
+    Counts and feed sums of any bin layout then come from searchsorted in
+    O(bins * log n) instead of a pass over every segment.
+    """
+
+    def __init__(self, valid_dists: np.ndarray, valid_feeds: np.ndarray, progress=None):
+        valid_dists = np.asarray(valid_dists, dtype=np.float64)
+        order = _stable_argsort(valid_dists, progress)
+        self.sorted_dists = valid_dists[order]
+        self.feed_prefix = np.zeros(len(order) + 1, dtype=np.float64)
+        np.cumsum(np.asarray(valid_feeds, dtype=np.float64)[order], out=self.feed_prefix[1:])
+
+    @classmethod
+    def from_sorted(cls, sorted_dists: np.ndarray, feed_prefix: np.ndarray) -> "DistanceIndex":
+        """Wraps arrays that are already sorted (e.g. mapped from another process)."""
+        index = cls.__new__(cls)
+        index.sorted_dists = sorted_dists
+        index.feed_prefix = feed_prefix
+        return index
+
+    def __len__(self):
+        return len(self.sorted_dists)
+
+    def bin_stats(self, bins):
+        """
+        (counts, feed_sums) per interval bins[i] <= d < bins[i+1]
+        (same edges rule as np.digitize / np.histogram without the closed last bin).
+        """
+        pos = np.searchsorted(self.sorted_dists, np.asarray(bins, dtype=np.float64), side='left')
+        return np.diff(pos), np.diff(self.feed_prefix[pos])
+
+
+@dataclass(frozen=True)
+class SegmentStats:
+    """
+    Immutable interval statistics: counts and feed sums per interval plus
+    everything derived from them (shares, average feeds, Top-N ranks, BPT).
+    Nothing here touches the per-segment arrays again.
+    """
+    intervals: tuple        # ((min_len, max_len), ...)
+    counts: np.ndarray      # segments per interval
+    feed_sums: np.ndarray   # summed feed per interval
+    total_count: int        # valid segments (all intervals and outside)
+    g01_dist: float
+    time: float
+
+    TOP_N = 10
+
+    def __post_init__(self):
+        for name in ('counts', 'feed_sums'):
+            arr = np.array(getattr(self, name))
+            arr.setflags(write=False)
+            object.__setattr__(self, name, arr)
+
+    @property
+    def percentages(self) -> np.ndarray:
+        if self.total_count == 0:
+            return np.zeros(len(self.counts))
+        return self.counts / self.total_count * 100
+
+    @property
+    def avg_feeds(self) -> np.ndarray:
+        counts = self.counts
+        return np.where(counts > 0, self.feed_sums / np.maximum(counts, 1), 1000.0)
+
+    @property
+    def labels(self) -> list:
+        def fmt_val(v):
+            if v == float('inf'): return "inf"
+            if v < 1.0: return f"{v*1000:.0f}um"
+            return f"{v:.3f}mm"
+        return [f"{fmt_val(s)} ~ {fmt_val(e)}" if e != float('inf') else f"> {fmt_val(s)}"
+                for s, e in self.intervals]
+
+    @property
+    def ranking(self) -> list:
+        """Non-empty interval indices by count, largest first (ties keep interval order)."""
+        counts = self.counts.tolist()
+        return sorted((i for i, c in enumerate(counts) if c > 0), key=lambda i: -counts[i])
+
+    @property
+    def ranks(self) -> np.ndarray:
+        """1-based Top-N rank per interval, 0 outside the Top-N."""
+        ranks = np.zeros(len(self.counts), dtype=np.int64)
+        for rank, i in enumerate(self.ranking[:self.TOP_N]):
+            ranks[i] = rank + 1
+        return ranks
+
+    def top(self, n) -> list:
+        """Top-n intervals as dicts (label, count, pct, avg_feed, min_len, max_len)."""
+        labels, pcts, feeds = self.labels, self.percentages, self.avg_feeds
+        return [{
+            'label': labels[i],
+            'count': int(self.counts[i]),
+            'pct': float(pcts[i]),
+            'avg_feed': float(feeds[i]),
+            'min_len': self.intervals[i][0],
+            'max_len': self.intervals[i][1]
+        } for i in self.ranking[:n]]
+
+    @property
+    def bpt(self):
+        top = self.top(1)
+        if not top: return None
+        top1 = top[0]
+        f_avg = top1['avg_feed']
+        if f_avg <= 0: return None
+        min_bpt = (top1['min_len'] / f_avg) * 60000
+        m_len = top1['max_len']
+        if m_len == float('inf'): m_len = top1['min_len'] * 1.5
+        max_bpt = (m_len / f_avg) * 60000
+        return {'range_str': f"{min_bpt:.2f}ms ~ {max_bpt:.2f}ms", 'f_avg': f_avg}
+
+    def to_dict(self) -> dict:
+        """JSON-friendly form (inf edges as strings)."""
+        return {
+            'intervals': [[s, "inf" if e == float('inf') else e] for s, e in self.intervals],
+            'counts': self.counts.tolist(),
+            'feed_sums': self.feed_sums.tolist(),
+            'total_count': self.total_count,
+            'g01_dist': self.g01_dist,
+            'time': self.time,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "SegmentStats":
+        intervals = tuple((float(s), float(e)) for s, e in d['intervals'])
+        return cls(intervals, np.asarray(d['counts'], dtype=np.int64), np.asarray(d['feed_sums'], dtype=np.float64),
+                   int(d['total_count']), float(d['g01_dist']), float(d['time']))
+
+
+@dataclass(frozen=True)
+class FeedDensity:
+    """
+    2D histogram of segments over feed and segment length (log-spaced bins):
+    counts[i, j] = segments with feed_edges[i] <= F < feed_edges[i + 1] and
+    dist_edges[j] <= D < dist_edges[j + 1]. Shows which feed regimes make
+    the short blocks that limit block processing time.
+    """
+    dist_edges: np.ndarray  # mm
+    feed_edges: np.ndarray  # mm/min
+    counts: np.ndarray      # (len(feed_edges) - 1, len(dist_edges) - 1)
+    no_feed: int            # valid segments without a positive feed
+
+    def __post_init__(self):
+        for name in ('dist_edges', 'feed_edges', 'counts'):
+            arr = np.array(getattr(self, name))
+            arr.setflags(write=False)
+            object.__setattr__(self, name, arr)
+
+    @property
+    def total_count(self) -> int:
+        return int(self.counts.sum()) + self.no_feed
+
+    def to_dict(self) -> dict:
+        return {
+            'dist_edges': self.dist_edges.tolist(),
+            'feed_edges': self.feed_edges.tolist(),
+            'counts': self.counts.tolist(),
+            'no_feed': self.no_feed,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "FeedDensity":
+        dist_edges = np.asarray(d['dist_edges'], dtype=np.float64)
+        feed_edges = np.asarray(d['feed_edges'], dtype=np.float64)
+        counts = np.asarray(d['counts'], dtype=np.int64).reshape(max(len(feed_edges) - 1, 0),
+                                                               max(len(dist_edges) - 1, 0))
+        return cls(dist_edges, feed_edges, counts, int(d['no_feed']))
+
+
+class SegmentIndex:
+    """
+    Uniform grid over the bounding boxes of the path segments (segment i runs
+    from row i to row i + 1). Every segment is listed in each cell its box
+    overlaps, in CSR form: cell_segs[cell_start[c]:cell_start[c + 1]].
+    Segments that would cover more than GRID_MAX_CELLS_PER_SEGMENT cells
+    (long rapids) go to `oversize` and are checked on every query instead.
+
+    dims selects the axes a query measures in (0=X, 1=Y, 2=Z): a pick in the
+    XY view uses dims=(0, 1) and ignores Z.
+    """
+
+    ARRAYS = ('origin', 'shape', 'cell', 'cell_start', 'cell_segs', 'oversize')
+
+    def __init__(self, x, y, z, progress=None):
+        self.coords = (x, y, z)
+        self.n = max(len(x) - 1, 0)
+        lo = np.array([float(c.min()) if len(c) else 0.0 for c in self.coords])
+        hi = np.array([float(c.max()) if len(c) else 0.0 for c in self.coords])
+        self.origin = lo
+        self.cell = np.array([self._cell_size(hi - lo)])
+        self.shape = np.maximum(np.floor((hi - lo) / self.cell[0]).astype(np.int64) + 1, 1)
+        self._build(progress)
+
+    def _cell_size(self, extent) -> float:
+        """
+        Cubic cell edge. Starts from an even spread over the bounding volume,
+        then halves while the cells a sample of path points occupies hold
+        more than GRID_SEGMENTS_PER_CELL segments each (tool paths fill
+        surfaces, not volumes), keeping at most 4 cells per segment.
+        Nearly flat axes (GRID_FLAT_RATIO) are left out of the spread.
+        """
+        used = extent > extent.max() * GRID_FLAT_RATIO
+        if not used.any():
+            return 1.0
+        cell = float(np.prod(extent[used]) / max(self.n / GRID_SEGMENTS_PER_CELL, 1.0)) ** (1.0 / used.sum())
+        limit = 4 * max(self.n, 1)
+        while np.prod(np.floor(extent / cell) + 1) > limit:
+            cell *= 2
+        step = max(self.n // 262144, 1)
+        sample = np.column_stack([c[::step] for c in self.coords]) - self.origin
+        for _ in range(16):
+            finer = cell / 2
+            if np.prod(np.floor(extent / finer) + 1) > limit:
+                break
+            sx, sy, _sz = (np.floor(extent / cell) + 1).astype(np.int64)
+            c = np.floor(sample / cell).astype(np.int64)
+            occupied = len(np.unique((c[:, 2] * sy + c[:, 1]) * sx + c[:, 0]))
+            if self.n / occupied <= GRID_SEGMENTS_PER_CELL:
+                break
+            cell = finer
+        return cell
+
+    def _build(self, progress):
+        sx, sy, sz = (int(v) for v in self.shape)
+        n_cells = sx * sy * sz
+        cell_dtype = np.int32 if n_cells < 2 ** 31 else np.int64
+        seg_dtype = np.int32 if self.n < 2 ** 31 else np.int64
+        cell_ids, seg_ids, oversize = [], [], []
+        for lo in range(0, self.n, CALC_BLOCK):
+            hi = min(lo + CALC_BLOCK, self.n)
+            first = np.empty((hi - lo, 3), dtype=np.int64)
+            span = np.empty((hi - lo, 3), dtype=np.int64)
+            for axis, c in enumerate(self.coords):
+                a, b = c[lo:hi], c[lo + 1:hi + 1]
+                c0 = self._cell_of(np.minimum(a, b), axis)
+                first[:, axis] = c0
+                span[:, axis] = self._cell_of(np.maximum(a, b), axis) - c0 + 1
+            count = span.prod(axis=1)
+            big = count > GRID_MAX_CELLS_PER_SEGMENT
+            if big.any():
+                oversize.append(np.flatnonzero(big) + lo)
+                count[big] = 0
+            # Most segments stay inside one cell
+            single = np.flatnonzero(count == 1)
+            cell_ids.append(((first[single, 2] * sy + first[single, 1]) * sx + first[single, 0]).astype(cell_dtype))
+            seg_ids.append((single + lo).astype(seg_dtype))
+            # The others get one entry per covered cell: t walks their span box
+            multi = np.flatnonzero(count > 1)
+            if len(multi):
+                reps = count[multi]
+                seg = np.repeat(multi, reps)
+                t = np.arange(len(seg)) - np.repeat(np.cumsum(reps) - reps, reps)
+                off = span[seg]
+                cx = first[seg, 0] + t % off[:, 0]
+                cy = first[seg, 1] + (t // off[:, 0]) % off[:, 1]
+                cz = first[seg, 2] + t // (off[:, 0] * off[:, 1])
+                cell_ids.append(((cz * sy + cy) * sx + cx).astype(cell_dtype))
+                seg_ids.append((seg + lo).astype(seg_dtype))
+            if progress is not None:
+                progress.update(hi / max(self.n, 1) * 100, "Building Spatial Index")
+
+        cell_ids = np.concatenate(cell_ids) if cell_ids else np.empty(0, dtype=cell_dtype)
+        seg_ids = np.concatenate(seg_ids) if seg_ids else np.empty(0, dtype=seg_dtype)
+        # Consecutive segments mostly share cells: the stable sort sees long runs
+        order = np.argsort(cell_ids, kind='stable')
+        index_dtype = np.int32 if max(self.n, len(seg_ids)) < 2 ** 31 else np.int64
+        self.cell_segs = seg_ids[order].astype(index_dtype)
+        self.cell_start = np.zeros(n_cells + 1, dtype=index_dtype)
+        np.cumsum(np.bincount(cell_ids, minlength=n_cells), out=self.cell_start[1:])
+        self.oversize = (np.concatenate(oversize) if oversize else np.empty(0, dtype=np.int64)).astype(index_dtype)
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, x, y, z) -> "SegmentIndex":
+        """Wraps stored arrays (see ARRAYS) around the coordinate columns."""
+        index = cls.__new__(cls)
+        index.coords = (x, y, z)
+        index.n = max(len(x) - 1, 0)
+        for name in cls.ARRAYS:
+            setattr(index, name, arrays[name])
+        return index
+
+    def arrays(self) -> dict:
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def _cell_of(self, values, axis):
+        idx = np.floor((values - self.origin[axis]) / self.cell[0]).astype(np.int64)
+        return np.clip(idx, 0, int(self.shape[axis]) - 1)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def box(self, lo, hi, dims=(0, 1, 2)) -> np.ndarray:
+        """Sorted indices of segments whose bounding box meets lo..hi on dims."""
+        ranges = []
+        for axis in range(3):
+            if axis in dims:
+                if hi[axis] < self.origin[axis] or lo[axis] > self.origin[axis] + self.shape[axis] * self.cell[0]:
+                    cells = np.empty(0, dtype=np.int64)
+                else:
+                    cells = np.arange(self._cell_of(np.float64(lo[axis]), axis),
+                                      self._cell_of(np.float64(hi[axis]), axis) + 1)
+            else:
+                cells = np.arange(int(self.shape[axis]))
+            ranges.append(cells)
+        sx, sy = int(self.shape[0]), int(self.shape[1])
+        cells = ((ranges[2][:, None, None] * sy + ranges[1][None, :, None]) * sx + ranges[0][None, None, :]).ravel()
+        starts, stops = self.cell_start[cells], self.cell_start[cells + 1]
+        count = (stops - starts).astype(np.int64)
+        pos = np.repeat(starts.astype(np.int64) - np.cumsum(count) + count, count) + np.arange(count.sum())
+        candidates = np.union1d(self.cell_segs[pos], self.oversize).astype(np.int64)
+        if not len(candidates):
+            return candidates
+        keep = np.ones(len(candidates), dtype=bool)
+        for axis in dims:
+            c = self.coords[axis]
+            a, b = c[candidates], c[candidates + 1]
+            keep &= (np.maximum(a, b) >= lo[axis]) & (np.minimum(a, b) <= hi[axis])
+        return candidates[keep]
+
+    def distances(self, point, segments, dims=(0, 1, 2)) -> np.ndarray:
+        """Distance from point to each segment, measured on dims."""
+        a = np.column_stack([self.coords[axis][segments] for axis in dims])
+        d = np.column_stack([self.coords[axis][segments + 1] for axis in dims]) - a
+        p = np.asarray([point[axis] for axis in dims], dtype=np.float64) - a
+        length2 = (d * d).sum(axis=1)
+        t = np.clip((p * d).sum(axis=1) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+        return np.sqrt(((p - t[:, None] * d) ** 2).sum(axis=1))
+
+    def nearest(self, point, dims=(0, 1, 2), max_dist=float('inf')):
+        """
+        (segment index, distance) of the segment closest to point on dims, or
+        None when none lies within max_dist. Searches boxes of growing size
+        until the best hit is inside the searched radius.
+        """
+        if self.n == 0:
+            return None
+        radius = float(self.cell[0])
+        limit = min(max_dist, float(np.sqrt(((self.shape * self.cell[0]) ** 2).sum())) +
+                    float(np.abs(np.asarray(point, dtype=np.float64) - self.origin).max()))
+        while True:
+            r = min(radius, limit)
+            lo = [point[axis] - r for axis in range(3)]
+            hi = [point[axis] + r for axis in range(3)]
+            segments = self.box(lo, hi, dims)
+            if len(segments):
+                dist = self.distances(point, segments, dims)
+                best = int(np.argmin(dist))
+                if dist[best] <= r:
+                    return (int(segments[best]), float(dist[best])) if dist[best] <= max_dist else None
+            if r >= limit:
+                return None
+            radius *= 2
+
+
+class SourceLines:
+    """
+    Random access to source lines by parser line number (1-based), comments
+    removed exactly as the parser saw them (or raw, for the source viewer).
+
+    Reads start at the nearest known line start (mark) at or before the
+    line. Marks come from the result's line_offsets when the parser recorded
+    them; otherwise every LINE_INDEX_STRIDE-th line start is collected while
+    scanning forward, and only as far as the highest line requested so far.
+    Either way a read touches at most LINE_INDEX_STRIDE lines of the file.
+    """
+
+    def __init__(self, file_path: str, encoding: str = None, line_offsets=None):
+        """line_offsets: (n, 2) [line number, byte offset] from parse_file()."""
+        self.file_path = file_path
+        self._text_lines = None
+        self.encoding = encoding or GCodeAnalyzer().detect_encoding(file_path)
+        # UTF-16/32 newlines are not single bytes: those files are re-decoded on demand
+        self._byte_level = not codecs.lookup(self.encoding).name.startswith(('utf-16', 'utf-32'))
+
+        self._size = os.path.getsize(file_path)
+        start = 0
+        if self._byte_level:
+            with open(file_path, 'rb') as f:
+                if f.read(len(UTF8_BOM)) == UTF8_BOM:
+                    start = len(UTF8_BOM)
+        # Line _mark_lines[j] starts at byte _mark_offsets[j] (both ascending)
+        self._mark_lines = [1]
+        self._mark_offsets = [start]
+        self._scan_pos = start
+        self._scan_lines = 0
+        if line_offsets is not None and len(line_offsets) and self._byte_level:
+            self._mark_lines = [int(n) for n in line_offsets[:, 0]]
+            self._mark_offsets = [int(o) for o in line_offsets[:, 1]]
+            # The parser saw the whole file: no forward scan needed
+            self._scan_pos = self._size
+
+    @classmethod
+    def from_text(cls, text: str) -> "SourceLines":
+        """Line access for content parsed from memory (parse_and_calculate)."""
+        obj = cls.__new__(cls)
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        obj._text_lines = text.split('\n')
+        return obj
+
+    def get(self, line_numbers, raw=False) -> list:
+        """Text of each requested line ('' past the end of the file); raw keeps comments."""
+        line_numbers = [int(n) for n in line_numbers]
+        text = self._lines(set(line_numbers))
+        if raw:
+            return [text.get(n, '') for n in line_numbers]
+        return [COMMENT_RE.sub('', text.get(n, '')) for n in line_numbers]
+
+    def context(self, line_number: int, before: int, after: int) -> list:
+        """[(line number, raw text)] from line_number - before to + after, within the file."""
+        line_number = int(line_number)
+        text = self._lines(set(range(max(line_number - before, 1), line_number + after + 1)))
+        return sorted(text.items())
+
+    def _lines(self, wanted) -> dict:
+        """line number -> raw text for the wanted lines that exist."""
+        if self._text_lines is not None:
+            lines = self._text_lines
+            return {n: lines[n - 1] for n in wanted if 0 < n <= len(lines)}
+        if self._byte_level:
+            return self._read_bytes_lines(wanted)
+        return self._read_decoded_lines(wanted)
+
+    def _read_bytes_lines(self, wanted) -> dict:
+        out = {}
+        if not wanted or self._size == 0:
+            return out
+        self._extend_marks(max(wanted))
+
+        groups = {}
+        for n in wanted:
+            if n < 1: continue
+            groups.setdefault(bisect.bisect_right(self._mark_lines, n) - 1, []).append(n)
+
+        with open(self.file_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for j, numbers in groups.items():
+                    last = max(numbers)
+                    line = self._mark_lines[j]
+                    for start, stop in self._iter_lines(mm, self._mark_offsets[j]):
+                        if line in numbers:
+                            out[line] = mm[start:stop].decode(self.encoding, errors='replace')
+                        if line >= last: break
+                        line += 1
+            finally:
+                mm.close()
+        return out
+
+    def _iter_lines(self, mm, pos):
+        """(start, stop) byte range of each line from pos on, line break excluded."""
+        size = self._size
+        while pos < size:
+            ends, breaks = self._scan_breaks(mm, pos)
+            for end, brk in zip(ends.tolist(), breaks.tolist()):
+                yield pos, end
+                pos = end + brk
+            if not len(ends):
+                # No line break left: the rest is the last line
+                yield pos, size
+                return
+
+    def _scan_breaks(self, mm, pos):
+        """
+        Line ends from pos on (absolute offsets of the first break byte) and the
+        length of each break: 1 for LF or a bare CR, 2 for CRLF. pos must be a
+        line start. The block grows until it holds a break or reaches EOF.
+        """
+        size = self._size
+        block_size = SOURCE_SCAN_BLOCK
+        while True:
+            end = min(pos + block_size, size)
+            block = np.frombuffer(mm, dtype=np.uint8, count=end - pos, offset=pos)
+            cr = block == ORD_CR
+            nl = block == ORD_NL
+            # The LF of a CRLF is not a line end of its own
+            nl[1:] &= ~cr[:-1]
+            ends = np.flatnonzero(cr | nl)
+            if len(ends) or end == size:
+                break
+            block_size *= 2
+
+        nxt = ends + 1
+        crlf = np.zeros(len(ends), dtype=bool)
+        inside = nxt < len(block)
+        crlf[inside] = block[nxt[inside]] == ORD_NL
+        if len(ends) and not inside[-1] and end < size:
+            crlf[-1] = mm[end] == ORD_NL
+        crlf &= cr[ends]
+        del block
+        return ends + pos, 1 + crlf.astype(np.int64)
+
+    def _extend_marks(self, line_number):
+        """Scans forward until a mark within LINE_INDEX_STRIDE lines before line_number is known."""
+        if line_number < self._mark_lines[-1] + LINE_INDEX_STRIDE or self._scan_pos >= self._size:
+            return
+        with open(self.file_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                while line_number >= self._mark_lines[-1] + LINE_INDEX_STRIDE and self._scan_pos < self._size:
+                    ends, breaks = self._scan_breaks(mm, self._scan_pos)
+                    if not len(ends):
+                        self._scan_pos = self._size
+                        break
+                    starts = ends + breaks
+                    # starts[k] begins line _scan_lines + k + 2
+                    first = self._scan_lines + 2
+                    numbers = np.arange(first, first + len(starts))
+                    hit = ((numbers - 1) % LINE_INDEX_STRIDE == 0) & (starts < self._size)
+                    self._mark_lines.extend(numbers[hit].tolist())
+                    self._mark_offsets.extend(starts[hit].tolist())
+                    self._scan_lines += len(starts)
+                    self._scan_pos = int(starts[-1])
+            finally:
+                mm.close()
+
+    def _read_decoded_lines(self, wanted) -> dict:
+        out = {}
+        if not wanted:
+            return out
+        last = max(wanted)
+        line, carry = 0, ''
+        for chunk in GCodeAnalyzer().read_file_generator(self.file_path, encoding=self.encoding):
+            pieces = (carry + chunk).split('\n')
+            carry = pieces.pop()
+            for piece in pieces:
+                line += 1
+                if line in wanted: out[line] = piece
+            if line >= last:
+                return out
+        if carry and line + 1 in wanted:
+            out[line + 1] = carry
+        return out
+
+
+def _stable_argsort(values: np.ndarray, progress=None) -> np.ndarray:
+    """
+    np.argsort(kind='stable') done as SORT_BLOCK sorted runs with a progress
+    check between them; the last stable sort only merges the runs.
+    Ties keep their original order, so the result is identical.
+    """
+    n = len(values)
+    if n <= SORT_BLOCK:
+        return np.argsort(values, kind='stable')
+    order = np.empty(n, dtype=np.intp)
+    for lo in range(0, n, SORT_BLOCK):
+        hi = min(lo + SORT_BLOCK, n)
+        np.add(np.argsort(values[lo:hi], kind='stable'), lo, out=order[lo:hi])
+        if progress: progress.check()
+    return order[np.argsort(values[order], kind='stable')]
+
+
+def _csv_quote(text: str) -> str:
+    """Minimal CSV quoting (same rule as csv.QUOTE_MINIMAL)."""
+    if any(ch in text for ch in ',"\r\n'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def _csv_float_fmt(values) -> str:
+    """Round-trip printf format for a float column (float32 columns of compact results)."""
+    return CSV_FLOAT_FMT.get(np.asarray(values).dtype, CSV_FLOAT_FMT[np.dtype(np.float64)])
+
+
+def _parse_slice_job(file_path, start, end, encoding):
+    """Process pool entry point (must be importable at module level)."""
+    cpu = time.process_time()
+    result = GCodeAnalyzer()._parse_slice(file_path, start, end, encoding)
+    result['cpu_s'] = time.process_time() - cpu
+    result['peak_rss'] = memory_usage()[1]
+    return result
+
+
+if __name__ == "__main__":
+    # python -m backend analyze/serve/watch ...: headless modes (no Tk, matplotlib or PIL)
+    import sys
+    from batch import main
+    sys.exit(main())
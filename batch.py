@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# Project:      CAM Analyzer
+# File:         batch.py
+# Author:       TFC-CRM
+# Created:      2025-12-12
+# Copyright:    (c) 2025 TFC-CRM. All rights reserved.
+# License:      Proprietary / Confidential
+# Description:  Headless batch analysis (python -m backend analyze ...)
+#               and the command line of the HTTP service (... serve)
+#               and the watch-folder daemon (... watch).
+#               Writes one JSON report per file plus an aggregate table.
+#               Only the engine is imported: no Tk, matplotlib or PIL.
+# ------------------------------------------------------------------------------
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from backend import GCodeAnalyzer, DEFAULT_INTERVALS, format_profile
+
+SUMMARY_FILE = "summary.csv"
+SUMMARY_COLUMNS = ["file", "status", "total_lines", "segments", "total_mm", "g01_mm", "g00_mm",
+                   "time_min", "top1_interval", "top1_pct", "bpt", "calc_mode", "elapsed_s", "error"]
+
+
+# ------------------------------------------------------------------------------
+# Inputs
+# ------------------------------------------------------------------------------
+def expand_inputs(patterns) -> list:
+    """
+    Files and glob patterns (** allowed) -> unique file paths, in order.
+    Literal paths are kept even when missing, so they show up as errors.
+    """
+    files, seen = [], set()
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = [p for p in sorted(glob.glob(pattern, recursive=True)) if os.path.isfile(p)]
+        else:
+            matches = [pattern]
+        for path in matches:
+            key = os.path.abspath(path)
+            if key not in seen:
+                seen.add(key)
+                files.append(path)
+    return files
+
+
+def parse_edges(text: str) -> list:
+    """'0, 0.001, 0.01, inf' -> [(0, 0.001), (0.001, 0.01), (0.01, inf)]"""
+    try:
+        edges = [float(tok) for tok in text.replace(',', ' ').split()]
+    except ValueError:
+        raise argparse.ArgumentTypeError("interval edges must be numbers (inf allowed)")
+    if len(edges) < 2:
+        raise argparse.ArgumentTypeError("at least two interval edges are required")
+    if any(e != e for e in edges) or edges[0] < 0:
+        raise argparse.ArgumentTypeError("interval edges must not be negative or NaN")
+    if any(b <= a for a, b in zip(edges, edges[1:])):
+        raise argparse.ArgumentTypeError("interval edges must be strictly increasing")
+    return list(zip(edges[:-1], edges[1:]))
+
+
+# ------------------------------------------------------------------------------
+# Per-file analysis (runs in the pool workers)
+# ------------------------------------------------------------------------------
+def analyze_file(path: str, intervals, compact=False, workers=1, profile=False, cprofile_path=None) -> dict:
+    """
+    Parses one file and returns its JSON report.
+    profile adds the per-stage timings; cprofile_path dumps a cProfile of the parse loop.
+    """
+    engine = GCodeAnalyzer()
+    engine.compact_results = compact
+    engine.cprofile_path = cprofile_path
+    start = time.perf_counter()
+    data = engine.parse_file(path, workers=workers)
+    stats = engine.compute_stats(data, intervals)
+    report = build_report(path, data, stats, time.perf_counter() - start)
+    if profile:
+        report['profile'] = data['profile']
+    return report
+
+
+def build_report(path: str, data: dict, stats, elapsed: float) -> dict:
+    """JSON report of one result (KPIs, Top-N, BPT and the interval table)."""
+    g00, g01 = float(data['g00_dist']), float(data['g01_dist'])
+    total_seconds = int(float(data['time']) * 60)
+    bins = []
+    for i, (s, e) in enumerate(stats.intervals):
+        bins.append({
+            'label': stats.labels[i],
+            'min_len': s,
+            'max_len': e,
+            'count': int(stats.counts[i]),
+            'pct': float(stats.percentages[i]),
+            'avg_feed': float(stats.avg_feeds[i]) if stats.counts[i] else None,
+            'rank': int(stats.ranks[i]) or None,
+        })
+    return _json_safe({
+        'file': os.path.abspath(path),
+        'status': 'ok',
+        'size_bytes': os.path.getsize(path),
+        'engine_version': GCodeAnalyzer.ENGINE_VERSION,
+        'calc_mode': data['calc_mode'],
+        'is_tcp': bool(data['is_tcp']),
+        'axes': list(data['axes']),
+        'total_lines': int(data['total_lines']),
+        'segments': int(stats.total_count),
+        'skipped_lines': int(len(data['skipped_lines'])),
+        'distance_mm': {'total': g00 + g01, 'g01': g01, 'g00': g00},
+        'time_min': float(data['time']),
+        'time_hms': f"{total_seconds // 3600:02d}:{total_seconds % 3600 // 60:02d}:{total_seconds % 60:02d}",
+        'top_bins': stats.top(stats.TOP_N),
+        'bpt': stats.bpt,
+        'bins': bins,
+        'elapsed_s': round(elapsed, 3),
+    })
+
+
+def _analyze_job(path, intervals, compact, workers, profile=False, cprofile_path=None):
+    """Pool entry point: failures become error reports instead of aborting the batch."""
+    try:
+        return analyze_file(path, intervals, compact, workers, profile, cprofile_path)
+    except Exception as e:
+        return {'file': os.path.abspath(path), 'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+
+
+def _json_safe(obj):
+    # JSON has no Infinity: open interval ends are written as "inf" (as SegmentStats.to_dict)
+    if isinstance(obj, float) and obj == float('inf'):
+        return "inf"
+    if isinstance(obj, dict):
+        return {k: _json_safe(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_json_safe(v) for v in obj]
+    return obj
+
+
+# ------------------------------------------------------------------------------
+# Outputs
+# ------------------------------------------------------------------------------
+def report_names(files) -> dict:
+    """path -> unique '<name>.json' (same file names in different folders get a suffix)."""
+    names, used = {}, set()
+    for path in files:
+        stem = os.path.basename(path)
+        name, n = f"{stem}.json", 1
+        while name.lower() in used:
+            n += 1
+            name = f"{stem}-{n}.json"
+        used.add(name.lower())
+        names[os.path.abspath(path)] = name
+    return names
+
+
+def summary_row(report: dict) -> dict:
+    row = {'file': report['file'], 'status': report['status'], 'error': report.get('error', '')}
+    if report['status'] != 'ok':
+        return row
+    top = report['top_bins'][0] if report['top_bins'] else None
+    row.update({
+        'total_lines': report['total_lines'],
+        'segments': report['segments'],
+        'total_mm': f"{report['distance_mm']['total']:.3f}",
+        'g01_mm': f"{report['distance_mm']['g01']:.3f}",
+        'g00_mm': f"{report['distance_mm']['g00']:.3f}",
+        'time_min': f"{report['time_min']:.3f}",
+        'top1_interval': top['label'] if top else '',
+        'top1_pct': f"{top['pct']:.2f}" if top else '',
+        'bpt': report['bpt']['range_str'] if report['bpt'] else '',
+        'calc_mode': report['calc_mode'],
+        'elapsed_s': f"{report['elapsed_s']:.2f}",
+    })
+    return row
+
+
+def total_row(reports) -> dict:
+    ok = [r for r in reports if r['status'] == 'ok']
+    return {
+        'file': f"TOTAL ({len(ok)}/{len(reports)} ok)",
+        'status': 'ok' if len(ok) == len(reports) else 'partial',
+        'total_lines': sum(r['total_lines'] for r in ok),
+        'segments': sum(r['segments'] for r in ok),
+        'total_mm': f"{sum(r['distance_mm']['total'] for r in ok):.3f}",
+        'g01_mm': f"{sum(r['distance_mm']['g01'] for r in ok):.3f}",
+        'g00_mm': f"{sum(r['distance_mm']['g00'] for r in ok):.3f}",
+        'time_min': f"{sum(r['time_min'] for r in ok):.3f}",
+        'elapsed_s': f"{sum(r['elapsed_s'] for r in ok):.2f}",
+    }
+
+
+def write_summary(reports, path: str):
+    # BOM so Excel opens the UTF-8 (Chinese) calc mode names correctly
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS, restval='')
+        writer.writeheader()
+        for report in reports:
+            writer.writerow(summary_row(report))
+        writer.writerow(total_row(reports))
+
+
+def format_table(reports) -> str:
+    """Fixed-width overview for the console."""
+    columns = [("file", 40), ("status", 7), ("total_lines", 11), ("total_mm", 14),
+               ("time_min", 10), ("top1_interval", 16), ("top1_pct", 8)]
+    rows = [summary_row(r) for r in reports] + [total_row(reports)]
+    lines = ["  ".join(f"{name:<{w}}" for name, w in columns)]
+    for row in rows:
+        cells = []
+        for name, w in columns:
+            text = str(row.get(name, ''))
+            if name == 'file' and len(text) > w:
+                text = "..." + text[-(w - 3):]
+            cells.append(f"{text:<{w}}")
+        lines.append("  ".join(cells).rstrip())
+    return "\n".join(lines)
+
+
+# ------------------------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------------------------
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m backend", description="CAM Analyzer headless mode")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("analyze", help="analyze G-code files and write JSON reports")
+    p.add_argument("inputs", nargs="+", help="files or glob patterns (quote patterns; ** recurses)")
+    p.add_argument("-o", "--out-dir", default="cam_reports", help="report folder (default: %(default)s)")
+    p.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                   help="files analyzed in parallel (default: all cores)")
+    p.add_argument("--bins", type=parse_edges, default=list(DEFAULT_INTERVALS),
+                   help="interval edges in mm, e.g. '0,0.001,0.01,0.1,1,inf'")
+    p.add_argument("--compact", action="store_true", help="keep only motion lines (less memory)")
+    p.add_argument("--profile", action="store_true", help="per-stage timings in the reports and on stderr")
+    p.add_argument("--cprofile", action="store_true",
+                   help="write a cProfile of each parse loop to <report>.prof (view with pstats/snakeviz)")
+    p.add_argument("-q", "--quiet", action="store_true", help="no per-file progress on stderr")
+
+    p = commands.add_parser("serve", help="run the local HTTP analysis service")
+    p.add_argument("--host", default="127.0.0.1", help="bind address (default: %(default)s)")
+    p.add_argument("--port", type=int, default=8765, help="port (default: %(default)s, 0 = any free port)")
+    p.add_argument("--data-dir", default=None, help="uploads and result cache (default: per-user cache folder)")
+    p.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="pool processes (default: all cores)")
+    p.add_argument("--max-queue", type=int, default=None, help="waiting analyses before 503 (default: 4 x jobs)")
+    p.add_argument("--max-upload-mb", type=int, default=2048, help="largest accepted program (default: %(default)s)")
+    p.add_argument("-q", "--quiet", action="store_true", help="no access log on stderr")
+
+    p = commands.add_parser("watch", help="analyze new or changed programs in a folder")
+    p.add_argument("folder", help="folder the post-processors write to")
+    p.add_argument("-r", "--recursive", action="store_true", help="include subfolders")
+    p.add_argument("--pattern", default="*.txt *.nc *.ncd *.tap", help="file patterns (default: %(default)s)")
+    p.add_argument("-o", "--out-dir", default=None, help="summary folder (default: beside each program)")
+    p.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                   help="files analyzed in parallel (default: all cores)")
+    p.add_argument("--bins", type=parse_edges, default=list(DEFAULT_INTERVALS),
+                   help="interval edges in mm, e.g. '0,0.001,0.01,0.1,1,inf'")
+    p.add_argument("--compact", action="store_true", help="keep only motion lines (less memory)")
+    p.add_argument("--poll", type=float, default=1.0, help="seconds between folder scans (default: %(default)s)")
+    p.add_argument("--settle", type=float, default=2.0,
+                   help="seconds a file must stay unchanged before it is analyzed (default: %(default)s)")
+    p.add_argument("--once", action="store_true", help="process the current files, then exit")
+    p.add_argument("-q", "--quiet", action="store_true", help="no per-file log on stderr")
+    return parser
+
+
+def run_analyze(args) -> int:
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("No input files matched.", file=sys.stderr)
+        return 2
+    os.makedirs(args.out_dir, exist_ok=True)
+    names = report_names(files)
+    jobs = max(1, min(args.jobs, len(files)))
+    # Few large files: parallelize inside each file instead of across files
+    workers = max(1, args.jobs // len(files)) if jobs == len(files) else 1
+
+    def cprofile_path(path):
+        if not args.cprofile: return None
+        return os.path.join(args.out_dir, names[os.path.abspath(path)][:-len(".json")] + ".prof")
+
+    reports = {}
+    def finished(report):
+        reports[report['file']] = report
+        with open(os.path.join(args.out_dir, names[report['file']]), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        if not args.quiet:
+            detail = f"{report['elapsed_s']:.2f}s" if report['status'] == 'ok' else report['error']
+            print(f"[{len(reports)}/{len(files)}] {report['file']}: {report['status']} ({detail})", file=sys.stderr)
+        if args.profile and 'profile' in report:
+            print("\n".join(format_profile(report['profile'])) + "\n", file=sys.stderr)
+
+    try:
+        if jobs == 1:
+            for path in files:
+                finished(_analyze_job(path, args.bins, args.compact, workers, args.profile, cprofile_path(path)))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(_analyze_job, path, args.bins, args.compact, workers,
+                                           args.profile, cprofile_path(path)) for path in files]
+                try:
+                    for fut in as_completed(futures):
+                        finished(fut.result())
+                except KeyboardInterrupt:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+    except KeyboardInterrupt:
+        print("Interrupted; writing the summary of finished files.", file=sys.stderr)
+
+    ordered = [reports[os.path.abspath(p)] for p in files if os.path.abspath(p) in reports]
+    write_summary(ordered, os.path.join(args.out_dir, SUMMARY_FILE))
+    print(format_table(ordered))
+    if len(ordered) < len(files):
+        return 130
+    return 0 if all(r['status'] == 'ok' for r in ordered) else 1
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == "analyze":
+        return run_analyze(args)
+    if args.command == "serve":
+        # Imported here: asyncio and the HTTP layer are not needed by analyze
+        from service import serve
+        return serve(args.host, args.port, data_dir=args.data_dir, workers=args.jobs, max_queue=args.max_queue,
+                     max_upload=args.max_upload_mb * 1024 * 1024, log=not args.quiet)
+    if args.command == "watch":
+        from watch import FolderWatcher
+        if not os.path.isdir(args.folder):
+            print(f"Not a folder: {args.folder}", file=sys.stderr)
+            return 2
+        watcher = FolderWatcher(args.folder, patterns=args.pattern.replace(',', ' ').split(),
+                                recursive=args.recursive, out_dir=args.out_dir, jobs=args.jobs,
+                                intervals=args.bins, compact=args.compact, settle=args.settle,
+                                poll=args.poll, log=not args.quiet)
+        return watcher.run(once=args.once)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
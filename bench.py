@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# Project:      CAM Analyzer
+# File:         bench.py
+# Author:       TFC-CRM
+# Created:      2025-12-12
+# Copyright:    (c) 2025 TFC-CRM. All rights reserved.
+# License:      Proprietary / Confidential
+# Description:  Engine benchmarks on deterministic synthetic G-code.
+#               python bench.py run | generate | compare
+#               Only the engine is imported: no Tk, matplotlib or PIL.
+# ------------------------------------------------------------------------------
+"""
+Every (program kind, line end, size) case is generated once into the data
+folder and reused. Each stage runs in a fresh process, so its peak RSS is
+not hidden by an earlier stage; 'rss_before_mb' is what the stage's setup
+(e.g. mapping the parsed result) already used.
+
+    python bench.py run --sizes 1MB,16MB --kinds micro3,tcp
+    python bench.py compare bench_results/old.json bench_results/new.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from backend import GCodeAnalyzer, DEFAULT_INTERVALS, memory_usage, reset_peak_rss
+from result_cache import ResultCache
+
+# Bump when the generated programs change (old files are then regenerated)
+GENERATOR_VERSION = 1
+GEN_BLOCK_LINES = 64 * 1024
+# parse_and_calculate needs the whole program as one str
+STR_STAGE_MAX_BYTES = 256 * 1024 ** 2
+# Share of matrix cells emptied again for the ffill stages (sparse axis words)
+FFILL_EMPTY_SHARE = 0.6
+# Stages shorter than this are not reported as regressions (timer noise)
+COMPARE_MIN_SECONDS = 0.05
+
+DEFAULT_SIZES = "1MB,16MB,128MB"
+FULL_SIZES = "1MB,16MB,256MB,1GB,5GB"
+DEFAULT_OUT_DIR = "bench_results"
+DEFAULT_DATA_DIR = os.path.join("bench_results", "data")
+
+HEADER = "%\nO1000 (SYNTHETIC BENCHMARK)\nG90 G21 G17\nT1 M06\nS12000 M03\nG00 X0. Y0. Z50.\nG01 F1500.\n"
+TCP_HEADER = HEADER + "G43.4 H1\n"
+FOOTER = "G00 Z50.\nM05\nM30\n%\n"
+
+
+# ------------------------------------------------------------------------------
+# Synthetic programs
+# ------------------------------------------------------------------------------
+def _walk(rng, pos, n, scale):
+    """Random walk of n points from pos; step lengths spread over the default bins."""
+    steps = rng.standard_normal((n, len(pos)))
+    steps /= np.linalg.norm(steps, axis=1, keepdims=True)
+    steps *= rng.lognormal(np.log(scale), 1.5, (n, 1))
+    points = pos + np.cumsum(steps, axis=0)
+    return points, points[-1]
+
+
+def _block_micro3(rng, state, n):
+    xyz, state['xyz'] = _walk(rng, state['xyz'], n, 0.02)
+    return ("X%.4f Y%.4f Z%.4f\n" * n) % tuple(xyz.ravel())
+
+
+def _block_abc5(rng, state, n):
+    xyz, state['xyz'] = _walk(rng, state['xyz'], n, 0.05)
+    abc, state['abc'] = _walk(rng, state['abc'], n, 0.01)
+    return ("X%.4f Y%.4f Z%.4f A%.3f B%.3f C%.3f\n" * n) % tuple(np.hstack((xyz, abc)).ravel())
+
+
+def _block_tcp(rng, state, n):
+    xyz, state['xyz'] = _walk(rng, state['xyz'], n, 0.05)
+    ijk, state['ijk'] = _walk(rng, state['ijk'], n, 0.002)
+    ijk[:, 2] = np.abs(ijk[:, 2]) + 1.0
+    ijk /= np.linalg.norm(ijk, axis=1, keepdims=True)
+    return ("X%.4f Y%.4f Z%.4f I%.6f J%.6f K%.6f\n" * n) % tuple(np.hstack((xyz, ijk)).ravel())
+
+
+def _block_comments(rng, state, n):
+    # Every motion line carries a comment and is followed by a comment-only line
+    half = max(n // 2, 1)
+    xyz, state['xyz'] = _walk(rng, state['xyz'], half, 0.02)
+    ops = rng.integers(1, 500, half)
+    values = np.column_stack((xyz, ops, ops)).ravel()
+    fmt = "X%.4f Y%.4f Z%.4f (PASS %d - FINISH CONTOUR)\n(OPERATION %d: TOOL 6MM BALL, STOCK 0.02)\n"
+    return (fmt * half) % tuple(values)
+
+
+def _block_mcodes(rng, state, n):
+    # Four motion lines, then a coolant / spindle / tool line
+    groups = max(n // 5, 1)
+    xyz, state['xyz'] = _walk(rng, state['xyz'], groups * 4, 0.02)
+    codes = rng.choice([7, 8, 9, 3, 5], groups)
+    speeds = rng.integers(8000, 24000, groups)
+    values = np.column_stack((xyz.reshape(groups, 12), codes, speeds)).ravel()
+    fmt = "X%.4f Y%.4f Z%.4f\n" * 4 + "M%02d S%d\n"
+    return (fmt * groups) % tuple(values)
+
+
+KINDS = {
+    'micro3': ("3-axis G01 micro-segments", HEADER, _block_micro3),
+    'abc5': ("5-axis XYZ + ABC", HEADER, _block_abc5),
+    'tcp': ("TCP (G43.4) with IJK tool vectors", TCP_HEADER, _block_tcp),
+    'comments': ("comment-heavy", HEADER, _block_comments),
+    'mcodes': ("M-code heavy", HEADER, _block_mcodes),
+}
+EOLS = ('lf', 'crlf')
+
+
+def program_name(kind: str, eol: str, size: int, seed: int) -> str:
+    return f"{kind}-{eol}-{format_size(size)}-s{seed}-v{GENERATOR_VERSION}.nc"
+
+
+def generate(path: str, kind: str, size: int, eol='lf', seed=0):
+    """
+    Writes a synthetic program of about size bytes (whole lines, plus the
+    footer). The same arguments always give the same bytes.
+    """
+    _, header, make_block = KINDS[kind]
+    rng = np.random.default_rng(seed)
+    state = {'xyz': np.zeros(3), 'abc': np.zeros(3), 'ijk': np.array([0.0, 0.0, 1.0])}
+    newline = b'\r\n' if eol == 'crlf' else b'\n'
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        written = f.write(header.encode('ascii').replace(b'\n', newline))
+        while written < size:
+            block = make_block(rng, state, GEN_BLOCK_LINES).encode('ascii')
+            if eol == 'crlf':
+                block = block.replace(b'\n', b'\r\n')
+            if written + len(block) > size:
+                cut = block.rfind(b'\n', 0, size - written) + 1
+                if cut == 0: break
+                block = block[:cut]
+            written += f.write(block)
+        f.write(FOOTER.encode('ascii').replace(b'\n', newline))
+    os.replace(tmp, path)
+
+
+def ensure_program(data_dir: str, kind: str, eol: str, size: int, seed: int) -> str:
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, program_name(kind, eol, size, seed))
+    if not os.path.isfile(path):
+        generate(path, kind, size, eol, seed)
+    return path
+
+
+# ------------------------------------------------------------------------------
+# Stages (each runs in its own process)
+# ------------------------------------------------------------------------------
+STAGES = ('parse', 'parse_regex', 'parse_stream', 'parse_parallel', 'parse_and_calculate', 'ffill',
+          'ffill_baseline', 'stats')
+# Stages that read the parse result from the cache
+CACHED_STAGES = ('ffill', 'ffill_baseline', 'stats')
+
+
+def _ffill_full_matrix(arr: np.ndarray) -> np.ndarray:
+    """
+    The forward fill the engine used before the in-place block version
+    (full-size index array, mask and result copy), kept as the reference
+    of the ffill_baseline stage.
+    """
+    mask = np.isnan(arr)
+    idx = np.where(~mask, np.arange(mask.shape[0])[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return arr[idx, np.arange(arr.shape[1])]
+
+
+def _mb(value):
+    return round(value / 1024 ** 2, 1) if value is not None else None
+
+
+def _stage_job(stage: str, path: str, cache_dir: str, workers: int) -> dict:
+    engine = GCodeAnalyzer()
+    cache = ResultCache(cache_dir, max_bytes=float('inf'))
+    run = None
+
+    if stage == 'parse':
+        run = lambda: engine.parse_file(path)
+    elif stage == 'parse_regex':
+        engine.tokenizer = 'regex'
+        run = lambda: engine.parse_file(path)
+    elif stage == 'parse_stream':
+        engine.use_mmap = False
+        run = lambda: engine.parse_file(path)
+    elif stage == 'parse_parallel':
+        run = lambda: engine.parse_file(path, workers=workers)
+    elif stage == 'parse_and_calculate':
+        with open(path, 'r', encoding='ascii', newline='') as f:
+            text = f.read()
+        run = lambda: engine.parse_and_calculate(text)
+    else:
+        data = cache.load(path, engine.settings_key())
+        if data is None:
+            raise RuntimeError("run the 'parse' stage first")
+        if stage in ('ffill', 'ffill_baseline'):
+            matrix = np.array(data['matrix'])
+            empty = np.random.default_rng(0).random(matrix.shape) < FFILL_EMPTY_SHARE
+            empty[0] = False
+            matrix[empty] = np.nan
+            del empty
+            if stage == 'ffill':
+                run = lambda: engine._numpy_ffill(matrix)
+            else:
+                run = lambda: _ffill_full_matrix(matrix)
+        else:
+            bins = [s for s, _ in DEFAULT_INTERVALS] + [DEFAULT_INTERVALS[-1][1]]
+            # Page the mapped arrays in, so the timing is the computation and not the disk
+            np.sum(data['dists']), np.sum(data['feeds'])
+            run = lambda: engine.calculate_metrics_and_stats(data, bins, DEFAULT_INTERVALS)
+
+    rss_before, _ = memory_usage()
+    reset_peak_rss()
+    start = time.perf_counter()
+    result = run()
+    wall = time.perf_counter() - start
+    _, peak = memory_usage()
+
+    if stage in ('ffill', 'ffill_baseline'):
+        lines = len(result)
+    elif stage == 'stats':
+        lines = int(np.count_nonzero(engine.valid_segment_mask(data['dists'])))
+    else:
+        lines = int(result['total_lines'])
+        if stage == 'parse':
+            cache.store(path, result, engine.settings_key())
+    return {'wall_s': wall, 'lines': lines, 'rss_before_mb': _mb(rss_before), 'peak_rss_mb': _mb(peak)}
+
+
+def run_stage(stage: str, path: str, cache_dir: str, workers: int) -> dict:
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_stage_job, stage, path, cache_dir, workers).result()
+
+
+# ------------------------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------------------------
+SIZE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text: str) -> int:
+    m = SIZE_RE.match(text)
+    if not m:
+        raise argparse.ArgumentTypeError(f"not a size: {text!r} (e.g. 512KB, 16MB, 5GB)")
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2).upper()])
+
+
+def format_size(size: int) -> str:
+    for unit in ('G', 'M', 'K'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}B"
+    return f"{size}B"
+
+
+def _choices(allowed):
+    def parse(text):
+        values = [v.strip() for v in text.split(',') if v.strip()]
+        unknown = [v for v in values if v not in allowed]
+        if unknown:
+            raise argparse.ArgumentTypeError(f"unknown: {', '.join(unknown)} (choose from {', '.join(allowed)})")
+        return values
+    return parse
+
+
+def _sizes(text):
+    if text == 'full':
+        text = FULL_SIZES
+    return [parse_size(v) for v in text.split(',') if v.strip()]
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        'engine_version': GCodeAnalyzer.ENGINE_VERSION,
+        'generator_version': GENERATOR_VERSION,
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def run_benchmarks(args) -> int:
+    results = []
+    workers = args.workers or os.cpu_count() or 1
+    cache_dir = os.path.join(args.data_dir, 'results')
+    stages = [s for s in STAGES if s in args.stages]
+    if any(s in CACHED_STAGES for s in stages) and 'parse' not in stages:
+        stages.insert(0, 'parse')
+
+    print(f"{'case':<32}{'stage':<22}{'wall s':>9}{'Mlines/s':>10}{'MB/s':>9}{'peak MB':>10}", file=sys.stderr)
+    for size in args.sizes:
+        for kind in args.kinds:
+            for eol in args.eol:
+                path = ensure_program(args.data_dir, kind, eol, size, args.seed)
+                file_size = os.path.getsize(path)
+                case = f"{kind}-{eol}-{format_size(size)}"
+                case_rows = {}
+                for stage in stages:
+                    if stage == 'parse_and_calculate' and file_size > STR_STAGE_MAX_BYTES:
+                        continue
+                    runs = [run_stage(stage, path, cache_dir, workers) for _ in range(args.repeat)]
+                    best = min(runs, key=lambda r: r['wall_s'])
+                    wall = best['wall_s']
+                    row = {
+                        'case': case, 'kind': kind, 'eol': eol, 'size_bytes': file_size, 'stage': stage,
+                        'wall_s': round(wall, 4),
+                        'lines': best['lines'],
+                        'lines_per_s': round(best['lines'] / wall) if wall else None,
+                        'mb_per_s': round(file_size / 1e6 / wall, 2) if wall and stage.startswith('parse') else None,
+                        'peak_rss_mb': max((r['peak_rss_mb'] for r in runs if r['peak_rss_mb'] is not None),
+                                           default=None),
+                        'rss_before_mb': best['rss_before_mb'],
+                        'repeat': args.repeat,
+                    }
+                    results.append(row)
+                    case_rows[stage] = row
+                    print(f"{case:<32}{stage:<22}{wall:>9.3f}{(row['lines_per_s'] or 0) / 1e6:>10.2f}"
+                          f"{row['mb_per_s'] or 0:>9.1f}{row['peak_rss_mb'] or 0:>10.1f}", file=sys.stderr)
+                if 'ffill' in case_rows and 'ffill_baseline' in case_rows:
+                    print(_ffill_summary(case_rows['ffill'], case_rows['ffill_baseline']), file=sys.stderr)
+
+    out = args.out or os.path.join(DEFAULT_OUT_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'workers': workers, 'results': results}, f, indent=2)
+    print(out)
+    return 0
+
+
+def _ffill_summary(new: dict, base: dict) -> str:
+    """In-place block ffill against the full-matrix baseline of the same case."""
+    def extra(row):
+        # Peak above the stage's starting point: the fill's own scratch memory
+        return (row['peak_rss_mb'] or 0) - (row['rss_before_mb'] or 0)
+    return (f"{'':<32}{'ffill vs baseline':<22}{new['wall_s']:.3f}s vs {base['wall_s']:.3f}s "
+            f"({base['wall_s'] / new['wall_s'] if new['wall_s'] else 0:.1f}x), "
+            f"peak {new['peak_rss_mb'] or 0:.1f} vs {base['peak_rss_mb'] or 0:.1f} MB "
+            f"(+{extra(new):.1f} vs +{extra(base):.1f} MB over setup)")
+
+
+def compare(base: dict, new: dict, threshold: float) -> tuple:
+    """(table lines, regressions): wall time and peak RSS of every shared (case, stage)."""
+    old_rows = {(r['case'], r['stage']): r for r in base['results']}
+    lines = [f"{'case':<32}{'stage':<22}{'base s':>9}{'new s':>9}{'time':>8}{'base MB':>9}{'new MB':>9}"]
+    regressions = []
+    for r in new['results']:
+        old = old_rows.get((r['case'], r['stage']))
+        if old is None:
+            continue
+        ratio = r['wall_s'] / old['wall_s'] if old['wall_s'] else float('inf')
+        mark = ""
+        if ratio > 1 + threshold and max(r['wall_s'], old['wall_s']) >= COMPARE_MIN_SECONDS:
+            mark = "  SLOWER"
+            regressions.append(r)
+        elif ratio < 1 - threshold:
+            mark = "  faster"
+        old_mb, new_mb = old.get('peak_rss_mb'), r.get('peak_rss_mb')
+        if old_mb and new_mb and new_mb > old_mb * (1 + threshold) and new_mb - old_mb >= 16:
+            mark += "  MORE MEMORY"
+            if r not in regressions: regressions.append(r)
+        lines.append(f"{r['case']:<32}{r['stage']:<22}{old['wall_s']:>9.3f}{r['wall_s']:>9.3f}"
+                     f"{(ratio - 1) * 100:>+7.0f}%{old_mb or 0:>9.1f}{new_mb or 0:>9.1f}{mark}")
+    return lines, regressions
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python bench.py", description="CAM Analyzer engine benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_case_options(p):
+        p.add_argument("--sizes", type=_sizes, default=_sizes(DEFAULT_SIZES),
+                       help=f"program sizes (default: {DEFAULT_SIZES}; 'full' = {FULL_SIZES})")
+        p.add_argument("--kinds", type=_choices(KINDS), default=list(KINDS),
+                       help=f"program kinds (default: all of {','.join(KINDS)})")
+        p.add_argument("--eol", type=_choices(EOLS), default=list(EOLS), help="line ends (default: lf,crlf)")
+        p.add_argument("--seed", type=int, default=0, help="generator seed (default: %(default)s)")
+        p.add_argument("--data-dir", default=DEFAULT_DATA_DIR,
+                       help="generated programs and parse results (default: %(default)s)")
+
+    p = commands.add_parser("run", help="run the benchmarks and write a JSON report")
+    add_case_options(p)
+    p.add_argument("--stages", type=_choices(STAGES), default=list(STAGES),
+                   help=f"stages (default: all of {','.join(STAGES)})")
+    p.add_argument("-r", "--repeat", type=int, default=1, help="runs per stage, fastest kept (default: 1)")
+    p.add_argument("-j", "--workers", type=int, default=None, help="processes of parse_parallel (default: all cores)")
+    p.add_argument("-o", "--out", default=None, help=f"report path (default: {DEFAULT_OUT_DIR}/bench-<time>.json)")
+
+    p = commands.add_parser("generate", help="only write the synthetic programs")
+    add_case_options(p)
+
+    p = commands.add_parser("compare", help="compare two reports; exit 1 on a regression")
+    p.add_argument("base", help="earlier report")
+    p.add_argument("new", help="later report")
+    p.add_argument("--threshold", type=float, default=0.10,
+                   help="relative change reported as regression (default: %(default)s)")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == "run":
+        return run_benchmarks(args)
+    if args.command == "generate":
+        for size in args.sizes:
+            for kind in args.kinds:
+                for eol in args.eol:
+                    print(ensure_program(args.data_dir, kind, eol, size, args.seed))
+        return 0
+    if args.command == "compare":
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+        with open(args.new, encoding='utf-8') as f:
+            new = json.load(f)
+        lines, regressions = compare(base, new, args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,8 +14,6 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import ttkbootstrap as ttk
 import os
-import csv
-import time
 import threading
 import queue
 import numpy as np 
@@ -23,9 +21,13 @@ import platform
 import sys
 from PIL import Image, ImageTk, ImageDraw 
 
-from backend import GCodeAnalyzer
+from backend import (GCodeAnalyzer, SourceLines, AXIS_MAP, LOG_SUFFIXES, DEFAULT_INTERVALS,
+                     LOG_M_CODE, LOG_TOOL, LOG_G_SETUP, LOG_HEADER, SegmentIndex, format_profile)
+from result_cache import ResultCache
+from analysis_worker import AnalysisProcess
 from frontend.styles import ThemeManager
-from frontend.charts import ChartManager
+from frontend.charts import ChartManager, ToolpathView, TimelineChart
+from frontend.detail_table import VirtualTable
 
 class CAMApp:
     def __init__(self, root, project_root="."):
@@ -34,6 +36,15 @@ class CAMApp:
         
         self.APP_NAME = "CAM Analyzer"
         self.APP_VERSION = "v10.10"
+        
+        # Log tab: entries per page and category filters (label, LOG_* category)
+        self.LOG_PAGE_SIZE = 500
+        self.LOG_FILTERS = [("全部", None), ("M Code", LOG_M_CODE), ("Tool/Speed", LOG_TOOL),
+                            ("G Code Setup", LOG_G_SETUP), ("Header", LOG_HEADER)]
+        # Toolpath box selection: segments drawn highlighted at most
+        self.MAX_PICK_HIGHLIGHT = 10000
+        # Detail tab source pane: raw lines shown before/after the selected line
+        self.SOURCE_CONTEXT = 20
         self.COPYRIGHT = "Copyright © 2025 TFC-CRM. All rights reserved."
         
         self.root.title(f"{self.APP_NAME} {self.APP_VERSION}")
@@ -43,6 +54,8 @@ class CAMApp:
         self.colors = self.tm.get_color_palette() 
         
         self.engine = GCodeAnalyzer()
+        self.parse_workers = os.cpu_count() or 1
+        self.result_cache = ResultCache()
         self.msg_queue = queue.Queue()
         
         # State Variables
@@ -50,26 +63,34 @@ class CAMApp:
         self.is_running = False
         self.is_paused = False
         self.should_stop = False
+        self.analysis = None
         self.status_var = tk.StringVar(value="Ready")
+        self.var_compact = tk.BooleanVar(value=False)
         self.after_id = None 
         
         # Data
         self.raw_data = None 
+        self.shared_result = None
+        self.dist_index = None
+        self.source_lines = None
+        self.log_indices = np.empty(0, dtype=np.intp)
+        self.log_page = 0
         self.detected_axes = []
-        self.top_10_stats = []
-        self.top_3_stats = []
+        self.stats = None
+        self.density = None
+        self.segment_index = None
+        self.segment_index_job = 0
+        self.segment_index_thread = None
+        self.segment_index_thread_job = None
+        self.segment_index_error = None
+        self.pending_pick = None
+        self.picked_line = None
         self.current_calc_mode = "" 
         
         # Bins
-        self.fixed_intervals = [
-            (0.000, 0.001), (0.001, 0.01), (0.01, 0.02), (0.02, 0.03), 
-            (0.03, 0.04), (0.04, 0.05), (0.05, 0.06), (0.06, 0.07), 
-            (0.07, 0.08), (0.08, 0.09), (0.09, 0.10), (0.10, 0.20), 
-            (0.20, 0.30), (0.30, 0.40), (0.40, 0.50), (0.50, 0.60), 
-            (0.60, 0.70), (0.70, 0.80), (0.80, 0.90), (0.90, 1.00),
-            (1.00, float('inf'))
-        ]
+        self.fixed_intervals = list(DEFAULT_INTERVALS)
         self.bins = [i[0] for i in self.fixed_intervals] + [self.fixed_intervals[-1][1]]
+        self.default_bins = list(self.bins)
         
         self._init_layout()
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -176,12 +197,20 @@ class CAMApp:
         self.btn_stop = ttk.Button(ctrl_frame, text="停止", bootstyle="danger", width=4, state='disabled', command=self.stop_analysis)
         self.btn_stop.pack(side='right', fill='x', expand=True, padx=(2, 0))
 
+        self.btn_clear_cache = ttk.Button(self.sidebar, text="🗑 清除分析快取", bootstyle="secondary-outline",
+                                          command=self.clear_cache)
+        self.btn_clear_cache.pack(fill='x', pady=5)
+        self.chk_compact = ttk.Checkbutton(self.sidebar, text="精簡結果 (僅運動單節)", bootstyle="round-toggle",
+                                           variable=self.var_compact)
+        self.chk_compact.pack(anchor='w', pady=5)
+
         ttk.Separator(self.sidebar).pack(fill='x', pady=20)
 
         # Navigation
         ttk.Label(self.sidebar, text="視圖切換", style='Inverse.TLabel', font=self.tm.fonts['h2']).pack(anchor='w', pady=(0, 10))
         self.nav_btns = {}
-        nav_items = [('dashboard', '📊', '儀表板'), ('detail', '📝', '詳細數據'), ('log', '📜', '執行紀錄')]
+        nav_items = [('dashboard', '📊', '儀表板'), ('toolpath', '🧭', '刀具路徑'), ('timeline', '📈', '單節趨勢'),
+                     ('detail', '📝', '詳細數據'), ('log', '📜', '執行紀錄')]
         for key, icon, label in nav_items:
             btn = ttk.Button(self.sidebar, text=f"{icon}  {label}", style='Nav.TButton',
                              command=lambda k=key: self.switch_view(k))
@@ -237,6 +266,8 @@ class CAMApp:
         self.view_container.pack(fill='both', expand=True)
         
         self._init_dashboard()
+        self._init_toolpath()
+        self._init_timeline()
         self._init_detail_text()
         self._init_log()
         self._init_about() 
@@ -281,33 +312,240 @@ class CAMApp:
             val.pack(anchor='w', pady=(5, 0))
             self.kpi_vals[key] = val
 
+        bin_row = ttk.Frame(self.view_dash)
+        bin_row.pack(fill='x', pady=(0, 10))
+        ttk.Label(bin_row, text="區間邊界 (mm):", font=self.tm.fonts['ui']).pack(side='left')
+        ttk.Button(bin_row, text="匯出統計", bootstyle="success-outline", command=self.export_stats).pack(side='right', padx=(5, 0))
+        ttk.Button(bin_row, text="預設", bootstyle="secondary-outline", command=self.reset_intervals).pack(side='right')
+        ttk.Button(bin_row, text="套用", bootstyle="primary-outline", command=self.apply_intervals).pack(side='right', padx=5)
+        self.var_density = tk.BooleanVar(value=False)
+        ttk.Checkbutton(bin_row, text="進給密度圖", variable=self.var_density, bootstyle="round-toggle",
+                        command=self.toggle_density).pack(side='right', padx=10)
+        self.entry_bins = ttk.Entry(bin_row, font=self.tm.fonts['mono'])
+        self.entry_bins.pack(side='left', fill='x', expand=True, padx=5)
+        self.entry_bins.insert(0, self._format_edges(self.bins))
+        self.entry_bins.bind("<Return>", self.apply_intervals)
+
         chart_area = ttk.Frame(self.view_dash, style='Card.TFrame', padding=5)
         chart_area.pack(fill='both', expand=True)
         self.chart_hist = ChartManager(chart_area, self.tm)
 
+    def _init_toolpath(self):
+        self.view_path = ttk.Frame(self.view_container)
+
+        ctrl = ttk.Frame(self.view_path)
+        ctrl.pack(fill='x', pady=(0, 10))
+        ttk.Label(ctrl, text="投影:", font=self.tm.fonts['ui']).pack(side='left')
+        self.combo_projection = ttk.Combobox(ctrl, values=list(ToolpathView.PROJECTIONS), width=8, state='readonly')
+        self.combo_projection.current(0)
+        self.combo_projection.pack(side='left', padx=5)
+        self.combo_projection.bind("<<ComboboxSelected>>",
+                                   lambda e: self.chart_path.set_projection(self.combo_projection.get()))
+        ttk.Button(ctrl, text="重設視圖", bootstyle="secondary-outline",
+                   command=lambda: self.chart_path.reset_view()).pack(side='left', padx=5)
+        ttk.Label(ctrl, text="滾輪縮放 · 拖曳平移 · 點選查行號 · Shift+拖曳框選", font=self.tm.fonts['ui']).pack(side='right')
+
+        pick_row = ttk.Frame(self.view_path)
+        pick_row.pack(fill='x', pady=(0, 10))
+        self.btn_pick_detail = ttk.Button(pick_row, text="在詳細數據中顯示", bootstyle="secondary-outline",
+                                          state='disabled', command=self.show_picked_line)
+        self.btn_pick_detail.pack(side='right')
+        self.lbl_pick = ttk.Label(pick_row, text="", font=self.tm.fonts['ui'])
+        self.lbl_pick.pack(side='left')
+
+        chart_area = ttk.Frame(self.view_path, style='Card.TFrame', padding=5)
+        chart_area.pack(fill='both', expand=True)
+        self.chart_path = ToolpathView(chart_area, self.tm)
+        self.chart_path.pick_callback = self.on_path_pick
+
+    # ------------------------------------------------------------------
+    # Toolpath picking (segment spatial index, built on the first pick)
+    # ------------------------------------------------------------------
+    def _reset_segment_index(self):
+        self.segment_index = None
+        self.segment_index_error = None
+        self.segment_index_job += 1
+        self.pending_pick = None
+        self.picked_line = None
+        self.lbl_pick.config(text="")
+        self.btn_pick_detail.config(state='disabled')
+
+    def on_path_pick(self, dims, point=None, box=None):
+        if self.raw_data is None: return
+        if dims is None:
+            self.lbl_pick.config(text="ISO 視圖不支援點選查詢，請切換到 XY / XZ / YZ")
+            return
+        self.pending_pick = (dims, point, box)
+        if self.segment_index is not None:
+            self._run_pick()
+            return
+        job = self.segment_index_job
+        # 舊結果的建立執行緒仍在跑時不算數：它的索引會被丟棄
+        if (self.segment_index_thread is not None and self.segment_index_thread.is_alive()
+                and self.segment_index_thread_job == job):
+            return
+        self.lbl_pick.config(text="建立空間索引中...")
+        self.segment_index_error = None
+        self.segment_index_thread_job = job
+        self.segment_index_thread = threading.Thread(target=self._build_segment_index,
+                                                     args=(job, self.file_path, self.raw_data), daemon=True)
+        self.segment_index_thread.start()
+        self.root.after(100, self._check_segment_index, job)
+
+    def _build_segment_index(self, job, file_path, raw_data):
+        try:
+            settings = self.engine.settings_key()
+            coords = self.engine.segment_coordinates(raw_data)
+            arrays = None
+            try:
+                arrays = self.result_cache.load_segment_index(file_path, settings)
+            except OSError:
+                pass
+            if arrays is not None:
+                index = SegmentIndex.from_arrays(arrays, *coords)
+            else:
+                index = self.engine.build_segment_index(raw_data)
+                try:
+                    self.result_cache.store_segment_index(file_path, index.arrays(), settings)
+                except OSError:
+                    pass
+        except Exception as e:
+            if job == self.segment_index_job:
+                self.segment_index_error = f"{type(e).__name__}: {e}"
+            return
+        if job == self.segment_index_job:
+            self.segment_index = index
+
+    def _check_segment_index(self, job):
+        if job != self.segment_index_job: return
+        if self.segment_index_error is not None:
+            self.pending_pick = None
+            self.lbl_pick.config(text=f"空間索引建立失敗: {self.segment_index_error}")
+            return
+        if self.segment_index is None:
+            self.root.after(100, self._check_segment_index, job)
+            return
+        if self.pending_pick is not None:
+            self._run_pick()
+
+    def _run_pick(self):
+        dims, point, box = self.pending_pick
+        self.pending_pick = None
+        index = self.segment_index
+        if point is not None:
+            u, v, tolerance = point
+            target = [0.0, 0.0, 0.0]
+            target[dims[0]], target[dims[1]] = u, v
+            hit = index.nearest(target, dims, max_dist=tolerance)
+            if hit is None:
+                self.picked_line = None
+                self.lbl_pick.config(text="附近沒有線段")
+                self.chart_path.highlight([])
+            else:
+                segment, dist = hit
+                self.picked_line = int(self.engine.segment_lines(self.raw_data, [segment])[0])
+                self.lbl_pick.config(text=f"第 {self.picked_line:,} 行  (距離 {dist:.4f} mm)")
+                self.chart_path.highlight([segment])
+        else:
+            u0, u1, v0, v1 = box
+            lo, hi = [0.0, 0.0, 0.0], [0.0, 0.0, 0.0]
+            lo[dims[0]], hi[dims[0]], lo[dims[1]], hi[dims[1]] = u0, u1, v0, v1
+            segments = index.box(lo, hi, dims)
+            if not len(segments):
+                self.picked_line = None
+                self.lbl_pick.config(text="框選範圍內沒有線段")
+            else:
+                lines = self.engine.segment_lines(self.raw_data, segments)
+                self.picked_line = int(lines[0])
+                self.lbl_pick.config(text=f"框選 {len(segments):,} 線段  第 {int(lines[0]):,} – {int(lines[-1]):,} 行")
+            self.chart_path.highlight(segments[:self.MAX_PICK_HIGHLIGHT])
+        self.btn_pick_detail.config(state='normal' if self.picked_line is not None else 'disabled')
+
+    def show_picked_line(self):
+        if self.picked_line is None: return
+        self.entry_jump.delete(0, tk.END)
+        self.entry_jump.insert(0, str(self.picked_line))
+        self.jump_to_line()
+
+    def _init_timeline(self):
+        self.view_timeline = ttk.Frame(self.view_container)
+
+        ctrl = ttk.Frame(self.view_timeline)
+        ctrl.pack(fill='x', pady=(0, 10))
+        ttk.Label(ctrl, text="分段長度 +", font=self.tm.fonts['ui']).pack(side='left')
+        self.var_tl_feed = tk.BooleanVar(value=False)
+        self.var_tl_rot = tk.BooleanVar(value=False)
+        ttk.Checkbutton(ctrl, text="進給", variable=self.var_tl_feed, bootstyle="round-toggle",
+                        command=self._update_timeline_series).pack(side='left', padx=(10, 0))
+        ttk.Checkbutton(ctrl, text="旋轉角", variable=self.var_tl_rot, bootstyle="round-toggle",
+                        command=self._update_timeline_series).pack(side='left', padx=(10, 0))
+        ttk.Button(ctrl, text="重設視圖", bootstyle="secondary-outline",
+                   command=lambda: self.chart_timeline.reset_view()).pack(side='left', padx=15)
+        ttk.Label(ctrl, text="滾輪縮放 · 左鍵拖曳平移 · 雙擊重設", font=self.tm.fonts['ui']).pack(side='right')
+
+        chart_area = ttk.Frame(self.view_timeline, style='Card.TFrame', padding=5)
+        chart_area.pack(fill='both', expand=True)
+        self.chart_timeline = TimelineChart(chart_area, self.tm)
+
+    def _update_timeline_series(self):
+        keys = ['dists']
+        if self.var_tl_feed.get(): keys.append('feeds')
+        if self.var_tl_rot.get(): keys.append('rots_deg')
+        self.chart_timeline.set_series(keys)
+
     def _init_detail_text(self):
         self.view_detail = ttk.Frame(self.view_container)
         
         ctrl = ttk.Frame(self.view_detail)
         ctrl.pack(fill='x', pady=(0, 10))
-        ttk.Label(ctrl, text="顯示範圍:", font=self.tm.fonts['ui']).pack(side='left')
+        ttk.Label(ctrl, text="跳至行號:", font=self.tm.fonts['ui']).pack(side='left')
         
-        self.combo_limit = ttk.Combobox(ctrl, values=["前 1000 筆", "前 5000 筆", "前 10000 筆"], width=15, state='readonly')
-        self.combo_limit.current(0)
-        self.combo_limit.pack(side='left', padx=5)
-        self.combo_limit.bind("<<ComboboxSelected>>", self.refresh_detail_view)
+        self.entry_jump = ttk.Entry(ctrl, width=12)
+        self.entry_jump.pack(side='left', padx=5)
+        self.entry_jump.bind("<Return>", self.jump_to_line)
+        ttk.Button(ctrl, text="前往", bootstyle="secondary-outline", command=self.jump_to_line).pack(side='left')
+        self.lbl_detail_total = ttk.Label(ctrl, text="", font=self.tm.fonts['ui'])
+        self.lbl_detail_total.pack(side='left', padx=15)
         
         ttk.Button(ctrl, text="匯出 CSV", bootstyle="success-outline", command=self.export_csv).pack(side='right')
-        
-        self.txt_detail = scrolledtext.ScrolledText(
-            self.view_detail, font=self.tm.fonts['mono'],
+
+        # 原始程式窗格: 選取列前後的原始行 (由行號索引直接讀取檔案)
+        source_pane = ttk.Frame(self.view_detail)
+        source_pane.pack(side='bottom', fill='x', pady=(10, 0))
+        self.lbl_source = ttk.Label(source_pane, text="原始程式: 點選一列或跳至行號", font=self.tm.fonts['ui'])
+        self.lbl_source.pack(anchor='w', pady=(0, 5))
+        self.txt_source = scrolledtext.ScrolledText(
+            source_pane, height=12, font=self.tm.fonts['mono'], wrap='none',
             bg=self.colors['bg_card'], fg=self.colors['fg_main'],
-            insertbackground='white', relief='flat', padx=10, pady=10
+            insertbackground='white', relief='flat', padx=10, pady=5
         )
-        self.txt_detail.pack(fill='both', expand=True)
+        self.txt_source.pack(fill='x')
+        self.txt_source.tag_configure('hit', background=self.colors['accent'], foreground=self.colors['bg_card'])
+        self.txt_source.config(state='disabled')
+
+        self.detail_table = VirtualTable(self.view_detail, self.tm)
+        self.detail_table.pack(fill='both', expand=True)
+        self.detail_table.select_callback = self.on_detail_select
 
     def _init_log(self):
         self.view_log = ttk.Frame(self.view_container)
+        
+        ctrl = ttk.Frame(self.view_log)
+        ctrl.pack(fill='x', pady=(0, 10))
+        ttk.Label(ctrl, text="類別:", font=self.tm.fonts['ui']).pack(side='left')
+        
+        self.combo_log_cat = ttk.Combobox(ctrl, values=[label for label, _ in self.LOG_FILTERS], width=15, state='readonly')
+        self.combo_log_cat.current(0)
+        self.combo_log_cat.pack(side='left', padx=5)
+        self.combo_log_cat.bind("<<ComboboxSelected>>", self.refresh_log_view)
+        
+        self.btn_log_next = ttk.Button(ctrl, text="下一頁 ▶", bootstyle="secondary-outline", command=lambda: self.change_log_page(1))
+        self.btn_log_next.pack(side='right')
+        self.lbl_log_page = ttk.Label(ctrl, text="", font=self.tm.fonts['ui'])
+        self.lbl_log_page.pack(side='right', padx=10)
+        self.btn_log_prev = ttk.Button(ctrl, text="◀ 上一頁", bootstyle="secondary-outline", command=lambda: self.change_log_page(-1))
+        self.btn_log_prev.pack(side='right')
+        
         self.txt_log = scrolledtext.ScrolledText(
             self.view_log, font=self.tm.fonts['mono'],
             bg=self.colors['bg_card'], fg=self.colors['fg_main'],
@@ -347,12 +585,22 @@ class CAMApp:
 
     def switch_view(self, view):
         self.view_dash.pack_forget()
+        self.view_path.pack_forget()
+        self.chart_path.hide()
+        self.view_timeline.pack_forget()
+        self.chart_timeline.hide()
         self.view_detail.pack_forget()
         self.view_log.pack_forget()
         self.view_about.pack_forget()
         for k, btn in self.nav_btns.items():
             btn.configure(style=('NavActive.TButton' if k == view else 'Nav.TButton'))
         if view == 'dashboard': self.view_dash.pack(fill='both', expand=True)
+        elif view == 'toolpath':
+            self.view_path.pack(fill='both', expand=True)
+            self.chart_path.show()
+        elif view == 'timeline':
+            self.view_timeline.pack(fill='both', expand=True)
+            self.chart_timeline.show()
         elif view == 'detail': self.view_detail.pack(fill='both', expand=True)
         elif view == 'log': self.view_log.pack(fill='both', expand=True)
         elif view == 'about': self.view_about.pack(fill='both', expand=True)
@@ -368,79 +616,68 @@ class CAMApp:
             for k in self.kpi_vals: self.kpi_vals[k].config(text="--")
             for lbl in self.axis_indicators.values(): lbl.configure(style='AxisInactive.TLabel')
             self.lbl_calc_mode.config(text="")
-            self.txt_detail.delete(1.0, tk.END)
+            self.detail_table.clear()
+            self.chart_path.clear()
+            self._reset_segment_index()
+            self.chart_timeline.clear()
+            self.lbl_detail_total.config(text="")
+            self._clear_source()
             self.txt_log.delete(1.0, tk.END)
             self.raw_data = None 
+            self.dist_index = None
+            self.stats = None
+            self.density = None
 
     def start_analysis_thread(self):
         if self.is_running: return
         self.is_running = True
-        self.should_stop = False
         self.is_paused = False
         
         self.btn_analyze.config(state='disabled')
         self.btn_open.config(state='disabled')
+        self.chk_compact.config(state='disabled')
+        self.engine.compact_results = self.var_compact.get()
         self.btn_pause.config(state='normal', text="暫停")
         self.btn_stop.config(state='normal')
         
         self.txt_log.delete(1.0, tk.END)
-        self.txt_detail.delete(1.0, tk.END)
+        self.detail_table.clear()
         self.txt_log.insert(tk.END, "Starting High-Performance Analysis Engine (Numpy Float64)...\n")
         
-        thread = threading.Thread(target=self.run_analysis)
-        thread.daemon = True
-        thread.start()
-
-    def run_analysis(self):
+        # 分析在子行程中執行，結果陣列經共享記憶體傳回
+        self.analysis = AnalysisProcess(self.file_path, self.fixed_intervals, compact=self.engine.compact_results,
+                                        workers=self.parse_workers, cache=self.result_cache)
         try:
-            content = ""
-            for chunk in self.engine.read_file_generator(self.file_path, progress_callback=self.thread_callback):
-                content += chunk
-                if self.should_stop: break
-            
-            if self.should_stop: raise InterruptedError("Stopped by user")
-
-            data_dict = self.engine.parse_and_calculate(content, self.thread_callback)
-            if not data_dict: raise InterruptedError("Stopped")
-            
-            dists, g01, time_m, top10, top3, bpt = self.engine.calculate_metrics_and_stats(
-                data_dict, self.bins, self.fixed_intervals, self.thread_callback
-            )
-
-            result_payload = {
-                "raw_data": data_dict, 
-                "top10": top10,
-                "top3": top3,
-                "bpt": bpt,
-                "hist_dists": dists 
-            }
-            self.msg_queue.put(("DONE", result_payload))
-
-        except InterruptedError:
-            self.msg_queue.put(("STATUS", "Cancelled"))
-        except Exception as e:
+            self.analysis.start()
+        except OSError as e:
+            self.analysis = None
             self.msg_queue.put(("ERROR", str(e)))
-        finally:
             self.msg_queue.put(("FINISH", None))
 
-    def thread_callback(self, pct, msg):
-        self.msg_queue.put(("PROGRESS", (pct, msg)))
-        while self.is_paused:
-            self.msg_queue.put(("STATUS", "Paused..."))
-            time.sleep(0.2)
-            if self.should_stop: return True
-        return self.should_stop
+    def clear_cache(self):
+        if self.is_running: return
+        if not messagebox.askyesno("清除快取", "確定要清除所有已快取的分析結果嗎？"):
+            return
+        self.result_cache.clear()
+        self.status_var.set("Cache cleared")
 
     def check_queue(self):
         if self.should_stop: return
+        if self.analysis is not None:
+            for msg in self.analysis.poll():
+                self.msg_queue.put(msg)
+        # 連續的進度訊息只顯示最後一筆
+        pending_progress = None
         try:
             while True:
                 msg_type, data = self.msg_queue.get_nowait()
                 if msg_type == "PROGRESS":
-                    pct, txt = data
-                    self.progress['value'] = pct
-                    self.status_var.set(f"{txt} ({pct:.1f}%)")
-                elif msg_type == "STATUS":
+                    pending_progress = data
+                    continue
+                if pending_progress is not None:
+                    self._show_progress(*pending_progress)
+                    pending_progress = None
+                if msg_type == "STATUS":
                     self.status_var.set(data)
                 elif msg_type == "DONE":
                     self.update_results(data)
@@ -448,8 +685,10 @@ class CAMApp:
                     messagebox.showerror("Error", data)
                 elif msg_type == "FINISH":
                     self.is_running = False
+                    self.analysis = None
                     self.btn_analyze.config(state='normal')
                     self.btn_open.config(state='normal')
+                    self.chk_compact.config(state='normal')
                     self.btn_pause.config(state='disabled')
                     self.btn_stop.config(state='disabled')
                     self.progress['value'] = 0
@@ -457,14 +696,22 @@ class CAMApp:
                         self.status_var.set("Ready")
         except queue.Empty:
             pass
+        if pending_progress is not None:
+            self._show_progress(*pending_progress)
         if not self.should_stop:
             self.after_id = self.root.after(100, self.check_queue)
 
+    def _show_progress(self, pct, txt):
+        self.progress['value'] = pct
+        self.status_var.set(f"{txt} ({pct:.1f}%)")
+
     def update_results(self, payload):
+        previous = self.shared_result
+        self.shared_result = payload["shared"]
         self.raw_data = payload["raw_data"]
         self.detected_axes = self.raw_data["axes"]
-        self.top_10_stats = payload["top10"]
-        self.top_3_stats = payload["top3"]
+        self.stats = payload["stats"]
+        self.density = payload["density"]
         self.current_calc_mode = self.raw_data["calc_mode"]
         
         for lbl in self.axis_indicators.values():
@@ -486,7 +733,7 @@ class CAMApp:
         self.lbl_calc_mode.config(text=f"[ {self.current_calc_mode} ]")
         self.lbl_calc_mode.configure(foreground=self.colors['accent'] if is_tcp else self.colors['fg_main'])
             
-        total_lines = len(self.raw_data['matrix']) - 1
+        total_lines = self.raw_data.get('total_lines', len(self.raw_data['matrix']) - 1)
         self.kpi_vals['lines'].config(text=f"{total_lines:,}")
         
         total = self.raw_data["g00_dist"] + self.raw_data["g01_dist"]
@@ -504,147 +751,293 @@ class CAMApp:
         h, m, s = total_seconds // 3600, (total_seconds % 3600) // 60, total_seconds % 60
         self.kpi_vals['time'].config(text=f"{h:02d}:{m:02d}:{s:02d}")
         
-        if payload['bpt']:
-            self.kpi_vals['bpt'].config(text=f"{payload['bpt']['range_str']}")
+        self.dist_index = payload["dist_index"]
+        self._update_stat_cards()
+
+        try:
+            # 沿用解析時的編碼與行位移，不在 UI 執行緒重新偵測
+            self.source_lines = SourceLines(self.file_path, encoding=self.raw_data.get("encoding"),
+                                            line_offsets=self.raw_data.get("line_offsets"))
+        except (OSError, RuntimeError):
+            self.source_lines = None
+        self.combo_log_cat.current(0)
+        self.refresh_log_view()
+        
+        self.refresh_detail_view()
+        self._plot_bins()
+
+        # 路徑金字塔在第一次切到刀具路徑視圖時才建立
+        path_cols = {ax: (self.engine.matrix_columns(self.raw_data, [ax])[0]
+                          if ax in self.raw_data.get("matrix_axes", "XYZ") else None) for ax in 'XYZ'}
+        self.chart_path.set_path(self.raw_data["matrix"], path_cols, self.raw_data["modes"])
+        self._reset_segment_index()
+        self.chart_timeline.set_data(self.raw_data)
+        
+        self.status_var.set("Analysis Complete")
+        self.switch_view('dashboard')
+
+        # 舊結果的陣列已不再被參照，釋放其共享記憶體
+        if previous is not None:
+            previous.release()
+
+    def _update_stat_cards(self):
+        bpt = self.stats.bpt
+        top_3 = self.stats.top(3)
+        if bpt:
+            self.kpi_vals['bpt'].config(text=f"{bpt['range_str']}")
         else:
             self.kpi_vals['bpt'].config(text="N/A")
 
         for i in range(3):
             key = f'top{i+1}'
-            if i < len(self.top_3_stats):
-                item = self.top_3_stats[i]
+            if i < len(top_3):
+                item = top_3[i]
                 self.kpi_vals[key].config(text=f"{item['label']} ({item['pct']:.1f}%)")
             else:
                 self.kpi_vals[key].config(text="--")
 
-        self.txt_log.insert(tk.END, f"=== Analysis Mode: {self.current_calc_mode} ===\n")
-        self.txt_log.insert(tk.END, f"=== Total Lines: {total_lines} ===\n")
-        MAX_LOG = 2000
-        skipped = self.raw_data["skipped"]
-        for i, l in enumerate(skipped):
-            if i < MAX_LOG: self.txt_log.insert(tk.END, l + "\n")
-            else: 
-                self.txt_log.insert(tk.END, f"... ({len(skipped)-MAX_LOG} more lines hidden) ...\n")
-                break
-        
-        self.refresh_detail_view()
-        self.chart_hist.plot_histogram(payload["hist_dists"], self.bins, self.fixed_intervals)
-        
-        self.status_var.set("Analysis Complete")
-        self.switch_view('dashboard')
+    def _plot_bins(self):
+        if self.var_density.get():
+            self.chart_hist.plot_f_curve(self.density, self.fixed_intervals)
+        else:
+            self.chart_hist.plot_histogram(self.stats)
+
+    def toggle_density(self):
+        if self.stats is not None:
+            self._plot_bins()
+
+    # ------------------------------------------------------------------
+    # Interval editing (re-binning from the sorted distance index)
+    # ------------------------------------------------------------------
+    def _format_edges(self, edges):
+        return ", ".join("inf" if e == float('inf') else f"{e:g}" for e in edges)
+
+    def _parse_edges(self, text):
+        try:
+            edges = [float(tok) for tok in text.replace(',', ' ').split()]
+        except ValueError:
+            raise ValueError("區間邊界必須是數字 (可用 inf)")
+        if len(edges) < 2:
+            raise ValueError("至少需要兩個邊界")
+        if any(e != e for e in edges) or edges[0] < 0:
+            raise ValueError("邊界不可為負數或 NaN")
+        if any(b <= a for a, b in zip(edges, edges[1:])):
+            raise ValueError("邊界必須嚴格遞增")
+        return edges
+
+    def apply_intervals(self, event=None):
+        try:
+            edges = self._parse_edges(self.entry_bins.get())
+        except ValueError as e:
+            messagebox.showerror("區間設定錯誤", str(e))
+            return
+        self.set_intervals(edges)
+
+    def reset_intervals(self):
+        self.entry_bins.delete(0, tk.END)
+        self.entry_bins.insert(0, self._format_edges(self.default_bins))
+        self.set_intervals(list(self.default_bins))
+
+    def set_intervals(self, edges):
+        self.bins = edges
+        self.fixed_intervals = list(zip(edges[:-1], edges[1:]))
+        if self.raw_data is None or self.dist_index is None or self.is_running: return
+
+        self.stats = self.engine.compute_stats(self.raw_data, self.fixed_intervals, index=self.dist_index)
+        self._update_stat_cards()
+        self._plot_bins()
+        self.status_var.set(f"Re-binned ({len(self.fixed_intervals)} intervals)")
+
+    def refresh_log_view(self, event=None):
+        """Rebuilds the category filter and shows its first page."""
+        if self.raw_data is None: return
+        category = dict(self.LOG_FILTERS)[self.combo_log_cat.get()]
+        cats = self.raw_data["skipped_cats"]
+        if category is None:
+            self.log_indices = np.arange(len(cats))
+        else:
+            self.log_indices = np.flatnonzero(np.asarray(cats) == category)
+        self.log_page = 0
+        self.show_log_page()
+
+    def change_log_page(self, step):
+        if self.raw_data is None: return
+        pages = max(1, -(-len(self.log_indices) // self.LOG_PAGE_SIZE))
+        self.log_page = min(max(self.log_page + step, 0), pages - 1)
+        self.show_log_page()
+
+    def show_log_page(self):
+        """Formats only the entries of the current page (text read from the source file)."""
+        data = self.raw_data
+        total = len(self.log_indices)
+        pages = max(1, -(-total // self.LOG_PAGE_SIZE))
+        start = self.log_page * self.LOG_PAGE_SIZE
+        page = self.log_indices[start:start + self.LOG_PAGE_SIZE]
+        counts = np.bincount(np.asarray(data["skipped_cats"], dtype=np.intp), minlength=len(LOG_SUFFIXES))
+
+        self.txt_log.delete(1.0, tk.END)
+        self.txt_log.insert(tk.END, f"=== Analysis Mode: {data['calc_mode']} ===\n")
+        self.txt_log.insert(tk.END, f"=== Total Lines: {data.get('total_lines', len(data['matrix']) - 1)} ===\n")
+        summary = ", ".join(f"{label}: {counts[cat]:,}" for label, cat in self.LOG_FILTERS if cat is not None)
+        self.txt_log.insert(tk.END, f"=== Skipped Lines: {len(data['skipped_cats']):,} ({summary}) ===\n\n")
+        profile = format_profile(data.get('profile'))
+        if profile:
+            self.txt_log.insert(tk.END, "=== Stage Profile ===\n" + "\n".join(profile) + "\n\n")
+        if len(page):
+            entries = self.engine.format_skipped(data, page, self.source_lines)
+            self.txt_log.insert(tk.END, "\n".join(entries) + "\n")
+
+        self.lbl_log_page.config(text=f"{self.log_page + 1:,} / {pages:,} 頁 (共 {total:,} 筆)")
+        self.btn_log_prev.config(state='normal' if self.log_page > 0 else 'disabled')
+        self.btn_log_next.config(state='normal' if self.log_page < pages - 1 else 'disabled')
 
     def refresh_detail_view(self, event=None):
         if self.raw_data is None: return
-        self.txt_detail.delete(1.0, tk.END)
-        selection = self.combo_limit.get()
-        if "1000" in selection: limit = 1000
-        elif "5000" in selection: limit = 5000
-        elif "10000" in selection: limit = 10000
-        else: limit = 1000
-        matrix = self.raw_data["matrix"] 
-        dists = self.raw_data["dists"]   
-        modes = self.raw_data["modes"]
-        feeds = self.raw_data["feeds"]
-        total_records = len(dists)
-        limit = min(limit, total_records)
-        self.txt_detail.insert(tk.END, f"=== Displaying First {limit} Records (Total {total_records}) ===\n")
-        self.txt_detail.insert(tk.END, "="*90 + "\n\n")
-        all_axes_priority = ['X', 'Y', 'Z', 'A', 'B', 'C', 'I', 'J', 'K']
-        active_cols = [ax for ax in all_axes_priority if ax in self.detected_axes]
-        s_headers = [f"Start_{ax}" for ax in active_cols]
-        e_headers = [f"End_{ax}" for ax in active_cols]
-        is_tcp = self.raw_data["is_tcp"]
-        if is_tcp: dist_header = f"{'XYZ_Dist':<8} | {'Rot_Deg':<7} | {'Total_Dist':<10}"
+        total_records = len(self.raw_data["dists"])
+        self.detail_active_cols = [ax for ax in AXIS_MAP if ax in self.detected_axes]
+        self.detail_col_indices = self.engine.matrix_columns(self.raw_data, self.detail_active_cols)
+        s_headers = [f"Start_{ax}" for ax in self.detail_active_cols]
+        e_headers = [f"End_{ax}" for ax in self.detail_active_cols]
+        if self.raw_data["is_tcp"]: dist_header = f"{'XYZ_Dist':<8} | {'Rot_Deg':<7} | {'Total_Dist':<10}"
         else: dist_header = f"{'Dist':<8}"
-        header_str = f"{'Line':<6} | {' '.join(s_headers):<30} | {' '.join(e_headers):<30} | {dist_header} | {'Feed':<6} | {'Info'}\n"
-        self.txt_detail.insert(tk.END, header_str)
-        self.txt_detail.insert(tk.END, "-"*len(header_str) + "\n")
-        axis_map_full = {ax: i for i, ax in enumerate(all_axes_priority)}
-        col_indices = [axis_map_full[ax] for ax in active_cols]
-        buffer = ""
-        for i in range(limit):
-            line_num = self.raw_data["lines"][i+1] 
-            row_s = matrix[i]
-            row_e = matrix[i+1]
-            s_str = " ".join([f"{row_s[c]:.1f}" for c in col_indices])
-            e_str = " ".join([f"{row_e[c]:.1f}" for c in col_indices])
+        header_str = f"{'Line':<6} | {' '.join(s_headers):<30} | {' '.join(e_headers):<30} | {dist_header} | {'Feed':<6} | {'Info'}"
+        self.lbl_detail_total.config(text=f"共 {total_records:,} 筆")
+        self._clear_source()
+        self.detail_table.set_source(total_records, self._format_detail_rows, [header_str, "-" * len(header_str)])
+
+    def _format_detail_rows(self, start, count):
+        """Formats segments start..start+count-1 (only the rows in view)."""
+        data = self.raw_data
+        end = start + count
+        is_tcp = data["is_tcp"]
+        matrix = data["matrix"]
+        cols = self.detail_col_indices
+        starts = np.asarray(matrix[start:end])[:, cols]
+        ends = np.asarray(matrix[start + 1:end + 1])[:, cols]
+        lines = data["lines"][start + 1:end + 1]
+        dists = data["dists"][start:end]
+        modes = data["modes"][start + 1:end + 1]
+        feeds = data["feeds"][start + 1:end + 1]
+        if is_tcp:
+            dists_xyz = data["dists_xyz"][start:end]
+            rots = data["rots_deg"][start:end]
+        rows = []
+        for i in range(count):
+            s_str = " ".join([f"{v:.1f}" for v in starts[i]])
+            e_str = " ".join([f"{v:.1f}" for v in ends[i]])
             d_total = dists[i]
             if is_tcp:
-                d_xyz = self.raw_data["dists_xyz"][i]
-                d_rot = self.raw_data["rots_deg"][i]
-                d_str = f"{d_xyz:<8.3f} | {d_rot:<7.1f} | {d_total:<10.3f}"
+                d_str = f"{dists_xyz[i]:<8.3f} | {rots[i]:<7.1f} | {d_total:<10.3f}"
             else:
                 d_str = f"{d_total:<8.3f}"
-            mode_val = modes[i+1]
-            feed_val = feeds[i+1]
-            mode_str = 'G00' if mode_val == 0.0 else 'G01'
-            info = f"{mode_str}"
+            mode_val = modes[i]
+            info = 'G00' if mode_val == 0.0 else 'G01'
             if is_tcp and mode_val == 1.0: info += " (TCP)"
-            buffer += f"{line_num:<6} | {s_str:<30} | {e_str:<30} | {d_str} | {int(feed_val):<6} | {info}\n"
-            if i % 500 == 0:
-                self.txt_detail.insert(tk.END, buffer)
-                buffer = ""
-                self.root.update_idletasks() 
-        if buffer: self.txt_detail.insert(tk.END, buffer)
+            rows.append(f"{lines[i]:<6} | {s_str:<30} | {e_str:<30} | {d_str} | {int(feeds[i]):<6} | {info}")
+        return rows
+
+    def jump_to_line(self, event=None):
+        if self.raw_data is None: return
+        try:
+            line_no = int(self.entry_jump.get().strip())
+        except ValueError:
+            self.status_var.set("Invalid line number")
+            return
+        # Segment i ends on source line lines[i+1]; compact results skip non-motion lines
+        lines = self.raw_data["lines"]
+        idx = int(np.searchsorted(lines[1:], line_no))
+        if idx >= len(lines) - 1:
+            self.status_var.set(f"Line {line_no} is past the last motion line")
+            return
+        self.switch_view('detail')
+        self.detail_table.scroll_to(idx, highlight=True)
+        self.show_source(line_no)
+        if lines[idx + 1] != line_no:
+            self.status_var.set(f"Line {line_no} has no motion, showing line {lines[idx + 1]}")
+
+    def on_detail_select(self, row):
+        self.show_source(int(self.raw_data["lines"][row + 1]))
+
+    def show_source(self, line_no):
+        """Shows the raw source around line_no (only these lines are read from the file)."""
+        if self.source_lines is None:
+            rows = []
+        else:
+            rows = self.source_lines.context(line_no, self.SOURCE_CONTEXT, self.SOURCE_CONTEXT)
+        width = len(str(rows[-1][0])) if rows else 0
+        self.txt_source.config(state='normal')
+        self.txt_source.delete(1.0, tk.END)
+        self.txt_source.insert(tk.END, "\n".join(f"{n:>{width}}  {text}" for n, text in rows))
+        target = next((i for i, (n, _) in enumerate(rows, 1) if n == line_no), None)
+        if target is not None:
+            self.txt_source.tag_add('hit', f"{target}.0", f"{target}.end")
+            self.txt_source.see(f"{target}.0")
+        self.txt_source.config(state='disabled')
+        self.lbl_source.config(text=f"原始程式: 第 {line_no:,} 行" if rows else "原始程式: 無法讀取來源檔")
+
+    def _clear_source(self):
+        self.txt_source.config(state='normal')
+        self.txt_source.delete(1.0, tk.END)
+        self.txt_source.config(state='disabled')
+        self.lbl_source.config(text="原始程式: 點選一列或跳至行號")
 
     def export_csv(self):
         if self.raw_data is None: return
-        path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV", "*.csv")])
+        path = filedialog.asksaveasfilename(defaultextension=".csv",
+                                            filetypes=[("CSV", "*.csv"), ("CSV (gzip)", "*.csv.gz")])
         if not path: return
         def _export():
             try:
                 self.msg_queue.put(("STATUS", "Exporting CSV..."))
-                matrix = self.raw_data["matrix"]
-                dists = self.raw_data["dists"]
-                lines = self.raw_data["lines"]
-                modes = self.raw_data["modes"]
-                feeds = self.raw_data["feeds"]
-                count = len(dists)
-                all_axes_priority = ['X', 'Y', 'Z', 'A', 'B', 'C', 'I', 'J', 'K']
-                active_cols = [ax for ax in all_axes_priority if ax in self.detected_axes]
-                col_indices = [{ax: i for i, ax in enumerate(all_axes_priority)}[ax] for ax in active_cols]
-                with open(path, 'w', newline='', encoding='utf-8-sig') as f:
-                    writer = csv.writer(f)
-                    s_h = [f"Start_{ax}" for ax in active_cols]
-                    e_h = [f"End_{ax}" for ax in active_cols]
-                    is_tcp = self.raw_data["is_tcp"]
-                    d_h = ["XYZ_Dist", "Rot_Deg", "Total_Dist"] if is_tcp else ["Dist"]
-                    writer.writerow(["Line", "Mode"] + s_h + e_h + d_h + ["Feed", "Info"])
-                    rows = []
-                    BATCH = 5000
-                    for i in range(count):
-                        l_num = lines[i+1]
-                        row_s = matrix[i]
-                        row_e = matrix[i+1]
-                        s_vals = [row_s[c] for c in col_indices]
-                        e_vals = [row_e[c] for c in col_indices]
-                        if is_tcp:
-                            d_vals = [self.raw_data["dists_xyz"][i], self.raw_data["rots_deg"][i], dists[i]]
-                        else:
-                            d_vals = [dists[i]]
-                        mode_val = modes[i+1]
-                        feed_val = feeds[i+1]
-                        mode_str = 'G00' if mode_val == 0.0 else 'G01'
-                        rows.append([l_num, self.current_calc_mode] + s_vals + e_vals + d_vals + [feed_val, mode_str])
-                        if len(rows) >= BATCH:
-                            writer.writerows(rows)
-                            rows = []
-                    if rows: writer.writerows(rows)
+                compress = 'gzip' if path.lower().endswith('.gz') else None
+                self.engine.export_csv(self.raw_data, path, compress=compress,
+                                       progress_callback=self._export_callback)
+                self.msg_queue.put(("PROGRESS", (0, "Export Complete")))
                 self.msg_queue.put(("STATUS", "Export Complete"))
                 messagebox.showinfo("Success", "Export Complete")
             except Exception as e:
                 messagebox.showerror("Failed", str(e))
-        threading.Thread(target=_export).start()
+        threading.Thread(target=_export, daemon=True).start()
+
+    def export_stats(self):
+        if self.stats is None: return
+        path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV", "*.csv")])
+        if not path: return
+        try:
+            self.engine.export_stats_csv(self.stats, path)
+            self.status_var.set("Statistics Exported")
+        except OSError as e:
+            messagebox.showerror("Failed", str(e))
+
+    def _export_callback(self, pct, msg):
+        self.msg_queue.put(("PROGRESS", (pct, msg)))
+        return False
 
     def toggle_pause(self):
+        if self.analysis is None: return
         self.is_paused = not self.is_paused
+        if self.is_paused:
+            self.analysis.pause()
+        else:
+            self.analysis.resume_run()
+            self.status_var.set("Resuming...")
         self.btn_pause.config(text="繼續" if self.is_paused else "暫停")
 
     def stop_analysis(self):
-        self.should_stop = True
+        if self.analysis is None: return
+        self.analysis.stop()
+        self.btn_pause.config(state='disabled')
+        self.btn_stop.config(state='disabled')
+        self.status_var.set("Stopping...")
 
     def on_closing(self):
         self.should_stop = True
+        if self.analysis is not None:
+            self.analysis.shutdown()
+            self.analysis = None
+        if self.shared_result is not None:
+            self.shared_result.release()
+            self.shared_result = None
         if self.after_id:
             self.root.after_cancel(self.after_id)
             self.after_id = None
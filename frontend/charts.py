@@ -4,6 +4,12 @@ import matplotlib
 matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba, LogNorm
+from matplotlib.ticker import FuncFormatter, MultipleLocator
+from matplotlib.patches import Polygon, Rectangle
+import threading
+import queue
 import numpy as np
 
 class ChartManager:
@@ -32,67 +38,94 @@ class ChartManager:
         
         self.canvas.mpl_connect("motion_notify_event", self.on_hover)
         self.canvas.mpl_connect("scroll_event", self.on_scroll)
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.canvas.mpl_connect("axes_leave_event", lambda e: self._set_hover(None))
         
         self.bars = None
         self.hist_data = None
         self.last_plot_args = None
+        self.colorbar = None
         self.current_scale_hist = 1.0
-        self.tooltip = None # 懸停提示框
+        
+        # 直方圖上可就地更新的元件 (縮放時只移動位置，不重建)
+        self.max_val = 1
+        self.pct_texts = []
+        self.rank_artists = {}   # bar index -> (虛線, 排名文字, 百分比文字長度)
+        
+        # 縮放/懸停皆以 blit 重繪: bg_static 不含會移動的元件，background 含全部
+        self.bg_static = None
+        self.background = None
+        self.dynamic_artists = []
+        self.hover_idx = None
+        self.hover_patch = None
+        self.hover_annot = None
+        
+        # 滾輪停止後才完整重繪一次 (X 軸刻度與格線在背景中)
+        self.settle_timer = self.canvas.new_timer(interval=200)
+        self.settle_timer.single_shot = True
+        self.settle_timer.add_callback(self.canvas.draw_idle)
 
     def update_size(self, width_inch, height_inch):
         self.figure.set_size_inches(width_inch, height_inch)
         self.canvas.draw()
 
     def on_scroll(self, event):
-        if not self.last_plot_args: return
+        if not self.last_plot_args or self.bars is None: return
         if event.button == 'up':
             self.current_scale_hist = min(1.5, self.current_scale_hist * 1.1)
         elif event.button == 'down':
             self.current_scale_hist = max(0.5, self.current_scale_hist * 0.9)
         
-        if self.last_plot_args:
-            self.plot_histogram(*self.last_plot_args)
+        self._layout_labels()
+        if self.bg_static is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.bg_static)
+        self._draw_dynamic()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._blit_hover()
+        self.settle_timer.stop()
+        self.settle_timer.start()
 
-    def plot_histogram(self, distances, bins, fixed_intervals):
-        # 儲存參數供縮放使用
-        self.last_plot_args = (distances, bins, fixed_intervals)
+    def plot_histogram(self, stats):
+        # 儲存統計物件供縮放使用 (縮放只重繪，不重新計算)
+        self.last_plot_args = (stats,)
         
+        self._remove_colorbar()
         self.ax.clear()
         self.ax.set_facecolor(self.colors['bg_card'])
+        self.bars = None
+        self.hover_idx = None
+        self.dynamic_artists = []
         
         c_fg = self.colors['fg_main']
         c_grid = self.colors['grid']
         c_bar = self.colors['accent']
         c_star = self.colors['star']
         
-        # [修正] 支援 Numpy Array 的判斷方式
-        if distances is None or len(distances) == 0:
+        if stats is None or stats.total_count == 0:
             self.ax.text(0.5, 0.5, '無數據', ha='center', va='center', color=c_fg)
             self.canvas.draw()
             return
 
-        # Numpy histogram 運算極快，即便是百萬筆資料也是瞬間完成
-        hist, _ = np.histogram(distances, bins=bins)
+        # 計數、百分比與 Top 10 排名都來自同一個 SegmentStats
+        hist = stats.counts
         self.hist_data = hist
         
         labels = [
             f"{s:.3f}<=D<{e:.3f}" if e != float('inf') else f"{s:.3f}<D"
-            for s, e in fixed_intervals
+            for s, e in stats.intervals
         ]
         
-        # 計算 Top 10
-        total_segments = len(distances)
-        percentages = [count / total_segments * 100 if total_segments > 0 else 0 for count in hist]
-        percentages_with_index = [(pct, idx) for idx, pct in enumerate(percentages)]
-        top_10 = sorted(percentages_with_index, key=lambda x: x[0], reverse=True)[:10]
-        top_10_indices = [idx for _, idx in top_10]
-        top_10_ranks = {idx: rank + 1 for rank, idx in enumerate(top_10_indices)}
+        percentages = stats.percentages
+        ranks = stats.ranks
+        top_10_indices = [i for i in np.argsort(ranks) if ranks[i] > 0]
         max_idx = top_10_indices[0] if top_10_indices else 0
 
         y_pos = np.arange(len(labels))
         
-        # 繪製 Bar
-        self.bars = self.ax.barh(y_pos, hist * self.current_scale_hist, align='center', 
+        # 繪製 Bar (寬度為實際數量，縮放改變 X 軸範圍)
+        self.bars = self.ax.barh(y_pos, hist, align='center', 
                                 color=c_bar, edgecolor=self.colors['bg_card'], alpha=0.8, height=0.7)
         
         self.ax.set_yticks(y_pos)
@@ -109,91 +142,798 @@ class ChartManager:
         self.ax.spines['left'].set_color(c_grid)
         self.ax.grid(True, axis='x', alpha=0.2, linestyle='--', color=c_grid)
 
-        # 設定 X 軸範圍 (留空間給標籤)
-        max_val = max(hist) if len(hist) > 0 and max(hist) > 0 else 1
-        x_max = max_val * (1.4 * self.current_scale_hist)
-        self.ax.set_xlim(0, x_max)
+        self.max_val = hist.max() if len(hist) > 0 and hist.max() > 0 else 1
 
-        # 繪製 Top 10 標籤與虛線
-        for i, bar in enumerate(self.bars):
-            width = bar.get_width()
-            percentage = percentages[i]
-            text = f'{percentage:.1f}%'
+        # 百分比標籤與 Top 10 虛線/排名 (位置由 _layout_labels 設定)
+        self.pct_texts = []
+        self.rank_artists = {}
+        for i in range(len(hist)):
+            text = f'{percentages[i]:.1f}%'
             if i == max_idx:
                 text += ' ★'
-            
-            # 文字位置
-            text_x = width + (0.02 * x_max)
-            bar_y = bar.get_y() + bar.get_height() / 2
-            
-            # 顯示百分比文字
-            self.ax.text(text_x, bar_y, text, 
+            self.pct_texts.append(self.ax.text(0, i, text, 
                         ha='left', va='center', fontsize=9, 
-                        color=c_star if i == max_idx else c_fg, weight='bold')
+                        color=c_star if i == max_idx else c_fg, weight='bold'))
             
-            # 如果是 Top 10，畫虛線與排名
-            if i in top_10_indices:
-                text_len_est = len(text) * (x_max * 0.025) 
-                line_start = text_x + text_len_est
-                
-                self.ax.plot([line_start, x_max], [bar_y, bar_y], 
+            if ranks[i] > 0:
+                line, = self.ax.plot([0, 0], [i, i], 
                             color=c_star, linestyle='--', linewidth=0.8, alpha=0.5)
-                
-                rank = top_10_ranks[i]
-                self.ax.text(x_max, bar_y, f'Top{rank}', 
+                rank_text = self.ax.text(0, i, f'Top{ranks[i]}', 
                             ha='right', va='center', fontsize=9, 
                             color=c_star, weight='bold')
+                self.rank_artists[i] = (line, rank_text, len(text))
+
+        # 縮放時會移動的元件不進背景，改由 blit 繪製
+        self.dynamic_artists = list(self.bars) + self.pct_texts + [a for line, txt, _ in self.rank_artists.values() for a in (line, txt)]
+        for artist in self.dynamic_artists:
+            artist.set_animated(True)
 
+        # 懸停高亮與提示框: animated，只透過 blit 繪製
+        self.hover_patch = self.ax.barh([0], [0], height=0.7, color=c_star, alpha=0.35, animated=True)[0]
+        self.hover_patch.set_visible(False)
+        self.hover_annot = self.ax.annotate("", xy=(0, 0), xytext=(15, -10), textcoords='offset points',
+                                            color="#FFF", fontsize=9, animated=True, annotation_clip=False,
+                                            bbox=dict(boxstyle='round,pad=0.3', fc="#333", ec="#333"))
+        self.hover_annot.set_visible(False)
+
+        self._layout_labels()
         self.figure.tight_layout()
         self.canvas.draw()
 
-    def plot_f_curve(self, x_values, f_values, t_value, max_dist, hist_data, fixed_intervals):
-        # 暫時保留此函式，雖然 UI 目前沒呼叫
+    def _layout_labels(self):
+        """依目前縮放比例設定 X 軸範圍與標籤位置 (就地更新)。"""
+        x_max = self.max_val * 1.4 / self.current_scale_hist
+        self.ax.set_xlim(0, x_max)
+        for i, txt in enumerate(self.pct_texts):
+            txt.set_x(self.hist_data[i] + 0.02 * x_max)
+        for i, (line, rank_text, text_len) in self.rank_artists.items():
+            line_start = self.hist_data[i] + 0.02 * x_max + text_len * (x_max * 0.025)
+            line.set_xdata([line_start, x_max])
+            rank_text.set_x(x_max)
+
+    def plot_f_curve(self, density, fixed_intervals=()):
+        """
+        進給 x 分段長度密度圖: FeedDensity 的格子畫成單一影像 (對數色階)，
+        兩軸以 log10 座標顯示，虛線為目前的區間邊界。只讀取快取的格子數，
+        與單節數無關。
+        """
+        self._remove_colorbar()
         self.ax.clear()
+        self.bars = None
+        self.hover_idx = None
+        self.dynamic_artists = []
+        self.last_plot_args = None
         self.ax.set_facecolor(self.colors['bg_card'])
-        
+
         c_fg = self.colors['fg_main']
         c_grid = self.colors['grid']
-        c_line = self.colors['line']
-        
-        if x_values is None or len(x_values) == 0:
-            self.ax.text(0.5, 0.5, '無效數據', ha='center', color=c_fg)
+
+        if density is None or not density.counts.any():
+            self.ax.text(0.5, 0.5, '無數據', ha='center', va='center', color=c_fg)
             self.canvas.draw()
             return
 
-        self.ax.plot(x_values, f_values, color=c_line, linewidth=2)
-        
+        counts = np.ma.masked_equal(density.counts, 0)
+        lx, ly = np.log10(density.dist_edges), np.log10(density.feed_edges)
+        image = self.ax.imshow(counts, origin='lower', aspect='auto', interpolation='nearest',
+                               extent=(lx[0], lx[-1], ly[0], ly[-1]), cmap='viridis',
+                               norm=LogNorm(vmin=1, vmax=max(int(counts.max()), 2)))
+
+        # 座標是 log10 值，刻度標回原始數值
+        decade = FuncFormatter(lambda v, pos: f"{10 ** v:g}")
+        for axis in (self.ax.xaxis, self.ax.yaxis):
+            axis.set_major_locator(MultipleLocator(1))
+            axis.set_major_formatter(decade)
+        for s, _ in fixed_intervals[1:]:
+            if s > 0 and lx[0] < np.log10(s) < lx[-1]:
+                self.ax.axvline(np.log10(s), color=c_fg, alpha=0.25, linestyle='--', linewidth=0.6)
+
         self.ax.set_xlabel('Length (mm)', color=c_fg)
         self.ax.set_ylabel('Feed (mm/min)', color=c_fg)
-        
+        if density.no_feed:
+            self.ax.set_title(f"無進給單節 {density.no_feed:,} 筆未列入", color=self.colors['fg_dim'], fontsize=9, loc='right')
+
         self.ax.tick_params(axis='both', colors=c_fg)
-        self.ax.spines['top'].set_visible(False)
-        self.ax.spines['right'].set_visible(False)
-        self.ax.spines['bottom'].set_color(c_grid)
-        self.ax.spines['left'].set_color(c_grid)
-        self.ax.grid(True, alpha=0.2, linestyle='--', color=c_grid)
-        
+        for side in self.ax.spines.values():
+            side.set_color(c_grid)
+
+        self.colorbar = self.figure.colorbar(image, ax=self.ax, pad=0.02)
+        self.colorbar.set_label('單節數', color=c_fg)
+        self.colorbar.ax.tick_params(colors=c_fg, which='both')
+        self.colorbar.outline.set_edgecolor(c_grid)
+
         self.figure.tight_layout()
         self.canvas.draw()
 
+    def _remove_colorbar(self):
+        if self.colorbar is not None:
+            self.colorbar.remove()
+            self.colorbar = None
+
+    def on_draw(self, event):
+        # 完整重繪後保存背景，之後縮放與懸停只 blit 動態元件
+        self.bg_static = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_dynamic()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._blit_hover()
+
+    def _draw_dynamic(self):
+        for artist in self.dynamic_artists:
+            self.ax.draw_artist(artist)
+
     def on_hover(self, event):
-        if event.inaxes != self.ax or self.bars is None:
-            if self.tooltip: self.tooltip.destroy()
+        if event.inaxes != self.ax or self.bars is None or event.ydata is None:
+            self._set_hover(None)
+            return
+
+        # O(1): bar i 置中於 y = i，高度 0.7
+        i = int(round(event.ydata))
+        if 0 <= i < len(self.hist_data) and abs(event.ydata - i) <= 0.35:
+            self._set_hover(i, event.xdata, event.ydata)
+        else:
+            self._set_hover(None)
+
+    def _set_hover(self, idx, x=None, y=None):
+        if self.hover_patch is None or self.bars is None: return
+        if idx is None:
+            if self.hover_idx is None: return
+            self.hover_idx = None
+            self.hover_patch.set_visible(False)
+            self.hover_annot.set_visible(False)
+        else:
+            if idx != self.hover_idx:
+                self.hover_idx = idx
+                count = int(self.hist_data[idx])
+                self.hover_patch.set_y(idx - 0.35)
+                self.hover_patch.set_width(max(count, self.max_val * 0.005))
+                self.hover_annot.set_text(f"數量: {count:,} 筆")
+                self.hover_patch.set_visible(True)
+                self.hover_annot.set_visible(True)
+            self.hover_annot.xy = (x, y)
+        self._blit_hover()
+
+    def _blit_hover(self):
+        if self.background is None or self.hover_patch is None: return
+        self.canvas.restore_region(self.background)
+        if self.hover_idx is not None:
+            self.ax.draw_artist(self.hover_patch)
+            self.ax.draw_artist(self.hover_annot)
+        self.canvas.blit(self.figure.bbox)
+
+
+
+class PathLOD:
+    """
+    刀具路徑的多層次細節 (LOD) 金字塔，供繪圖使用。
+
+    第 0 層是全部點；往上每一層把下一層每 GROUP 個連續點縮成 KEEP 個:
+    u 最小/最大與 v 最小/最大的點 (保持路徑順序)。保留的點恰好張成被取代
+    點的外框，所以縮小時路徑範圍不會內縮；每組的外框也是其原始區段的精確
+    外框，query() 只往與視窗相交的組別展開，成本與畫面內的細節成正比，
+    與總點數無關。
+    """
+
+    GROUP = 16
+    KEEP = 4
+    # 每次處理的點數 (GROUP 的倍數)，限制建構時的暫存記憶體
+    BLOCK = GROUP * 65536
+
+    def __init__(self, u, v, top_size=4096):
+        self.u = u
+        self.v = v
+        self.n = len(u)
+        # levels[l - 1]: 第 l 層各點的原始索引 (每 KEEP 個一組)
+        self.levels = []
+        dtype = np.int32 if self.n < 2 ** 31 else np.int64
+        size = self.n
+        while size > top_size:
+            self.levels.append(self._reduce(self.levels[-1] if self.levels else None, size, dtype))
+            size = len(self.levels[-1])
+
+    def _reduce(self, prev, size, dtype):
+        G, K = self.GROUP, self.KEEP
+        out = np.empty(-(-size // G) * K, dtype=dtype)
+        for start in range(0, size, self.BLOCK):
+            stop = min(start + self.BLOCK, size)
+            pos = np.arange(start, stop, dtype=dtype) if prev is None else prev[start:stop]
+            pad = -len(pos) % G
+            if pad:
+                pos = np.concatenate((pos, np.full(pad, pos[-1], dtype=dtype)))
+            pos = pos.reshape(-1, G)
+            uu, vv = self.u[pos], self.v[pos]
+            pick = np.stack((uu.argmin(1), uu.argmax(1), vv.argmin(1), vv.argmax(1)), axis=1)
+            pick.sort(axis=1)
+            first = start // G * K
+            out[first:first + pick.size] = pos[np.arange(len(pos))[:, None], pick].ravel()
+        return out
+
+    def extent(self):
+        """整條路徑的 (u0, u1, v0, v1)，由最上層算出 (與原始點相同)。"""
+        top = self.levels[-1] if self.levels else slice(None)
+        u, v = self.u[top], self.v[top]
+        return float(u.min()), float(u.max()), float(v.min()), float(v.max())
+
+    def query(self, u0, u1, v0, v1, budget):
+        """
+        視窗 (u0..u1, v0..v1) 要畫的點: 取可見部分不超過約 budget 點的
+        最細層。傳回 (該層位置, 原始索引, 層號)；只有在該層相鄰的點才相連
+        (見 segments())。
+        """
+        G, K = self.GROUP, self.KEEP
+        level = len(self.levels)
+        pos = np.arange(len(self.levels[-1]) if level else self.n)
+        while level > 0:
+            index = self.levels[level - 1]
+            groups = np.unique(pos // K)
+            members = index[groups[:, None] * K + np.arange(K)]
+            gu, gv = self.u[members], self.v[members]
+            hit = (gu.max(1) >= u0) & (gu.min(1) <= u1) & (gv.max(1) >= v0) & (gv.min(1) <= v1)
+            groups = groups[hit]
+            if len(groups) * G > budget:
+                pos = (groups[:, None] * K + np.arange(K)).ravel()
+                break
+            below = len(self.levels[level - 2]) if level > 1 else self.n
+            pos = (groups[:, None] * G + np.arange(G)).ravel()
+            pos = pos[pos < below]
+            level -= 1
+        else:
+            # 第 0 層: 只留視窗內的點
+            uu, vv = self.u[pos], self.v[pos]
+            pos = pos[(uu >= u0) & (uu <= u1) & (vv >= v0) & (vv <= v1)]
+
+        # 前後各補一點，讓穿出視窗的線段畫到視窗外
+        size = len(self.levels[level - 1]) if level else self.n
+        if len(pos):
+            pos = np.unique(np.concatenate((pos - 1, pos, pos + 1)))
+            pos = pos[(pos >= 0) & (pos < size)]
+        orig = self.levels[level - 1][pos] if level else pos
+        return pos, orig, level
+
+    @staticmethod
+    def segments(pos, orig):
+        """要畫的線段 (起點, 終點) 原始索引。"""
+        join = np.flatnonzero(np.diff(pos) == 1)
+        return orig[join], orig[join + 1]
+
+
+class ToolpathView:
+    """
+    刀具路徑預覽: XY / XZ / YZ 投影與等角 (ISO) 視圖。
+
+    整條路徑只有一個 LineCollection，依 G00/G01 上色。每次平移或縮放只向
+    PathLOD 取約一個畫面份量的點 (畫布寬度 x VERTICES_PER_PIXEL)，所以
+    五千萬節的程式也能流暢操作。金字塔在背景執行緒建立，每個投影一份。
+    視野以中心點與每像素 mm 表示，兩軸比例永遠相同。
+    """
+
+    PROJECTIONS = ('XY', 'XZ', 'YZ', 'ISO')
+    # 點選查詢時投影座標對應的機械軸 (0=X, 1=Y, 2=Z)；ISO 無法反推深度
+    PICK_DIMS = {'XY': (0, 1), 'XZ': (0, 2), 'YZ': (1, 2)}
+    PICK_PIXELS = 6
+    AXIS_LABELS = {'XY': ('X', 'Y'), 'XZ': ('X', 'Z'), 'YZ': ('Y', 'Z'), 'ISO': ('', '')}
+    VERTICES_PER_PIXEL = 16
+    ZOOM_STEP = 1.25
+    # 等角視圖: u = (x - y) cos30°, v = z + (x + y) sin30°
+    ISO_COS, ISO_SIN = np.cos(np.radians(30)), np.sin(np.radians(30))
+    ISO_BLOCK = 1 << 20
+
+    def __init__(self, parent_frame, theme_manager):
+        self.parent = parent_frame
+        self.tm = theme_manager
+        self.colors = self.tm.get_color_palette()
+
+        self.figure, self.ax = plt.subplots(figsize=(8, 5), dpi=96)
+        self.figure.patch.set_facecolor(self.colors['bg_card'])
+        self.ax.set_facecolor(self.colors['bg_card'])
+        self.ax.tick_params(axis='both', colors=self.colors['fg_main'])
+        for side in self.ax.spines.values():
+            side.set_color(self.colors['grid'])
+        self.ax.grid(True, alpha=0.2, linestyle='--', color=self.colors['grid'])
+
+        # index 0 = G00 (空跑)，1 = G01 (切削)
+        self.rgba = np.array([to_rgba(self.colors['warning'], 0.6), to_rgba(self.colors['accent'], 1.0)])
+        self.collection = LineCollection([], linewidths=0.8)
+        self.ax.add_collection(self.collection, autolim=False)
+        self.info = self.ax.text(0.01, 0.99, '', transform=self.ax.transAxes, ha='left', va='top',
+                                 fontsize=9, color=self.colors['fg_dim'])
+        # 點選或框選到的線段
+        self.picked = LineCollection([], linewidths=2.5, colors=self.colors['danger'], zorder=3)
+        self.ax.add_collection(self.picked, autolim=False)
+        self.picked_segments = np.empty(0, dtype=np.int64)
+        self.band = Rectangle((0, 0), 0, 0, fill=False, edgecolor=self.colors['fg_main'], linestyle='--',
+                              linewidth=0.8, visible=False)
+        self.ax.add_patch(self.band)
+
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self.parent)
+        self.canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.canvas.mpl_connect("scroll_event", self.on_scroll)
+        self.canvas.mpl_connect("button_press_event", self.on_press)
+        self.canvas.mpl_connect("motion_notify_event", self.on_motion)
+        self.canvas.mpl_connect("button_release_event", self.on_release)
+        self.canvas.mpl_connect("resize_event", lambda e: self._refresh())
+
+        self.matrix = None
+        self.columns = None
+        self.modes = None
+        self.projection = 'XY'
+        self.lods = {}
+        self.lod = None
+        self.visible = False
+        self.generation = 0
+        self.building = set()
+        self.built = queue.Queue()
+        self.center = (0.0, 0.0)
+        self.scale = 1.0  # mm / 像素
+        self.drag = None
+        self.select = None
+        # pick_callback(dims, point=(u, v, 容差) 或 box=(u0, u1, v0, v1))
+        self.pick_callback = None
+
+    # ------------------------------------------------------------------
+    # 資料
+    # ------------------------------------------------------------------
+    def set_path(self, matrix, columns, modes):
+        """matrix: 已前向填補的結果矩陣；columns: X/Y/Z 欄位索引 (不存在為 None)。"""
+        self.matrix, self.columns, self.modes = matrix, columns, modes
+        self.generation += 1
+        self.lods = {}
+        self.lod = None
+        self.picked_segments = np.empty(0, dtype=np.int64)
+        if self.visible:
+            self.show()
+
+    def clear(self):
+        self.set_path(None, None, None)
+        self.collection.set_segments([])
+        self.picked.set_segments([])
+        self.info.set_text('')
+        self.canvas.draw_idle()
+
+    def set_projection(self, name):
+        self.projection = name
+        self.lod = None
+        self.picked_segments = np.empty(0, dtype=np.int64)
+        if self.visible:
+            self.show()
+
+    def show(self):
+        """切換到此視圖時呼叫: 需要時在背景建立目前投影的金字塔。"""
+        self.visible = True
+        if self.matrix is None:
+            return
+        lod = self.lods.get(self.projection)
+        if lod is not None:
+            if self.lod is not lod:
+                self.lod = lod
+                self.reset_view()
+            return
+        key = (self.generation, self.projection)
+        if key in self.building:
+            return
+        if not self.building:
+            self.canvas.get_tk_widget().after(100, self._check_built)
+        self.building.add(key)
+        self.info.set_text("建立路徑預覽中...")
+        self.canvas.draw_idle()
+        threading.Thread(target=self._build, args=key, daemon=True).start()
+
+    def hide(self):
+        self.visible = False
+
+    def _axis(self, name):
+        col = self.columns[name]
+        if col is None:
+            return np.broadcast_to(np.float64(0.0), len(self.matrix))
+        return self.matrix[:, col]
+
+    def _project(self, projection):
+        x, y, z = self._axis('X'), self._axis('Y'), self._axis('Z')
+        if projection == 'XY': return x, y
+        if projection == 'XZ': return x, z
+        if projection == 'YZ': return y, z
+        n = len(self.matrix)
+        u = np.empty(n, dtype=np.float32)
+        v = np.empty(n, dtype=np.float32)
+        for lo in range(0, n, self.ISO_BLOCK):
+            hi = min(lo + self.ISO_BLOCK, n)
+            u[lo:hi] = (x[lo:hi] - y[lo:hi]) * self.ISO_COS
+            v[lo:hi] = z[lo:hi] + (x[lo:hi] + y[lo:hi]) * self.ISO_SIN
+        return u, v
+
+    def _build(self, generation, projection):
+        # 背景執行緒: 不碰 Tk，結果交給 _check_built 在主執行緒套用
+        try:
+            lod = PathLOD(*self._project(projection))
+        except Exception:
+            lod = None
+        self.built.put((generation, projection, lod))
+
+    def _check_built(self):
+        while not self.built.empty():
+            generation, projection, lod = self.built.get_nowait()
+            self.building.discard((generation, projection))
+            # 期間若已載入新結果則丟棄
+            if generation == self.generation and lod is not None:
+                self.lods[projection] = lod
+                if self.visible and projection == self.projection:
+                    self.show()
+        if self.building:
+            self.canvas.get_tk_widget().after(100, self._check_built)
+
+    # ------------------------------------------------------------------
+    # 繪製
+    # ------------------------------------------------------------------
+    def _pixels(self):
+        box = self.ax.get_window_extent()
+        return max(box.width, 1.0), max(box.height, 1.0)
+
+    def reset_view(self):
+        if self.lod is None: return
+        u0, u1, v0, v1 = self.lod.extent()
+        width, height = self._pixels()
+        self.center = ((u0 + u1) / 2, (v0 + v1) / 2)
+        self.scale = max((u1 - u0) / width, (v1 - v0) / height, 1e-6) * 1.06
+        names = self.AXIS_LABELS[self.projection]
+        self.ax.set_xlabel(names[0], color=self.colors['fg_main'])
+        self.ax.set_ylabel(names[1], color=self.colors['fg_main'])
+        self._refresh()
+
+    def _refresh(self):
+        if self.lod is None: return
+        width, height = self._pixels()
+        cu, cv = self.center
+        u0, u1 = cu - self.scale * width / 2, cu + self.scale * width / 2
+        v0, v1 = cv - self.scale * height / 2, cv + self.scale * height / 2
+        self.ax.set_xlim(u0, u1)
+        self.ax.set_ylim(v0, v1)
+
+        budget = max(self.canvas.get_tk_widget().winfo_width(), 100) * self.VERTICES_PER_PIXEL
+        pos, orig, level = self.lod.query(u0, u1, v0, v1, budget)
+        start, end = PathLOD.segments(pos, orig)
+
+        u, v = self.lod.u, self.lod.v
+        segs = np.empty((len(start), 2, 2))
+        segs[:, 0, 0], segs[:, 0, 1] = u[start], v[start]
+        segs[:, 1, 0], segs[:, 1, 1] = u[end], v[end]
+        # 線段 i (第 i 列到第 i+1 列) 的模式是 modes[i + 1]: 以終點的模式上色
+        cutting = np.asarray(self.modes[end]) != 0
+        self.collection.set_segments(segs)
+        self.collection.set_color(self.rgba[cutting.astype(np.intp)])
+        picked = self.picked_segments
+        self.picked.set_segments(np.stack((np.column_stack((u[picked], v[picked])),
+                                           np.column_stack((u[picked + 1], v[picked + 1]))), axis=1))
+        detail = "完整" if level == 0 else f"1/{(PathLOD.GROUP // PathLOD.KEEP) ** level}"
+        self.info.set_text(f"{self.projection}  {len(start):,} 線段  細節 {detail}")
+        self.canvas.draw_idle()
+
+    def highlight(self, segments):
+        """標示線段 (線段 i 為第 i 列到第 i+1 列)。"""
+        self.picked_segments = np.asarray(segments, dtype=np.int64)
+        self._refresh()
+
+    # ------------------------------------------------------------------
+    # 平移 / 縮放 / 點選 (Shift+拖曳為框選)
+    # ------------------------------------------------------------------
+    def on_scroll(self, event):
+        if self.lod is None or event.inaxes != self.ax: return
+        factor = 1 / self.ZOOM_STEP if event.button == 'up' else self.ZOOM_STEP
+        # 游標下的點保持不動
+        cu, cv = self.center
+        self.center = (event.xdata + (cu - event.xdata) * factor, event.ydata + (cv - event.ydata) * factor)
+        self.scale *= factor
+        self._refresh()
+
+    def on_press(self, event):
+        if self.lod is None or event.inaxes != self.ax: return
+        if event.dblclick:
+            self.reset_view()
+        elif event.button == 1 and event.key == 'shift':
+            self.select = (event.xdata, event.ydata)
+            self.band.set_bounds(event.xdata, event.ydata, 0, 0)
+            self.band.set_visible(True)
+        elif event.button == 1:
+            self.drag = (event.x, event.y, self.center)
+
+    def on_motion(self, event):
+        if self.select is not None:
+            if event.inaxes == self.ax:
+                u0, v0 = self.select
+                self.band.set_bounds(u0, v0, event.xdata - u0, event.ydata - v0)
+                self.canvas.draw_idle()
+            return
+        if self.drag is None: return
+        x0, y0, (cu, cv) = self.drag
+        self.center = (cu - (event.x - x0) * self.scale, cv - (event.y - y0) * self.scale)
+        self._refresh()
+
+    def on_release(self, event):
+        drag, self.drag = self.drag, None
+        if self.select is not None:
+            self.band.set_visible(False)
+            x, y, w, h = self.band.get_bbox().bounds
+            self.select = None
+            self.canvas.draw_idle()
+            if w > 0 and h > 0:
+                self._pick(box=(x, x + w, y, y + h))
+        elif drag is not None and abs(event.x - drag[0]) + abs(event.y - drag[1]) <= 3 and event.inaxes == self.ax:
+            # 沒有拖曳的單擊: 查詢最近線段
+            self._pick(point=(event.xdata, event.ydata, self.PICK_PIXELS * self.scale))
+
+    def _pick(self, **query):
+        if self.pick_callback is not None:
+            self.pick_callback(self.PICK_DIMS.get(self.projection), **query)
+
+
+class SeriesEnvelope:
+    """
+    長序列的 min/max 包絡線，供每個像素欄取一組 (最小, 最大)。
+
+    預先以 BASE 點為一塊計算每塊的最小/最大 (第 0 層)，往上每層再合併
+    FACTOR 塊。query() 選塊寬不超過一個像素欄的最粗層，只對可見範圍做
+    reduceat，所以任何縮放下的工作量都約為 FACTOR x 像素欄數，與序列長度
+    無關。NaN 會被略過 (fmin/fmax)。
+    """
+
+    BASE = 64
+    FACTOR = 8
+    # 每次處理的點數 (BASE 的倍數)，限制建構時的暫存記憶體
+    BLOCK = BASE * 65536
+
+    def __init__(self, values):
+        self.values = values
+        self.n = len(values)
+        # levels[k] = (mins, maxs)，塊寬 BASE * FACTOR**k
+        self.levels = []
+        mins, maxs = self._reduce_blocks(values)
+        while True:
+            self.levels.append((mins, maxs))
+            if len(mins) <= self.FACTOR:
+                break
+            mins = self._reduce(mins, self.FACTOR, np.fmin)
+            maxs = self._reduce(maxs, self.FACTOR, np.fmax)
+
+    def _reduce_blocks(self, values):
+        count = -(-self.n // self.BASE)
+        mins = np.empty(count, dtype=np.float32)
+        maxs = np.empty(count, dtype=np.float32)
+        for start in range(0, self.n, self.BLOCK):
+            block = values[start:start + self.BLOCK]
+            first = start // self.BASE
+            mins[first:first + -(-len(block) // self.BASE)] = self._reduce(block, self.BASE, np.fmin)
+            maxs[first:first + -(-len(block) // self.BASE)] = self._reduce(block, self.BASE, np.fmax)
+        return mins, maxs
+
+    @staticmethod
+    def _reduce(values, size, ufunc):
+        return ufunc.reduceat(values, np.arange(0, len(values), size)).astype(np.float32, copy=False)
+
+    def query(self, i0, i1, columns):
+        """
+        索引 i0..i1 分成最多 columns 欄: 傳回 (各欄起點索引, 最小, 最大)。
+        欄界對齊到所用層的塊界，誤差不超過一塊 (小於一個像素欄)。
+        """
+        i0, i1 = max(int(i0), 0), min(int(i1), self.n)
+        if i1 <= i0:
+            empty = np.empty(0, dtype=np.float32)
+            return np.empty(0, dtype=np.int64), empty, empty
+        width = (i1 - i0) / max(columns, 1)
+        chunk, level = 1, -1
+        while level + 1 < len(self.levels) and self.BASE * self.FACTOR ** (level + 1) <= width:
+            level += 1
+            chunk = self.BASE * self.FACTOR ** level
+        if level < 0:
+            mins = maxs = self.values
+        else:
+            mins, maxs = self.levels[level]
+        j0, j1 = i0 // chunk, -(-i1 // chunk)
+        edges = np.unique(np.arange(columns) * (j1 - j0) // columns)
+        lo = np.fmin.reduceat(mins[j0:j1], edges)
+        hi = np.fmax.reduceat(maxs[j0:j1], edges)
+        return (edges + j0) * chunk, lo, hi
+
+
+class TimelineChart:
+    """
+    單節趨勢圖: 分段長度 (可加進給、旋轉角) 對行號。
+
+    每條序列一個子圖 (共用 X 軸)，以一個多邊形畫每個像素欄的 min/max
+    包絡線；縮放或平移時只對可見範圍重新查詢 SeriesEnvelope。包絡線在
+    第一次顯示時才於背景執行緒建立 (與 ToolpathView 相同)。
+    """
+
+    SERIES = (('dists', '分段長度 (mm)'), ('feeds', '進給 F'), ('rots_deg', '旋轉角 (°)'))
+    # 與矩陣列對齊的序列 (需去掉原點列)；其餘為每線段一筆
+    ROW_ALIGNED = ('feeds',)
+    ZOOM_STEP = 1.25
+
+    def __init__(self, parent_frame, theme_manager):
+        self.parent = parent_frame
+        self.tm = theme_manager
+        self.colors = self.tm.get_color_palette()
+        self.series_colors = {'dists': self.colors['accent'], 'feeds': self.colors['warning'],
+                              'rots_deg': self.colors['line']}
+
+        self.figure = plt.figure(figsize=(8, 5), dpi=96)
+        self.figure.patch.set_facecolor(self.colors['bg_card'])
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self.parent)
+        self.canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.canvas.mpl_connect("scroll_event", self.on_scroll)
+        self.canvas.mpl_connect("button_press_event", self.on_press)
+        self.canvas.mpl_connect("motion_notify_event", self.on_motion)
+        self.canvas.mpl_connect("button_release_event", self.on_release)
+        self.canvas.mpl_connect("resize_event", lambda e: self._refresh())
+
+        self.data = None
+        self.lines = None
+        self.shown = ['dists']
+        self.envelopes = {}
+        self.generation = 0
+        self.building = set()
+        self.built = queue.Queue()
+        self.axes = {}
+        self.polygons = {}
+        self.notes = {}
+        self.view = (0.0, 1.0)
+        self.visible = False
+        self.drag = None
+
+    def set_data(self, data):
+        """
+        data: 分析結果。lines / feeds 與矩陣列對齊 (第 0 列為原點)，
+        dists / rots_deg 每線段一筆 (線段 i 結束於 lines[i+1])。
+        """
+        self.data = data
+        self.envelopes = {}
+        self.generation += 1
+        if data is None:
+            self.lines = None
+        else:
+            self.lines = data['lines'][1:]
+        self._layout()
+        self.reset_view()
+
+    def clear(self):
+        self.set_data(None)
+
+    def show(self):
+        self.visible = True
+        self._refresh()
+
+    def hide(self):
+        self.visible = False
+
+    def set_series(self, keys):
+        self.shown = [key for key, _ in self.SERIES if key in keys]
+        self._layout()
+        self._refresh()
+
+    def _request_envelope(self, key):
+        """需要時在背景建立序列的包絡線 (整個序列掃過一次，快取結果可能要讀磁碟)。"""
+        job = (self.generation, key)
+        if job in self.building:
+            return
+        if not self.building:
+            self.canvas.get_tk_widget().after(100, self._check_built)
+        self.building.add(job)
+        values = self.data[key]
+        if key in self.ROW_ALIGNED:
+            values = values[1:]
+        threading.Thread(target=self._build, args=(job, values), daemon=True).start()
+
+    def _build(self, job, values):
+        # 背景執行緒: 不碰 Tk，結果交給 _check_built 在主執行緒套用
+        try:
+            env = SeriesEnvelope(values)
+        except Exception:
+            env = None
+        self.built.put((job, env))
+
+    def _check_built(self):
+        done = False
+        while not self.built.empty():
+            job, env = self.built.get_nowait()
+            self.building.discard(job)
+            # 期間若已載入新結果則丟棄
+            if job[0] == self.generation and env is not None:
+                self.envelopes[job[1]] = env
+                done = True
+        if self.building:
+            self.canvas.get_tk_widget().after(100, self._check_built)
+        if done:
+            self._refresh()
+
+    def _layout(self):
+        self.figure.clear()
+        self.axes, self.polygons, self.notes = {}, {}, {}
+        if self.data is None or not self.shown:
+            self.canvas.draw_idle()
+            return
+        labels = dict(self.SERIES)
+        first = None
+        for i, key in enumerate(self.shown):
+            ax = self.figure.add_subplot(len(self.shown), 1, i + 1, sharex=first)
+            first = first or ax
+            ax.set_facecolor(self.colors['bg_card'])
+            ax.tick_params(axis='both', colors=self.colors['fg_main'], labelsize=8)
+            for side in ax.spines.values():
+                side.set_color(self.colors['grid'])
+            ax.grid(True, alpha=0.2, linestyle='--', color=self.colors['grid'])
+            ax.set_ylabel(labels[key], color=self.colors['fg_main'], fontsize=9)
+            ax.ticklabel_format(axis='x', style='plain', useOffset=False)
+            if i < len(self.shown) - 1:
+                ax.tick_params(labelbottom=False)
+            color = self.series_colors[key]
+            poly = Polygon(np.zeros((1, 2)), closed=True, facecolor=color, edgecolor=color, linewidth=0.8)
+            ax.add_patch(poly)
+            self.axes[key] = ax
+            self.polygons[key] = poly
+            self.notes[key] = ax.text(0.5, 0.5, '', transform=ax.transAxes, ha='center', va='center',
+                                      fontsize=9, color=self.colors['fg_dim'])
+        ax.set_xlabel("行號", color=self.colors['fg_main'])
+        self.figure.subplots_adjust(left=0.1, right=0.98, top=0.97, bottom=0.1, hspace=0.08)
+
+    def reset_view(self):
+        if self.lines is None or not len(self.lines): return
+        self.view = (float(self.lines[0]), float(self.lines[-1]))
+        self._refresh()
+
+    def _refresh(self):
+        if not self.axes or not self.visible: return
+        x0, x1 = self.view
+        # 行號遞增，對應回列索引 (以整數查詢：浮點鍵會讓 numpy 複製整個行號陣列)
+        k0, k1 = (self.lines.dtype.type(np.floor(x)) for x in (x0, x1))
+        i0 = max(int(np.searchsorted(self.lines, k0, side='right')) - 1, 0)
+        i1 = int(np.searchsorted(self.lines, k1, side='right')) + 1
+        for key, ax in self.axes.items():
+            env = self.envelopes.get(key)
+            if env is None:
+                self._request_envelope(key)
+                self.notes[key].set_text("建立趨勢資料中...")
+                continue
+            self.notes[key].set_text('')
+            columns = max(int(ax.get_window_extent().width), 1)
+            starts, lo, hi = env.query(i0, i1, columns)
+            if not len(starts):
+                continue
+            xs = self.lines[starts]
+            self.polygons[key].set_xy(np.concatenate((np.column_stack((xs, hi)), np.column_stack((xs[::-1], lo[::-1])))))
+            y0, y1 = float(np.nanmin(lo)), float(np.nanmax(hi))
+            pad = (y1 - y0) * 0.05 or max(abs(y1) * 0.05, 1e-3)
+            ax.set_ylim(y0 - pad, y1 + pad)
+            ax.set_xlim(x0, x1 if x1 > x0 else x0 + 1)
+        self.canvas.draw_idle()
+
+    # ------------------------------------------------------------------
+    # 平移 / 縮放 (只動 X 軸)
+    # ------------------------------------------------------------------
+    def on_scroll(self, event):
+        if event.inaxes is None or self.lines is None: return
+        factor = 1 / self.ZOOM_STEP if event.button == 'up' else self.ZOOM_STEP
+        x0, x1 = self.view
+        cx = event.xdata
+        lo, hi = float(self.lines[0]), float(self.lines[-1])
+        x0, x1 = cx - (cx - x0) * factor, cx + (x1 - cx) * factor
+        if x1 - x0 < 10:
             return
+        self.view = (max(x0, lo), min(x1, hi))
+        self._refresh()
+
+    def on_press(self, event):
+        if event.inaxes is None or self.lines is None: return
+        if event.dblclick:
+            self.reset_view()
+        elif event.button == 1:
+            scale = (self.view[1] - self.view[0]) / max(event.inaxes.get_window_extent().width, 1)
+            self.drag = (event.x, self.view, scale)
+
+    def on_motion(self, event):
+        if self.drag is None: return
+        x_start, (x0, x1), scale = self.drag
+        shift = (x_start - event.x) * scale
+        lo, hi = float(self.lines[0]), float(self.lines[-1])
+        shift = min(max(shift, lo - x0), hi - x1)
+        self.view = (x0 + shift, x1 + shift)
+        self._refresh()
 
-        for i, bar in enumerate(self.bars):
-            if bar.contains(event)[0]:
-                count = self.hist_data[i]
-                self._show_tooltip(event, f"數量: {count} 筆")
-                return
-        
-        if self.tooltip:
-            self.tooltip.destroy()
-
-    def _show_tooltip(self, event, text):
-        if self.tooltip: self.tooltip.destroy()
-        x, y = event.guiEvent.x_root + 15, event.guiEvent.y_root + 10
-        self.tooltip = tk.Toplevel(self.parent)
-        self.tooltip.wm_overrideredirect(True)
-        self.tooltip.wm_geometry(f"+{x}+{y}")
-        tk.Label(self.tooltip, text=text, bg="#333", fg="#FFF", padx=5, pady=2).pack()
\ No newline at end of file
+    def on_release(self, event):
+        self.drag = None
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import tkinter as tk
+import tkinter.font as tkfont
+from tkinter import ttk
+import ttkbootstrap as ttk
+
+
+class VirtualTable:
+    """
+    虛擬捲動表格: 只格式化畫面上看得到的列。
+    row_source(start, count) -> list[str]，資料本身留在結果陣列中，
+    因此不論總列數多少，UI 記憶體固定為一個畫面的文字量。
+    點選一列時標示該列並呼叫 select_callback(row)。
+    """
+    def __init__(self, parent, theme_manager):
+        self.tm = theme_manager
+        self.colors = self.tm.get_color_palette()
+        self.font = tkfont.Font(font=self.tm.fonts['mono'])
+
+        self.total = 0
+        self.first = 0
+        self.row_source = None
+        self.highlight_row = None
+        self.select_callback = None
+
+        self.frame = ttk.Frame(parent)
+
+        text_opts = dict(font=self.tm.fonts['mono'], bg=self.colors['bg_card'], fg=self.colors['fg_main'],
+                         relief='flat', padx=10, wrap='none', cursor='arrow', highlightthickness=0)
+
+        # 表頭 (與內容同步水平捲動)
+        self.header = tk.Text(self.frame, height=2, pady=5, **text_opts)
+        self.header.pack(fill='x')
+        self.header.config(state='disabled')
+
+        body = ttk.Frame(self.frame)
+        body.pack(fill='both', expand=True)
+        self.vbar = ttk.Scrollbar(body, orient='vertical', command=self._on_vbar)
+        self.vbar.pack(side='right', fill='y')
+        self.text = tk.Text(body, pady=0, **text_opts)
+        self.text.pack(side='left', fill='both', expand=True)
+        self.text.tag_configure('hit', background=self.colors['accent'], foreground=self.colors['bg_card'])
+        self.text.config(state='disabled')
+
+        self.hbar = ttk.Scrollbar(self.frame, orient='horizontal', command=self._on_hbar)
+        self.hbar.pack(fill='x')
+        self.text.config(xscrollcommand=self.hbar.set)
+
+        self.text.bind("<Configure>", lambda e: self._render())
+        self.text.bind("<MouseWheel>", self._on_wheel)
+        self.text.bind("<Button-4>", lambda e: self.scroll_by(-3))
+        self.text.bind("<Button-5>", lambda e: self.scroll_by(3))
+        self.text.bind("<Prior>", lambda e: self.scroll_by(-self.visible_rows()))
+        self.text.bind("<Next>", lambda e: self.scroll_by(self.visible_rows()))
+        self.text.bind("<Up>", lambda e: self.scroll_by(-1))
+        self.text.bind("<Down>", lambda e: self.scroll_by(1))
+        self.text.bind("<Control-Home>", lambda e: self.scroll_to(0))
+        self.text.bind("<Control-End>", lambda e: self.scroll_to(self.total))
+        self.text.bind("<Button-1>", self._on_click)
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    # ------------------------------------------------------------------
+    # 資料來源
+    # ------------------------------------------------------------------
+    def set_source(self, total, row_source, header_lines=()):
+        self.total = total
+        self.row_source = row_source
+        self.first = 0
+        self.highlight_row = None
+        self._set_text(self.header, "\n".join(header_lines))
+        self._render()
+
+    def clear(self):
+        self.set_source(0, None)
+
+    # ------------------------------------------------------------------
+    # 捲動
+    # ------------------------------------------------------------------
+    def visible_rows(self) -> int:
+        height = self.text.winfo_height()
+        return max(1, height // self.font.metrics('linespace'))
+
+    def scroll_to(self, row, highlight=False):
+        n = self.visible_rows()
+        self.first = max(0, min(int(row), self.total - n))
+        self.highlight_row = int(row) if highlight else None
+        self._render()
+
+    def scroll_by(self, rows):
+        self.scroll_to(self.first + rows)
+        return "break"
+
+    def _on_vbar(self, *args):
+        if not self.total: return
+        if args[0] == 'moveto':
+            self.scroll_to(float(args[1]) * self.total)
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            if args[2] == 'pages': step *= self.visible_rows()
+            self.scroll_by(step)
+
+    def _on_hbar(self, *args):
+        self.header.xview(*args)
+        self.text.xview(*args)
+
+    def _on_click(self, event):
+        self.text.focus_set()
+        row = self.first + int(self.text.index(f"@{event.x},{event.y}").split('.')[0]) - 1
+        if not (self.first <= row < min(self.total, self.first + self.visible_rows())): return
+        self.highlight_row = row
+        self._render()
+        if self.select_callback: self.select_callback(row)
+
+    def _on_wheel(self, event):
+        # Windows: delta = ±120 / 格；macOS: ±1
+        step = -int(event.delta / 120) if abs(event.delta) >= 120 else -event.delta
+        return self.scroll_by(step * 3)
+
+    # ------------------------------------------------------------------
+    # 繪製
+    # ------------------------------------------------------------------
+    def _render(self):
+        n = self.visible_rows()
+        if self.total and self.row_source:
+            count = min(n, self.total - self.first)
+            rows = self.row_source(self.first, count)
+        else:
+            count, rows = 0, []
+
+        xview = self.text.xview()[0]
+        self._set_text(self.text, "\n".join(rows))
+        if self.highlight_row is not None and self.first <= self.highlight_row < self.first + count:
+            line = self.highlight_row - self.first + 1
+            self.text.tag_add('hit', f"{line}.0", f"{line}.end")
+        self.text.xview_moveto(xview)
+        self.header.xview_moveto(xview)
+
+        if self.total:
+            self.vbar.set(self.first / self.total, (self.first + count) / self.total)
+        else:
+            self.vbar.set(0.0, 1.0)
+
+    def _set_text(self, widget, content):
+        widget.config(state='normal')
+        widget.delete(1.0, tk.END)
+        widget.insert(tk.END, content)
+        widget.config(state='disabled')
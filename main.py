@@ -11,10 +11,14 @@
 
 import tkinter as tk
 import os
+import multiprocessing
 from tkinterdnd2 import TkinterDnD
 from frontend.app_ui import CAMApp
 
 if __name__ == "__main__":
+    # Required for the parser's process pool in the frozen (PyInstaller) build
+    multiprocessing.freeze_support()
+
     # 1. 抓取 main.py 所在的「絕對路徑」 (這就是您的專案根目錄)
     # 這樣不管您在終端機的哪一層目錄執行，這裡永遠會是對的
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
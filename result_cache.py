@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# Project:      CAM Analyzer
+# File:         result_cache.py
+# Author:       TFC-CRM
+# Created:      2025-12-12
+# Copyright:    (c) 2025 TFC-CRM. All rights reserved.
+# License:      Proprietary / Confidential
+# Description:  Persistent on-disk cache of analysis results.
+#               Arrays are stored as raw .npy files and reopened memory-mapped.
+# ------------------------------------------------------------------------------
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+
+from backend import GCodeAnalyzer, SegmentIndex
+
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+HASH_BLOCK = 4 * 1024 * 1024
+
+
+def default_cache_dir() -> str:
+    """Per-user cache folder (LOCALAPPDATA on Windows, XDG cache elsewhere)."""
+    if os.name == 'nt':
+        root = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'CAM_Analyzer', 'results')
+
+
+def _json_default(obj):
+    # numpy scalars inside stats dicts
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Not JSON serializable: {type(obj).__name__}")
+
+
+class ResultCache:
+    """
+    Stores parse_and_calculate results keyed by file content, engine version
+    and analyzer settings (GCodeAnalyzer.settings_key()).
+
+    Layout:
+        <cache_dir>/entries/<key>/<name>.npy   one file per result array
+        <cache_dir>/entries/<key>/meta.json    scalars, lists and strings
+        <cache_dir>/entries/<key>/stats-<bins>.json  metrics per bin layout
+        <cache_dir>/entries/<key>/density.json       feed / length density map
+        <cache_dir>/entries/<key>/spatial-<name>.npy segment spatial index arrays
+        <cache_dir>/paths/<path hash>.json     (size, mtime) -> content digest
+
+    The mtime of meta.json is the LRU timestamp; entries are evicted oldest
+    first once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.entries_dir = os.path.join(self.cache_dir, 'entries')
+        self.paths_dir = os.path.join(self.cache_dir, 'paths')
+
+    # ------------------------------------------------------------------
+    # Keys
+    # ------------------------------------------------------------------
+    def file_digest(self, file_path: str) -> str:
+        """
+        BLAKE2b of the file content. Remembered per (path, size, mtime), so an
+        unchanged file is identified with a single stat() call.
+        """
+        st = os.stat(file_path)
+        abs_path = os.path.abspath(file_path)
+        memo_path = os.path.join(self.paths_dir, _short_hash(abs_path) + '.json')
+        try:
+            with open(memo_path, 'r', encoding='utf-8') as f:
+                memo = json.load(f)
+            if memo['path'] == abs_path and memo['size'] == st.st_size and memo['mtime_ns'] == st.st_mtime_ns:
+                return memo['digest']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        digest = hash_file(file_path)
+        memo = {'path': abs_path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'digest': digest}
+        _write_json_atomic(memo_path, memo)
+        return digest
+
+    def entry_key(self, digest: str, settings: str = "") -> str:
+        return _short_hash(f"{digest}:{GCodeAnalyzer.ENGINE_VERSION}:{settings}")
+
+    def bins_key(self, bins) -> str:
+        return _short_hash(json.dumps([float(b) for b in bins]))
+
+    # ------------------------------------------------------------------
+    # Results
+    # ------------------------------------------------------------------
+    def load(self, file_path: str, settings: str = "", digest: str = None):
+        """
+        Returns the cached result dict (arrays memory-mapped read-only) or None.
+        digest skips hashing when the caller already knows the content digest.
+        """
+        entry = os.path.join(self.entries_dir, self.entry_key(digest or self.file_digest(file_path), settings))
+        meta_path = os.path.join(entry, 'meta.json')
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            result = dict(meta['values'])
+            for name in meta['arrays']:
+                result[name] = np.load(os.path.join(entry, name + '.npy'), mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return None
+
+        _touch(meta_path)
+        return result
+
+    def load_arrays(self, key: str, names) -> dict:
+        """
+        Memory-maps the named arrays of entry key (see entry_key), e.g. in a
+        process other than the one that found the entry. Raises OSError when
+        the entry has been evicted meanwhile.
+        """
+        entry = os.path.join(self.entries_dir, key)
+        try:
+            return {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in names}
+        except ValueError as e:
+            raise OSError(f"Damaged cache entry {key}: {e}") from e
+
+    def store(self, file_path: str, result: dict, settings: str = "", digest: str = None):
+        """
+        Writes a result dict. Arrays go to .npy files, everything else to meta.json.
+        Returns True when the entry is in the cache afterwards (False: the
+        write failed, or the entry alone exceeds max_bytes and was evicted).
+        """
+        key = self.entry_key(digest or self.file_digest(file_path), settings)
+        entry = os.path.join(self.entries_dir, key)
+        if os.path.isdir(entry):
+            return True
+
+        tmp = os.path.join(self.entries_dir, f".tmp-{key}-{os.getpid()}")
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            arrays, values = [], {}
+            for name, value in result.items():
+                if isinstance(value, np.ndarray):
+                    np.save(os.path.join(tmp, name + '.npy'), value, allow_pickle=False)
+                    arrays.append(name)
+                else:
+                    values[name] = value
+            meta = {
+                'source': os.path.abspath(file_path),
+                'engine': GCodeAnalyzer.ENGINE_VERSION,
+                'settings': settings,
+                'arrays': arrays,
+                'values': values,
+            }
+            with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, default=_json_default)
+            os.replace(tmp, entry)
+        except OSError:
+            # Another process stored the same entry first, or the disk is full
+            shutil.rmtree(tmp, ignore_errors=True)
+            return os.path.isdir(entry)
+
+        self.evict()
+        return os.path.isdir(entry)
+
+    def load_stats(self, file_path: str, bins, settings: str = ""):
+        """
+        Cached calculate_metrics_and_stats output (top10, top3, bpt) for one bin layout.
+        """
+        entry = os.path.join(self.entries_dir, self.entry_key(self.file_digest(file_path), settings))
+        try:
+            with open(os.path.join(entry, f"stats-{self.bins_key(bins)}.json"), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store_stats(self, file_path: str, bins, stats: dict, settings: str = ""):
+        entry = os.path.join(self.entries_dir, self.entry_key(self.file_digest(file_path), settings))
+        if not os.path.isdir(entry):
+            return
+        try:
+            _write_json_atomic(os.path.join(entry, f"stats-{self.bins_key(bins)}.json"), stats)
+        except OSError:
+            pass
+
+    def load_density(self, file_path: str, settings: str = ""):
+        """Cached FeedDensity.to_dict() (independent of the bin layout)."""
+        entry = os.path.join(self.entries_dir, self.entry_key(self.file_digest(file_path), settings))
+        try:
+            with open(os.path.join(entry, "density.json"), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store_density(self, file_path: str, density: dict, settings: str = ""):
+        entry = os.path.join(self.entries_dir, self.entry_key(self.file_digest(file_path), settings))
+        if not os.path.isdir(entry):
+            return
+        try:
+            _write_json_atomic(os.path.join(entry, "density.json"), density)
+        except OSError:
+            pass
+
+    def load_segment_index(self, file_path: str, settings: str = ""):
+        """Cached SegmentIndex.arrays() (memory-mapped) or None."""
+        entry = os.path.join(self.entries_dir, self.entry_key(self.file_digest(file_path), settings))
+        try:
+            return {name: np.load(os.path.join(entry, f"spatial-{name}.npy"), mmap_mode='r')
+                    for name in SegmentIndex.ARRAYS}
+        except (OSError, ValueError):
+            return None
+
+    def store_segment_index(self, file_path: str, arrays: dict, settings: str = ""):
+        entry = os.path.join(self.entries_dir, self.entry_key(self.file_digest(file_path), settings))
+        if not os.path.isdir(entry):
+            return
+        try:
+            for name in arrays:
+                tmp = os.path.join(entry, f".spatial-{name}.{os.getpid()}.npy")
+                np.save(tmp, arrays[name], allow_pickle=False)
+                os.replace(tmp, os.path.join(entry, f"spatial-{name}.npy"))
+        except OSError:
+            pass
+        self.evict()
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+    def _entries(self):
+        """[(last_used, size_bytes, path)] for every complete entry."""
+        out = []
+        try:
+            names = os.listdir(self.entries_dir)
+        except OSError:
+            return out
+        for name in names:
+            path = os.path.join(self.entries_dir, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                last_used = os.path.getmtime(os.path.join(path, 'meta.json'))
+                size = sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+            except OSError:
+                continue
+            out.append((last_used, size, path))
+        return out
+
+    def total_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in max_bytes.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            # Entries still memory-mapped (Windows) cannot be removed; skip them
+            shutil.rmtree(path, ignore_errors=True)
+            if not os.path.exists(path):
+                total -= size
+
+    def clear(self):
+        """
+        Drops every cached result and content digest.
+        """
+        shutil.rmtree(self.entries_dir, ignore_errors=True)
+        shutil.rmtree(self.paths_dir, ignore_errors=True)
+
+
+def content_hasher():
+    """Hash object behind file_digest(), for callers that hash while receiving data."""
+    return hashlib.blake2b(digest_size=20)
+
+
+def hash_file(file_path: str) -> str:
+    """Content digest of a file (no memo; see ResultCache.file_digest)."""
+    h = content_hasher()
+    buf = bytearray(HASH_BLOCK)
+    view = memoryview(buf)
+    with open(file_path, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n: break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def _short_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _touch(path: str):
+    try:
+        now = time.time()
+        os.utime(path, (now, now))
+    except OSError:
+        pass
+
+
+def _write_json_atomic(path: str, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, default=_json_default)
+    os.replace(tmp, path)
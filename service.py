@@ -0,0 +1,513 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# Project:      CAM Analyzer
+# File:         service.py
+# Author:       TFC-CRM
+# Created:      2025-12-12
+# Copyright:    (c) 2025 TFC-CRM. All rights reserved.
+# License:      Proprietary / Confidential
+# Description:  Local HTTP analysis service (python -m backend serve).
+#               asyncio front end, bounded process pool, content-hash cache.
+#               Standard library + numpy only; no Tk, matplotlib or PIL.
+# ------------------------------------------------------------------------------
+"""
+Endpoints (JSON unless noted):
+
+    POST /analyze?name=<file name>&compact=1&bins=0,0.01,0.1,inf   (PUT also works)
+         body = the NC program (Content-Length or chunked)
+         -> the batch report of the file plus 'digest' (content hash)
+    GET  /results/<digest>[?compact=1&bins=...]   report of an earlier upload
+    GET  /results/<digest>/arrays[?compact=1]     per-segment arrays as .npz
+         (np.load(); scalar values are JSON in the 'meta' entry)
+    GET  /metrics                                 queue, throughput, latency
+    GET  /health
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import multiprocessing
+import argparse
+import tempfile
+from http import HTTPStatus
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from backend import GCodeAnalyzer, DEFAULT_INTERVALS
+from result_cache import ResultCache, default_cache_dir, content_hasher, DEFAULT_MAX_BYTES
+from batch import build_report, parse_edges
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_UPLOAD = 2 * 1024 ** 3
+# Uploaded programs kept for /results and /arrays (oldest removed first)
+DEFAULT_UPLOAD_BYTES = 4 * 1024 ** 3
+IO_BLOCK = 1024 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+LATENCY_WINDOW = 1000
+SUMMARY_CACHE_SIZE = 256
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{40}$')
+
+
+def default_data_dir() -> str:
+    return os.path.join(os.path.dirname(default_cache_dir()), 'service')
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+# ------------------------------------------------------------------------------
+# Pool job
+# ------------------------------------------------------------------------------
+def _analysis_job(upload_path, digest, intervals, compact, cache_dir, cache_max_bytes):
+    """
+    Runs in a pool process. Arrays stay in the on-disk result cache; only
+    the small report crosses back to the server.
+    """
+    engine = GCodeAnalyzer()
+    engine.compact_results = compact
+    settings = engine.settings_key()
+    cache = ResultCache(cache_dir, cache_max_bytes)
+    start = time.perf_counter()
+    try:
+        data = cache.load(upload_path, settings, digest=digest)
+    except OSError:
+        data = None
+    cached = data is not None
+    if data is None:
+        data = engine.parse_file(upload_path)
+        try:
+            cache.store(upload_path, data, settings, digest=digest)
+        except OSError:
+            pass  # caching is best effort
+    stats = engine.compute_stats(data, intervals)
+    report = build_report(upload_path, data, stats, time.perf_counter() - start)
+    report['cached'] = cached
+    return report
+
+
+# ------------------------------------------------------------------------------
+# Metrics
+# ------------------------------------------------------------------------------
+class ServiceMetrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.analyses = 0
+        self.failures = 0
+        self.rejected = 0
+        self.cache_hits = 0
+        self.bytes_parsed = 0
+        self.parse_seconds = 0.0
+        self.pending = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def snapshot(self, workers: int, max_queue: int) -> dict:
+        uptime = time.monotonic() - self.started
+        latency = {'count': len(self.latencies)}
+        if self.latencies:
+            values = np.asarray(self.latencies) * 1000
+            for p in (50, 90, 99):
+                latency[f"p{p}"] = round(float(np.percentile(values, p)), 1)
+        return {
+            'uptime_s': round(uptime, 1),
+            'workers': workers,
+            'running': min(self.pending, workers),
+            'queue_depth': max(0, self.pending - workers),
+            'queue_limit': max_queue,
+            'requests': self.requests,
+            'analyses': self.analyses,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'cache_hits': self.cache_hits,
+            'bytes_parsed': self.bytes_parsed,
+            'parse_mb_per_s': round(self.bytes_parsed / 1e6 / self.parse_seconds, 2) if self.parse_seconds else None,
+            'analyses_per_min': round(self.analyses / uptime * 60, 2) if uptime else None,
+            'analyze_latency_ms': latency,
+        }
+
+
+# ------------------------------------------------------------------------------
+# Service
+# ------------------------------------------------------------------------------
+class AnalysisService:
+    """
+    One asyncio server, one process pool. Uploads are streamed to
+    <data_dir>/uploads/<digest>.nc while hashed; results are cached per
+    content hash and settings in <data_dir>/cache (ResultCache layout).
+    At most workers + max_queue analyses are accepted; more get 503.
+    """
+
+    def __init__(self, data_dir=None, workers=None, max_queue=None, max_upload=DEFAULT_MAX_UPLOAD,
+                 upload_bytes=DEFAULT_UPLOAD_BYTES, cache_max_bytes=DEFAULT_MAX_BYTES, log=True):
+        self.data_dir = data_dir or default_data_dir()
+        self.uploads_dir = os.path.join(self.data_dir, 'uploads')
+        self.cache = ResultCache(os.path.join(self.data_dir, 'cache'), cache_max_bytes)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = self.workers * 4 if max_queue is None else max_queue
+        self.max_upload = max_upload
+        self.upload_bytes = upload_bytes
+        self.log = log
+        self.metrics = ServiceMetrics()
+        self.summaries = OrderedDict()
+        self.names = {}
+        self.inflight = {}
+        self.executor = None
+        self.server = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        # Workers start lazily inside the event loop: forked ones would inherit
+        # the listening socket and any open client connection
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        self.server = await asyncio.start_server(self._handle, host, port, limit=MAX_HEADER_BYTES)
+        return self.server
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # ------------------------------------------------------------------
+    # HTTP plumbing
+    # ------------------------------------------------------------------
+    async def _handle(self, reader, writer):
+        start = time.perf_counter()
+        method, target, status = "-", "-", 500
+        try:
+            try:
+                method, target, headers = await self._read_head(reader)
+                self.metrics.requests += 1
+                status = await self._dispatch(method, target, headers, reader, writer)
+            except HTTPError as e:
+                status = e.status
+                await self._send_json(writer, e.status, {'error': str(e)}, e.headers)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                status = 499  # client went away
+            except Exception as e:
+                status = 500
+                await self._send_json(writer, 500, {'error': f"{type(e).__name__}: {e}"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+        if self.log:
+            peer = writer.get_extra_info('peername')
+            host = peer[0] if peer else '-'
+            print(f'{host} "{method} {target}" {status} {(time.perf_counter() - start) * 1000:.0f}ms',
+                  file=sys.stderr)
+
+    async def _read_head(self, reader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431, "Request header too large")
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return method.upper(), target, headers
+
+    async def _send(self, writer, status: int, body: bytes, content_type: str, headers=None):
+        await self._send_head(writer, status, len(body), content_type, headers)
+        writer.write(body)
+        await writer.drain()
+
+    async def _send_head(self, writer, status, length, content_type, headers=None):
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+                 f"Content-Type: {content_type}",
+                 f"Content-Length: {length}",
+                 "Connection: close"]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+
+    async def _send_json(self, writer, status, obj, headers=None):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        await self._send(writer, status, body, "application/json; charset=utf-8", headers)
+
+    async def _send_file(self, writer, path, content_type, headers=None):
+        size = os.path.getsize(path)
+        await self._send_head(writer, 200, size, content_type, headers)
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(IO_BLOCK)
+                if not block: break
+                writer.write(block)
+                await writer.drain()
+
+    async def _read_body(self, reader, writer, headers):
+        """Yields the request body in blocks (Content-Length or chunked)."""
+        if headers.get('expect', '').lower() == '100-continue':
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            while True:
+                size_line = await reader.readuntil(b'\r\n')
+                try:
+                    size = int(size_line.split(b';', 1)[0], 16)
+                except ValueError:
+                    raise HTTPError(400, "Malformed chunk size")
+                if size == 0:
+                    # Optional trailer fields, then the final empty line
+                    while await reader.readuntil(b'\r\n') != b'\r\n':
+                        pass
+                    return
+                while size:
+                    block = await reader.readexactly(min(size, IO_BLOCK))
+                    size -= len(block)
+                    yield block
+                await reader.readexactly(2)
+        else:
+            try:
+                remaining = int(headers['content-length'])
+            except (KeyError, ValueError):
+                raise HTTPError(411, "Content-Length or chunked transfer encoding required")
+            while remaining > 0:
+                block = await reader.readexactly(min(remaining, IO_BLOCK))
+                remaining -= len(block)
+                yield block
+
+    # ------------------------------------------------------------------
+    # Routing
+    # ------------------------------------------------------------------
+    async def _dispatch(self, method, target, headers, reader, writer) -> int:
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split('/') if p]
+
+        if parts == ['health']:
+            self._require(method, 'GET')
+            await self._send_json(writer, 200, {'status': 'ok', 'engine_version': GCodeAnalyzer.ENGINE_VERSION})
+        elif parts == ['metrics']:
+            self._require(method, 'GET')
+            await self._send_json(writer, 200, self.metrics.snapshot(self.workers, self.max_queue))
+        elif parts == ['analyze']:
+            self._require(method, 'POST', 'PUT')
+            start = time.perf_counter()
+            report = await self._analyze_upload(query, headers, reader, writer)
+            self.metrics.latencies.append(time.perf_counter() - start)
+            await self._send_json(writer, 200, report)
+        elif len(parts) == 2 and parts[0] == 'results':
+            self._require(method, 'GET')
+            report = await self._analyze_stored(parts[1], query)
+            await self._send_json(writer, 200, report)
+        elif len(parts) == 3 and parts[0] == 'results' and parts[2] == 'arrays':
+            self._require(method, 'GET')
+            await self._send_arrays(writer, parts[1], query)
+        else:
+            raise HTTPError(404, f"No such endpoint: {url.path}")
+        return 200
+
+    def _require(self, method, *allowed):
+        if method not in allowed:
+            raise HTTPError(405, f"Use {' or '.join(allowed)}", {'Allow': ', '.join(allowed)})
+
+    def _options(self, query):
+        compact = query.get('compact', '0').lower() in ('1', 'true', 'yes')
+        if 'bins' in query:
+            try:
+                intervals = parse_edges(query['bins'])
+            except argparse.ArgumentTypeError as e:
+                raise HTTPError(400, str(e))
+        else:
+            intervals = list(DEFAULT_INTERVALS)
+        return compact, intervals
+
+    def _upload_path(self, digest):
+        if not DIGEST_RE.match(digest):
+            raise HTTPError(404, "Unknown result")
+        path = os.path.join(self.uploads_dir, digest + '.nc')
+        if not os.path.isfile(path):
+            raise HTTPError(404, "Unknown result (upload the program again)")
+        return path
+
+    # ------------------------------------------------------------------
+    # Handlers
+    # ------------------------------------------------------------------
+    async def _analyze_upload(self, query, headers, reader, writer):
+        compact, intervals = self._options(query)
+        length = headers.get('content-length')
+        if length is not None and length.isdigit() and int(length) > self.max_upload:
+            raise HTTPError(413, f"Upload larger than {self.max_upload} bytes")
+        # Refuse before reading the body when nothing could take the job
+        if self.metrics.pending >= self.workers + self.max_queue:
+            self.metrics.rejected += 1
+            raise HTTPError(503, "Analysis queue is full", {'Retry-After': '5'})
+
+        path, digest, size = await self._receive_upload(reader, writer, headers)
+        if query.get('name'):
+            self.names[digest] = query['name']
+        report = await self._run(path, digest, size, intervals, compact)
+        return dict(report, file=self.names.get(digest, digest + '.nc'), digest=digest)
+
+    async def _analyze_stored(self, digest, query):
+        compact, intervals = self._options(query)
+        path = self._upload_path(digest)
+        report = await self._run(path, digest, os.path.getsize(path), intervals, compact)
+        return dict(report, file=self.names.get(digest, digest + '.nc'), digest=digest)
+
+    async def _receive_upload(self, reader, writer, headers):
+        """Streams the body to a temp file while hashing; renamed to <digest>.nc."""
+        fd, tmp = tempfile.mkstemp(dir=self.uploads_dir, prefix='.upload-')
+        hasher = content_hasher()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                async for block in self._read_body(reader, writer, headers):
+                    size += len(block)
+                    if size > self.max_upload:
+                        raise HTTPError(413, f"Upload larger than {self.max_upload} bytes")
+                    hasher.update(block)
+                    f.write(block)
+            digest = hasher.hexdigest()
+            path = os.path.join(self.uploads_dir, digest + '.nc')
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self._evict_uploads(keep=path)
+        return path, digest, size
+
+    async def _run(self, path, digest, size, intervals, compact):
+        """Report for one program; identical concurrent requests share one job."""
+        key = (digest, compact, tuple(intervals))
+        if key in self.summaries:
+            self.summaries.move_to_end(key)
+            self.metrics.cache_hits += 1
+            return dict(self.summaries[key], cached=True)
+        if key in self.inflight:
+            return await asyncio.shield(self.inflight[key])
+        if self.metrics.pending >= self.workers + self.max_queue:
+            self.metrics.rejected += 1
+            raise HTTPError(503, "Analysis queue is full", {'Retry-After': '5'})
+
+        loop = asyncio.get_running_loop()
+        job = loop.run_in_executor(self.executor, _analysis_job, path, digest, intervals, compact,
+                                   self.cache.cache_dir, self.cache.max_bytes)
+        self.inflight[key] = job
+        self.metrics.pending += 1
+        try:
+            report = await asyncio.shield(job)
+        except Exception as e:
+            self.metrics.failures += 1
+            raise HTTPError(422, f"Analysis failed: {type(e).__name__}: {e}")
+        finally:
+            self.metrics.pending -= 1
+            del self.inflight[key]
+
+        self.metrics.analyses += 1
+        if report['cached']:
+            self.metrics.cache_hits += 1
+        else:
+            self.metrics.bytes_parsed += size
+            self.metrics.parse_seconds += report['elapsed_s']
+        self.summaries[key] = report
+        if len(self.summaries) > SUMMARY_CACHE_SIZE:
+            self.summaries.popitem(last=False)
+        return report
+
+    async def _send_arrays(self, writer, digest, query):
+        compact, intervals = self._options(query)
+        path = self._upload_path(digest)
+        engine = GCodeAnalyzer()
+        engine.compact_results = compact
+        settings = engine.settings_key()
+
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self.cache.load, path, settings, digest)
+        if data is None:
+            # Not analyzed with these settings yet (or evicted): run it through the pool
+            await self._run(path, digest, os.path.getsize(path), intervals, compact)
+            data = await loop.run_in_executor(None, self.cache.load, path, settings, digest)
+            if data is None:
+                raise HTTPError(500, "Result could not be cached")
+
+        fd, tmp = tempfile.mkstemp(dir=self.uploads_dir, prefix='.arrays-', suffix='.npz')
+        os.close(fd)
+        try:
+            await loop.run_in_executor(None, _write_npz, tmp, data)
+            await self._send_file(writer, tmp, "application/octet-stream",
+                                  {'Content-Disposition': f'attachment; filename="{digest}.npz"'})
+        finally:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _evict_uploads(self, keep):
+        """Removes the oldest uploads once they exceed upload_bytes."""
+        entries = []
+        for e in os.scandir(self.uploads_dir):
+            if e.is_file() and not e.name.startswith('.'):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        busy = {key[0] for key in self.inflight}
+        for _, size, path in sorted(entries):
+            if total <= self.upload_bytes:
+                break
+            if path == keep or os.path.basename(path)[:-3] in busy:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def _write_npz(path, data):
+    arrays = {k: np.asarray(v) for k, v in data.items() if isinstance(v, np.ndarray)}
+    meta = {k: v for k, v in data.items() if not isinstance(v, np.ndarray)}
+    # A unicode array, so np.load works without allow_pickle
+    arrays['meta'] = np.array(json.dumps(meta, ensure_ascii=False, default=float))
+    np.savez(path, **arrays)
+
+
+# ------------------------------------------------------------------------------
+# Entry point
+# ------------------------------------------------------------------------------
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, **options) -> int:
+    service = AnalysisService(**options)
+
+    async def run():
+        await service.start(host, port)
+        bound_host, bound_port = service.address
+        print(f"CAM Analyzer service on http://{bound_host}:{bound_port} "
+              f"({service.workers} workers, data in {service.data_dir})", file=sys.stderr)
+        try:
+            await service.server.serve_forever()
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
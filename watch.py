@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------------------------------------
+# Project:      CAM Analyzer
+# File:         watch.py
+# Author:       TFC-CRM
+# Created:      2025-12-12
+# Copyright:    (c) 2025 TFC-CRM. All rights reserved.
+# License:      Proprietary / Confidential
+# Description:  Watch-folder daemon (python -m backend watch <folder>).
+#               Analyzes new or changed programs in a process pool and
+#               writes <program>.cam.json beside each of them.
+#               Only the engine is imported: no Tk, matplotlib or PIL.
+# ------------------------------------------------------------------------------
+"""
+A program is analyzed once its size and mtime have stopped changing for
+`settle` seconds (post-processors write files in several steps). The
+summary records the (size, mtime, content digest) it was made from, so a
+restart only stat()s the folder: files whose stamp still matches are
+skipped, files that were touched but not changed are re-hashed (in the
+pool) and skipped, everything else is analyzed again.
+"""
+
+import os
+import sys
+import json
+import time
+import fnmatch
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from backend import GCodeAnalyzer, DEFAULT_INTERVALS
+from batch import analyze_file, _json_safe
+from result_cache import hash_file
+
+SUMMARY_SUFFIX = ".cam.json"
+DEFAULT_PATTERNS = ("*.txt", "*.nc", "*.ncd", "*.tap")
+DEFAULT_POLL = 1.0
+DEFAULT_SETTLE = 2.0
+
+
+def settings_key(intervals, compact) -> str:
+    """Summaries made with other bins, layout or engine version are redone."""
+    edges = [s for s, _ in intervals] + [intervals[-1][1]]
+    return json.dumps([GCodeAnalyzer.ENGINE_VERSION, bool(compact), _json_safe(edges)])
+
+
+# ------------------------------------------------------------------------------
+# Pool job
+# ------------------------------------------------------------------------------
+def _watch_job(path, known_digest, intervals, compact):
+    """
+    Hashes the file first: a touched but unchanged program costs one read
+    instead of a parse. Failures become error summaries.
+    """
+    abs_path = os.path.abspath(path)
+    try:
+        digest = hash_file(path)
+        if digest == known_digest:
+            return {'file': abs_path, 'status': 'unchanged', 'digest': digest}
+        report = analyze_file(path, intervals, compact)
+    except Exception as e:
+        digest = None
+        report = {'file': abs_path, 'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+    report['digest'] = digest
+    return report
+
+
+# ------------------------------------------------------------------------------
+# Watcher
+# ------------------------------------------------------------------------------
+class FolderWatcher:
+    """
+    Polls one folder (optionally recursive) with os.scandir. Polling works
+    the same on local disks and SMB shares, where change notifications are
+    unreliable, and a scan of a few thousand entries takes milliseconds.
+
+    State per program path:
+        done      stamp (size, mtime_ns) the current summary was made from
+        settling  stamp seen at the last poll, waiting to become stable
+        running   stamp submitted to the pool
+    Ready files wait in a FIFO queue; at most 2 x jobs are handed to the
+    pool at once so a burst does not pin stale work in the executor.
+    """
+
+    def __init__(self, folder, patterns=DEFAULT_PATTERNS, recursive=False, out_dir=None, jobs=None,
+                 intervals=None, compact=False, settle=DEFAULT_SETTLE, poll=DEFAULT_POLL, log=True):
+        self.folder = os.path.abspath(folder)
+        self.patterns = [p.lower() for p in patterns]
+        self.recursive = recursive
+        self.out_dir = os.path.abspath(out_dir) if out_dir else None
+        self.jobs = jobs or os.cpu_count() or 1
+        self.intervals = list(intervals or DEFAULT_INTERVALS)
+        self.compact = compact
+        self.settle = settle
+        self.poll = poll
+        self.log = log
+        self.settings = settings_key(self.intervals, compact)
+
+        self.done = {}
+        self.settling = {}
+        self.running = {}
+        self.queue = deque()
+        self.queued = set()
+        self.counts = {'ok': 0, 'error': 0, 'unchanged': 0}
+
+    # ------------------------------------------------------------------
+    # Folder scan
+    # ------------------------------------------------------------------
+    def summary_path(self, path: str) -> str:
+        if self.out_dir is None:
+            return path + SUMMARY_SUFFIX
+        return os.path.join(self.out_dir, os.path.relpath(path, self.folder) + SUMMARY_SUFFIX)
+
+    def _matches(self, name: str) -> bool:
+        lower = name.lower()
+        return not lower.endswith(SUMMARY_SUFFIX) and any(fnmatch.fnmatch(lower, p) for p in self.patterns)
+
+    def scan(self) -> dict:
+        """path -> (size, mtime_ns) of every matching program."""
+        found = {}
+        stack = [self.folder]
+        while stack:
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with it:
+                for e in it:
+                    try:
+                        if e.is_dir():
+                            if self.recursive and not e.name.startswith('.'):
+                                stack.append(e.path)
+                        elif e.is_file() and self._matches(e.name):
+                            st = e.stat()
+                            found[e.path] = (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue  # removed while scanning
+        return found
+
+    def _read_summary(self, path: str):
+        try:
+            with open(self.summary_path(path), 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+            return summary if summary.get('watch', {}).get('settings') == self.settings else None
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    # ------------------------------------------------------------------
+    # One poll
+    # ------------------------------------------------------------------
+    def poll_once(self, executor):
+        """Collects finished jobs, finds settled files and submits them."""
+        for fut in [f for f in self.running if f.done()]:
+            path, stamp = self.running.pop(fut)
+            self._finish(path, stamp, fut.result())
+
+        found = self.scan()
+        busy = {path for path, _ in self.running.values()}
+        now_ns = time.time_ns()
+        for path, stamp in found.items():
+            if path in busy or path in self.queued or self.done.get(path) == stamp:
+                continue
+            if path not in self.done:
+                # First sight (e.g. after a restart): trust a summary with the same stamp
+                summary = self._read_summary(path)
+                watch = summary['watch'] if summary else {}
+                if (watch.get('size'), watch.get('mtime_ns')) == stamp:
+                    self.done[path] = stamp
+                    continue
+            # Stable = same stamp as the previous poll and not written to for `settle` seconds
+            if self.settling.get(path) != stamp:
+                self.settling[path] = stamp
+                continue
+            if now_ns - stamp[1] < self.settle * 1e9:
+                continue
+            del self.settling[path]
+            self.queue.append(path)
+            self.queued.add(path)
+
+        for path in [p for p in self.settling if p not in found]:
+            del self.settling[path]
+        for path in [p for p in self.done if p not in found]:
+            del self.done[path]
+
+        while self.queue and len(self.running) < 2 * self.jobs:
+            path = self.queue.popleft()
+            self.queued.discard(path)
+            stamp = found.get(path)
+            if stamp is None:
+                continue  # deleted while queued
+            summary = self._read_summary(path)
+            known = summary['watch'].get('digest') if summary else None
+            fut = executor.submit(_watch_job, path, known, self.intervals, self.compact)
+            self.running[fut] = (path, stamp)
+
+    def _finish(self, path, stamp, report):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return  # deleted meanwhile
+        if (st.st_size, st.st_mtime_ns) != stamp:
+            return  # rewritten during the analysis: the next poll picks it up again
+
+        status = report['status']
+        if status == 'unchanged':
+            summary = self._read_summary(path)
+            if summary is None:
+                return
+        else:
+            summary = report
+        summary['watch'] = {'size': stamp[0], 'mtime_ns': stamp[1], 'digest': report['digest'],
+                            'settings': self.settings}
+        try:
+            self._write_summary(path, summary)
+        except OSError as e:
+            self._print(f"{path}: cannot write summary ({e})")
+            return
+        self.done[path] = stamp
+        self.counts[status] += 1
+        if status == 'ok':
+            self._print(f"{path}: ok ({report['elapsed_s']:.2f}s, {report['total_lines']} lines)")
+        elif status == 'error':
+            self._print(f"{path}: error ({report['error']})")
+
+    def _write_summary(self, path, summary):
+        target = self.summary_path(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, target)
+
+    def _print(self, text):
+        if self.log:
+            print(f"{time.strftime('%H:%M:%S')} {text}", file=sys.stderr)
+
+    @property
+    def idle(self) -> bool:
+        return not (self.running or self.queue or self.settling)
+
+    # ------------------------------------------------------------------
+    # Main loop
+    # ------------------------------------------------------------------
+    def run(self, once=False):
+        """
+        Polls until interrupted. once: stops as soon as every program found
+        has an up-to-date summary (files still being written are waited for).
+        """
+        self._print(f"Watching {self.folder} ({self.jobs} workers, every {self.poll:g}s)")
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            try:
+                while True:
+                    self.poll_once(executor)
+                    if once and self.idle:
+                        break
+                    # Wakes early when a job finishes so the next file starts at once
+                    wait(list(self.running), timeout=self.poll, return_when=FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._print("Stopped.")
+                return 130 if once else 0
+        return 0 if not self.counts['error'] else 1